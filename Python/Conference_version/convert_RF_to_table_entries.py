@@ -8,6 +8,7 @@ from sklearn import tree
 import re
 from statistics import mode
 import random
+from itertools import product
 
 np.random.seed(42)
 
@@ -18,7 +19,18 @@ clf = pd.read_pickle('unsw_per_flow_saved_model_16_classes.sav') ## replace with
 feature_names = clf.feature_names_in_
 print(feature_names)
 
+num_of_trees = len(clf.estimators_)
+num_of_classes = len(clf.classes_)
+
 ## definition of useful functions
+## get the class voted by the majority of the trees, ties are broken at random
+def majority_vote(votes):
+    counts = [votes.count(vote) for vote in votes]
+    tied = [vote for vote, count in zip(votes, counts) if count == max(counts)]
+    if len(set(tied)) > 1:
+        return np.random.choice(tied)
+    return mode(votes)
+
 ## gets all splits and conditions
 def get_splits(forest, feature_names):
     data = []
@@ -250,35 +262,32 @@ for qsfp_cage in [1, 5]:
             print("table_feature"+str(num_feat)+" = p4.Ingress.table_feature"+str(num_feat), file=entries_file)
     print('', file=entries_file)
 
-    for num_tree in range(len(clf.estimators_)):
+    for num_tree in range(num_of_trees):
         print("code_table"+str(num_tree)+" = p4.Ingress.code_table"+str(num_tree), file=entries_file)
     print('', file=entries_file)
 
     # Get entries for feature tables
-    tree_code0 = []
-    tree_code1 = []
-    tree_code2 = []
+    tree_code_sizes = [[] for tree_id in range(num_of_trees)]
 
     for fea in range(0,len(feature_names)):
-        Ranges, Codes = get_feature_codes_with_ranges(get_feature_table(get_splits(clf, feature_names), feature_names[fea]), len(clf.estimators_))
-        for ran, cods0, cods1, cods2 in zip(Ranges, Codes.iloc[:,0], Codes.iloc[:,1], Codes.iloc[:,2]):
+        Ranges, Codes = get_feature_codes_with_ranges(get_feature_table(get_splits(clf, feature_names), feature_names[fea]), num_of_trees)
+        for ran, cods in zip(Ranges, Codes.values.tolist()):
+            codes = ", ".join("code"+str(tree_id)+"="+str(cods[tree_id]) for tree_id in range(num_of_trees))
             if(ran == Ranges[len(Ranges)-1]):
                 print("table_feature"+str(fea)+".add_with_SetCode"+str(fea)+"(feature"+str(fea)+"_start="+str(ran.split(",")[0])+ \
-                ", feature"+str(fea)+"_end="+str(65535)+", code0="+str(cods0) + ", code1=" + str(cods1) + ", code2=" + str(cods2) + ")", file = entries_file)
+                ", feature"+str(fea)+"_end="+str(65535)+", "+codes+")", file = entries_file)
             else:
                 print("table_feature"+str(fea)+".add_with_SetCode"+str(fea)+"(feature"+str(fea)+"_start="+str(ran.split(",")[0])+ \
-                ", feature"+str(fea)+"_end="+str(ran.split(",")[1])+", code0="+str(cods0)+", code1="+str(cods1)+", code2=" +str(cods2) + ")", file = entries_file)
-        tree_code0.append(len(cods0)-2)
-        tree_code1.append(len(cods1)-2)
-        tree_code2.append(len(cods2)-2)
+                ", feature"+str(fea)+"_end="+str(ran.split(",")[1])+", "+codes+")", file = entries_file)
+        for tree_id in range(num_of_trees):
+            tree_code_sizes[tree_id].append(len(cods[tree_id])-2)
 
         print('', file=entries_file)
-    tree_code_sizes = [tree_code0, tree_code1, tree_code2]
     print(tree_code_sizes)
 
     print('print("******************* ENTERED FEATURE TABLE RULES *****************")\n',  file=entries_file)
 
-    for tree_id in range(0, len(clf.estimators_)):
+    for tree_id in range(0, num_of_trees):
         Final_Codes, Final_Masks = get_codes_and_masks(clf.estimators_[tree_id], feature_names)
         Classe, Certain = get_classes(clf.estimators_[tree_id])
         for cod, mas, cla, cer in zip(Final_Codes, Final_Masks, Classe, Certain):
@@ -286,16 +295,10 @@ for qsfp_cage in [1, 5]:
         print('', file=entries_file)
 
     # Get voting table entries
-    # This loop should be modified depending on number of trees (i, j, k for 3 trees) and number of classes (1 to 17 for 16 classes)
-    for i in range(1,17):
-        for j in range(1,17):
-            for k in range(1,17):
-                if ((i!=j) & (j!=k) & (i!=k)):
-                    print("voting_table.add_with_set_final_class("+"class0="+str(i)+ \
-                          ", class1="+str(j)+", class2="+str(k)+", class_result="+str(np.random.choice([i, j, k]))+")", file=entries_file)
-                else:
-                    print("voting_table.add_with_set_final_class("+"class0="+str(i)+", class1="+str(j)+\
-                          ", class2="+str(k)+", class_result="+str(mode([i, j, k]))+")", file=entries_file)
+    # One entry per combination of the classes voted by the trees
+    for votes in product(range(1, num_of_classes+1), repeat=num_of_trees):
+        classes = ", ".join("class"+str(tree_id)+"="+str(vote) for tree_id, vote in enumerate(votes))
+        print("voting_table.add_with_set_final_class("+classes+", class_result="+str(majority_vote(list(votes)))+")", file=entries_file)
 
     print("bfrt.complete_operations()", file=entries_file)
 
@@ -0,0 +1,185 @@
+## Benchmark of the table entry compiler on synthetic forests.
+## usage: python3 benchmark_compiler.py REPORT.json [TREES] [DEPTHS] [FEATURES] [CLASSES] [BASELINE.json]
+##        e.g. python3 benchmark_compiler.py bench.json 1,3,5 5,10,20 5,10 2,16 bench_main.json
+## A RandomForestClassifier is trained for every combination of number of trees,
+## maximum depth, number of features and classes, on random integer features
+## (16-bit values, like the packet features). Every stage of the compiler is
+## timed and, in a second run under tracemalloc, its peak memory is measured:
+##  - get_splits, get_feature_table (all features), get_feature_codes_with_ranges,
+##  - get_codes_and_masks and get_classes (all trees, in this process), compile_trees,
+##  - voting generation (ternary voting table),
+##  - file emission (entries artifact and bfrt_python voting entries).
+## The report is a json file with the environment, the times, peak memories and
+## entry counts of every model. With a baseline report, the stages slower than
+## REGRESSION_TOLERANCE times the baseline are listed and the exit status is 1.
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import tracemalloc
+from itertools import product
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+from rf_compiler import get_splits, get_feature_table, get_feature_codes_with_ranges, get_codes_and_masks, \
+    get_classes, compile_trees, get_codeword_width
+from voting_compiler import get_voting_entries, write_voting_entries
+from entries_artifact import get_feature_table_entries, get_code_table_entries, get_voting_table_entries, save_entries
+
+## rows of the training set of every model
+NUM_OF_SAMPLES = 20000
+## largest value of the features (16-bit fields)
+MAX_FEATURE_VALUE = 65535
+## a stage is a regression when it is this many times slower than the baseline
+REGRESSION_TOLERANCE = 1.25
+## stages shorter than this in the baseline are not compared (seconds)
+MIN_COMPARED_SECONDS = 0.01
+## grid of models by default
+DEFAULT_GRID = {"trees": [1, 3, 5], "depths": [5, 10, 20], "features": [5, 10], "classes": [2, 16]}
+
+## a forest trained on random integer features, the class depending on a few of them
+def get_synthetic_forest(num_of_trees, max_depth, num_of_features, num_of_classes, seed=42):
+    rng = np.random.RandomState(seed)
+    features = pd.DataFrame(rng.randint(0, MAX_FEATURE_VALUE + 1, size=(NUM_OF_SAMPLES, num_of_features)),
+                            columns=["feature"+str(fea) for fea in range(num_of_features)])
+    weights = rng.randint(1, 1000, size=num_of_features)
+    labels = (features.values // weights).sum(axis=1) % num_of_classes
+    # some noise so that the deep trees do not stop early
+    noisy = rng.rand(NUM_OF_SAMPLES) < 0.1
+    labels[noisy] = rng.randint(0, num_of_classes, noisy.sum())
+    return RandomForestClassifier(n_estimators=num_of_trees, max_depth=max_depth, random_state=seed).fit(features, labels)
+
+## the stages of the compiler, run in order on a forest; every stage adds its
+## results to the state, where the next stages find them
+def run_get_splits(state):
+    state["splits"] = get_splits(state["clf"], state["feature_names"])
+
+def run_get_feature_table(state):
+    state["feature_tables"] = [get_feature_table(state["splits"], name, state["num_of_trees"])
+                               for name in state["feature_names"]]
+
+def run_get_feature_codes_with_ranges(state):
+    state["ranges"] = [get_feature_codes_with_ranges(feature_table, state["num_of_trees"])
+                       for feature_table in state["feature_tables"]]
+
+def run_get_codes_and_masks(state):
+    state["codes"] = [get_codes_and_masks(estimator, state["feature_names"]) for estimator in state["clf"].estimators_]
+
+def run_get_classes(state):
+    state["classes"] = [get_classes(estimator, state["feature_names"]) for estimator in state["clf"].estimators_]
+
+def run_compile_trees(state):
+    state["leaves"] = compile_trees(state["clf"], state["feature_names"])
+
+def run_voting(state):
+    state["voting_entries"] = list(get_voting_entries(state["num_of_trees"], state["num_of_classes"], ternary=True))
+
+def run_emission(state):
+    tables = [get_feature_table_entries(fea, feature_table, state["num_of_trees"])
+              for fea, feature_table in enumerate(state["feature_tables"])]
+    tables += [get_code_table_entries(tree_id, leaves) for tree_id, leaves in enumerate(state["leaves"])]
+    tables.append(get_voting_table_entries(state["voting_entries"], state["num_of_trees"], ternary=True))
+    with tempfile.TemporaryDirectory() as directory:
+        save_entries(os.path.join(directory, "entries.npz"), tables)
+        with open(os.path.join(directory, "entries.py"), "w") as entries_file:
+            write_voting_entries(entries_file, state["voting_entries"], ternary=True)
+
+STAGES = [("get_splits", run_get_splits), ("get_feature_table", run_get_feature_table),
+          ("get_feature_codes_with_ranges", run_get_feature_codes_with_ranges),
+          ("get_codes_and_masks", run_get_codes_and_masks), ("get_classes", run_get_classes),
+          ("compile_trees", run_compile_trees), ("voting", run_voting), ("emission", run_emission)]
+
+## run the stages on a forest, timed, or with the peak memory of every stage
+def run_stages(clf, trace_memory=False):
+    state = {"clf": clf, "feature_names": list(clf.feature_names_in_), "num_of_trees": len(clf.estimators_),
+             "num_of_classes": len(clf.classes_)}
+    measures = {}
+    for name, stage in STAGES:
+        if trace_memory:
+            tracemalloc.start()
+            stage(state)
+            measures[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            stage(state)
+            measures[name] = time.perf_counter() - start
+    return measures, state
+
+## entries and sizes of the compiled model
+def get_entry_counts(state):
+    return {"feature_table_entries": sum(len(feature_table["Threshold"]) for feature_table in state["feature_tables"]),
+            "code_table_entries": sum(len(leaves) for leaves in state["leaves"]),
+            "voting_table_entries": len(state["voting_entries"]),
+            "codeword_bits": sum(get_codeword_width(estimator) for estimator in state["clf"].estimators_),
+            "splits": len(state["splits"])}
+
+## benchmark of one model of the grid
+def benchmark_model(num_of_trees, max_depth, num_of_features, num_of_classes):
+    start = time.perf_counter()
+    clf = get_synthetic_forest(num_of_trees, max_depth, num_of_features, num_of_classes)
+    train_seconds = time.perf_counter() - start
+    seconds, state = run_stages(clf)
+    peak_bytes, _ = run_stages(clf, trace_memory=True)
+    return {"trees": num_of_trees, "max_depth": max_depth, "features": num_of_features, "classes": num_of_classes,
+            "train_seconds": train_seconds, "seconds": seconds, "total_seconds": sum(seconds.values()),
+            "peak_bytes": peak_bytes, "max_peak_bytes": max(peak_bytes.values()), **get_entry_counts(state)}
+
+## versions and machine the benchmark ran on
+def get_environment():
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "sklearn": sklearn.__version__, "machine": platform.machine(), "cpus": os.cpu_count(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+## benchmark every model of the grid
+def run_benchmark(grid=DEFAULT_GRID):
+    results = []
+    for config in product(grid["trees"], grid["depths"], grid["features"], grid["classes"]):
+        results.append(benchmark_model(*config))
+        print_result(results[-1])
+    return {"environment": get_environment(), "grid": grid, "results": results}
+
+## print the times of a model
+def print_result(result):
+    print("trees {:>3} depth {:>3} features {:>3} classes {:>3}: {:>9.3f} s, peak {:>8.1f} MB, {:>7} feature, {:>7} code, {:>7} voting entries".format(
+        result["trees"], result["max_depth"], result["features"], result["classes"], result["total_seconds"],
+        result["max_peak_bytes"] / 2**20, result["feature_table_entries"], result["code_table_entries"],
+        result["voting_table_entries"]))
+    print("    " + ", ".join("{} {:.4f}".format(name, seconds) for name, seconds in result["seconds"].items()))
+
+## stages slower than tolerance times the baseline, for the models in both reports
+def get_regressions(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    model = lambda result: (result["trees"], result["max_depth"], result["features"], result["classes"])
+    baseline_results = {model(result): result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        previous = baseline_results.get(model(result))
+        if previous is None:
+            continue
+        for name, seconds in result["seconds"].items():
+            before = previous["seconds"].get(name)
+            if before is not None and before >= MIN_COMPARED_SECONDS and seconds > tolerance * before:
+                regressions.append({"model": model(result), "stage": name, "baseline_seconds": before,
+                                    "seconds": seconds, "ratio": seconds / before})
+    return regressions
+
+if __name__ == "__main__":
+    grid = dict(DEFAULT_GRID)
+    for position, name in enumerate(["trees", "depths", "features", "classes"]):
+        if len(sys.argv) > position + 2 and sys.argv[position + 2]:
+            grid[name] = [int(value) for value in sys.argv[position + 2].split(",")]
+    report = run_benchmark(grid)
+    if len(sys.argv) > 6:
+        with open(sys.argv[6]) as baseline_file:
+            report["regressions"] = get_regressions(report, json.load(baseline_file))
+    with open(sys.argv[1], "w") as report_file:
+        json.dump(report, report_file, indent=1)
+    for regression in report.get("regressions", []):
+        print("** REGRESSION ** trees {} depth {} features {} classes {}: {} {:.4f} s -> {:.4f} s ({:.2f}x)".format(
+            *regression["model"], regression["stage"], regression["baseline_seconds"], regression["seconds"],
+            regression["ratio"]))
+    if report.get("regressions"):
+        sys.exit(1)
@@ -0,0 +1,77 @@
+## Connection to the BF Runtime gRPC server of a Tofino switch
+import os
+import sys
+
+## make the bfrt_grpc client of the SDE importable
+def add_sde_paths():
+    if 'SDE_INSTALL' not in os.environ:
+        return
+    SDE_INSTALL   = os.environ['SDE_INSTALL']
+    SDE_PYTHON2   = os.path.join(SDE_INSTALL, 'lib', 'python2.7', 'site-packages')
+    PYTHON3_VER   = '{}.{}'.format(
+                        sys.version_info.major,
+                        sys.version_info.minor)
+    SDE_PYTHON3   = os.path.join(SDE_INSTALL, 'lib', 'python' + PYTHON3_VER, 'site-packages')
+    for path in [SDE_PYTHON2, os.path.join(SDE_PYTHON2, 'tofino'),
+                 SDE_PYTHON3, os.path.join(SDE_PYTHON3, 'tofino'), os.path.join(SDE_PYTHON3, 'tofino', 'bfrt_grpc')]:
+        if path not in sys.path:
+            sys.path.append(path)
+
+## import the bfrt_grpc client module
+def import_bfrt_client():
+    add_sde_paths()
+    import bfrt_grpc.client as bfrt_client
+    return bfrt_client
+
+## connect to the BF Runtime server and bind to the running program
+def connect(grpc_addr, client_id=1, device_id=0):
+    bfrt_client = import_bfrt_client()
+    interface = bfrt_client.ClientInterface(
+        grpc_addr = grpc_addr,
+        client_id = client_id,
+        device_id = device_id)
+    bfrt_info = interface.bfrt_info_get()
+    interface.bind_pipeline_config(bfrt_info.p4_name_get())
+    return bfrt_client, interface, bfrt_info
+
+## tables written pipe by pipe in the sharded control plane
+PIPE_SCOPE_TABLES = ['Ingress.flow_action_table', 'Ingress.reg_status', 'Ingress.reg_classified_flag',
+                     'Ingress.reg_flow_ID', 'Ingress.reg_time_occ', 'Ingress.reg_pkt_count', 'Ingress.reg_pkt_len_total',
+                     'Ingress.reg_pkt_len_max', 'Ingress.reg_ack_flag_count']
+
+## entries of the tables written in one pipe at a time (asymmetric) instead of all
+## the pipes; the tables must be empty: install_table_entries.py --pipes sets it
+## on the program just loaded, before installing the entries in every pipe
+def set_single_pipe_scope(bfrt_client, bfrt_info, device_id=0, table_names=PIPE_SCOPE_TABLES):
+    import bfrt_grpc.bfruntime_pb2 as bfruntime_pb2
+    target = bfrt_client.Target(device_id=device_id, pipe_id=0xffff)
+    for name in table_names:
+        bfrt_info.table_get(name).attribute_entry_scope_set(target, predefined_pipe_scope=True,
+                                                            predefined_pipe_scope_val=bfruntime_pb2.Mode.SINGLE)
+
+## targets of the writes of a table: one per pipe for the asymmetric tables,
+## otherwise all the pipes at once (pipe_id 0xffff)
+def get_table_targets(bfrt_client, table_name, pipes=None, device_id=0, table_names=PIPE_SCOPE_TABLES):
+    if pipes and table_name in table_names:
+        return [bfrt_client.Target(device_id=device_id, pipe_id=pipe) for pipe in pipes]
+    return [bfrt_client.Target(device_id=device_id, pipe_id=0xffff)]
+
+## parse the --pipes 0,1,2,3 option out of the arguments, returns (arguments, pipes or None)
+def pop_pipes_option(args):
+    if "--pipes" not in args:
+        return args, None
+    position = args.index("--pipes")
+    return args[:position] + args[position+2:], [int(pipe) for pipe in args[position+1].split(",")]
+
+## session of a switch of the sharded control plane, a dict with "grpc_addr",
+## "client_id", "device_id", "pipes" (None: all the pipes at once) and
+## "pipe_scope" (the tables of the pipes were made asymmetric by
+## install_table_entries.py --pipes, required to write the pipes one by one)
+def connect_switch(switch):
+    if switch.get("pipes") and not switch.get("pipe_scope"):
+        raise ValueError("switch " + switch["name"] + ": writing the pipes one by one needs the tables installed with "
+                         "install_table_entries.py --pipes and pipe_scope set")
+    bfrt_client, interface, bfrt_info = connect(switch["grpc_addr"], switch.get("client_id", 1),
+                                                switch.get("device_id", 0))
+    return {"bfrt_client": bfrt_client, "interface": interface, "bfrt_info": bfrt_info,
+            "learn_filter": bfrt_info.learn_get("digest")}
@@ -0,0 +1,228 @@
+## Traffic-aware pruning of an RF model down to the sizes of the P4 tables.
+## A held-out flow dataset is replayed through the trees as the switch sees it
+## (feature values wrapped at the width of their field) to count the flows that
+## hit every leaf and every range of the feature tables. While a table does not
+## fit its budget, the model is pruned greedily:
+##  - a code table too large: the subtrees whose two children are leaves are
+##    collapsed into a leaf, the ones that change the class of the fewest
+##    replayed flows (often: that no flow reaches) first,
+##  - a feature table too large: the thresholds between the least hit ranges are
+##    removed, the splits on them moving to the next threshold (or, for the last
+##    threshold of a feature, the split is replaced by its most used child).
+## The entries are counted as the generator installs them, after the lossless
+## minimization of entries_minimizer.py (table_usage.py). Every step prunes a
+## share of the excess entries, the accuracy of the vote of the switch on the
+## replayed flows is reported after each one, and the pruned model is returned.
+import os
+import copy
+import time
+from math import ceil
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, f1_score
+from rf_compiler import TREE_UNDEFINED
+from table_usage import get_table_usage
+from voting_compiler import get_voting_entries
+from pipeline_emulator import match_voting_table
+from feature_quantization import get_feature_widths
+from p4_tables import get_p4_table_sizes
+
+P4_FILE = '../../P4/Full_version/unibs_flowrest.p4'
+## value of the children of a leaf in the sklearn trees
+TREE_LEAF = -1
+## share of the excess entries of a table pruned at each step
+PRUNE_SHARE = 0.25
+
+## parent of every node of a tree (-1 for the root)
+def get_parents(tree_):
+    parents = np.full(tree_.node_count, -1, dtype=np.int64)
+    for children in (tree_.children_left, tree_.children_right):
+        internal = np.flatnonzero(children != TREE_LEAF)
+        parents[children[internal]] = internal
+    return parents
+
+## nodes of the subtree of a node
+def get_subtree(tree_, node):
+    nodes, stack = [], [node]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        if tree_.children_left[node] != TREE_LEAF:
+            stack += [tree_.children_left[node], tree_.children_right[node]]
+    return nodes
+
+## unused nodes are marked as leaves without split, so that the compiler ignores them
+def drop_nodes(tree_, nodes):
+    tree_.children_left[nodes] = TREE_LEAF
+    tree_.children_right[nodes] = TREE_LEAF
+    tree_.threshold[nodes] = TREE_UNDEFINED
+    tree_.feature[nodes] = int(TREE_UNDEFINED)
+
+## turn a node into a leaf (its value is already the one of its subtree)
+def collapse_node(tree_, node):
+    drop_nodes(tree_, get_subtree(tree_, node)[1:])
+    drop_nodes(tree_, [node])
+
+## replace a split by the subtree of one of its children
+def graft_child(tree_, node, right):
+    kept = tree_.children_right[node] if right else tree_.children_left[node]
+    dropped = tree_.children_left[node] if right else tree_.children_right[node]
+    parent = get_parents(tree_)[node]
+    if tree_.children_left[parent] == node:
+        tree_.children_left[parent] = kept
+    else:
+        tree_.children_right[parent] = kept
+    drop_nodes(tree_, get_subtree(tree_, dropped) + [node])
+
+## class of every node of a tree (the leaves keep the class of the training)
+def get_node_classes(tree_):
+    return tree_.value[:, 0, :].argmax(axis=1)
+
+## merge the sibling leaves of the same class, until there are none (lossless)
+def collapse_same_class(forest):
+    for estimator in forest.estimators_:
+        tree_ = estimator.tree_
+        classes = get_node_classes(tree_)
+        changed = True
+        while changed:
+            left, right = tree_.children_left, tree_.children_right
+            nodes = np.flatnonzero(left != TREE_LEAF)
+            nodes = nodes[(left[left[nodes]] == TREE_LEAF) & (left[right[nodes]] == TREE_LEAF) &
+                          (classes[left[nodes]] == classes[right[nodes]])]
+            for node in nodes:
+                collapse_node(tree_, node)
+            changed = len(nodes) > 0
+    return forest
+
+## feature values as the switch sees them
+def get_switch_features(X, feature_widths):
+    return np.asarray(X, dtype=np.int64) & np.array([(1 << width) - 1 for width in feature_widths], dtype=np.int64)
+
+## class of the switch for every flow: vote of the ternary voting table on the
+## classes of the trees (numbered from 1 as in the P4 program)
+def get_switch_classes(forest, features, voting_tables):
+    tree_classes = np.stack([estimator.predict(features).astype(np.int64) + 1 for estimator in forest.estimators_],
+                            axis=1)
+    final = match_voting_table(voting_tables, tree_classes)
+    return forest.classes_[np.maximum(final, 1) - 1]
+
+## voting table entries in the format of the emulator of the pipeline
+def get_voting_tables(num_of_trees, num_of_classes):
+    entries = list(get_voting_entries(num_of_trees, num_of_classes, ternary=True))
+    entries.sort(key=lambda entry: entry[2])
+    return {"voting_ternary": True, "voting_keys": np.array([entry[0] for entry in entries], dtype=np.int64),
+            "voting_masks": np.array([entry[1] for entry in entries], dtype=np.int64),
+            "voting_results": np.array([entry[3] for entry in entries], dtype=np.int64)}
+
+## subtrees of a tree that can be collapsed (two leaf children), with the replayed
+## flows whose class would change and the flows that reach them
+def get_collapse_candidates(tree_, leaf_hits):
+    left, right = tree_.children_left, tree_.children_right
+    classes = get_node_classes(tree_)
+    nodes = np.flatnonzero(left != TREE_LEAF)
+    nodes = nodes[(left[left[nodes]] == TREE_LEAF) & (left[right[nodes]] == TREE_LEAF)]
+    changed = leaf_hits[left[nodes]] * (classes[left[nodes]] != classes[nodes]) + \
+        leaf_hits[right[nodes]] * (classes[right[nodes]] != classes[nodes])
+    return [(int(cost), int(leaf_hits[left[node]] + leaf_hits[right[node]]), int(node))
+            for cost, node in zip(changed, nodes)]
+
+## thresholds of a feature that can be removed, with the replayed flows of the
+## range that changes side and the direction of the move
+def get_threshold_candidates(forest, fea, values):
+    splits = []
+    for tree_id, estimator in enumerate(forest.estimators_):
+        tree_ = estimator.tree_
+        nodes = np.flatnonzero((tree_.feature == fea) & (tree_.threshold != TREE_UNDEFINED))
+        splits += [(tree_id, node, int(tree_.threshold[node])) for node in nodes]
+    thresholds = np.unique([threshold for tree_id, node, threshold in splits])
+    # flows of every range: (.., thresholds[0]], (thresholds[0], thresholds[1]], ...
+    range_hits = np.bincount(np.searchsorted(thresholds, values, side="left"), minlength=len(thresholds) + 1)
+    candidates = []
+    for index, threshold in enumerate(thresholds):
+        # moving the splits up sends the next range to the left, down sends this range to the right
+        up = (int(range_hits[index + 1]), "up")
+        down = (int(range_hits[index]), "down")
+        cost, direction = min(up, down)
+        nodes = [(tree_id, node) for tree_id, node, split_threshold in splits if split_threshold == threshold]
+        candidates.append((cost, int(range_hits[index] + range_hits[index + 1]), fea, int(threshold), direction,
+                           thresholds, nodes))
+    return candidates
+
+## remove a threshold: its splits move to the next threshold in the direction,
+## or keep one child when there is none (not for the root); returns the splits changed
+def remove_threshold(forest, candidate):
+    cost, hits, fea, threshold, direction, thresholds, nodes = candidate
+    index = int(np.searchsorted(thresholds, threshold))
+    target = index + 1 if direction == "up" else index - 1
+    moved = 0
+    for tree_id, node in nodes:
+        tree_ = forest.estimators_[tree_id].tree_
+        if tree_.threshold[node] == TREE_UNDEFINED:
+            continue
+        if 0 <= target < len(thresholds):
+            tree_.threshold[node] = thresholds[target] + 0.5
+            moved += 1
+        elif node != 0:
+            # no threshold above: every value goes left, below: every value goes right
+            graft_child(tree_, node, right=direction == "down")
+            moved += 1
+    return moved
+
+## prune the model until the feature and code tables fit the budgets; returns the
+## pruned model and the steps with the entries and accuracy after each one
+def prune_to_budget(clf, X_replay, y_replay, budgets=None, p4_file=P4_FILE, feature_widths=None, minimize=True,
+                    ternary_features=False, prune_share=PRUNE_SHARE, max_steps=1000):
+    feature_names = list(clf.feature_names_in_)
+    if feature_widths is None:
+        feature_widths = get_feature_widths(len(feature_names), p4_file)
+    if budgets is None:
+        budgets = get_p4_table_sizes(p4_file) if os.path.exists(p4_file) else {}
+    features = get_switch_features(pd.DataFrame(X_replay)[feature_names], feature_widths)
+    voting_tables = get_voting_tables(len(clf.estimators_), len(clf.classes_))
+    start = time.time()
+    y_baseline = get_switch_classes(clf, features, voting_tables)
+    baseline = {"accuracy": accuracy_score(y_replay, y_baseline), "macro": f1_score(y_replay, y_baseline, average="macro")}
+    forest = collapse_same_class(copy.deepcopy(clf))
+    steps = []
+    total_pruned = 0
+    for step in range(max_steps + 1):
+        usage = get_table_usage(forest, feature_names, feature_widths, minimize, ternary_features)
+        excess = {table_name: entries - budgets[table_name] for table_name, entries in usage.items()
+                  if table_name in budgets and entries > budgets[table_name]}
+        y_pred = get_switch_classes(forest, features, voting_tables)
+        steps.append({"step": step, "pruned": total_pruned,
+                      "entries": sum(usage.values()), "overflows": sorted(excess), "usage": usage,
+                      "accuracy": accuracy_score(y_replay, y_pred), "macro": f1_score(y_replay, y_pred, average="macro")})
+        steps[-1]["accuracy_lost"] = baseline["accuracy"] - steps[-1]["accuracy"]
+        print("step {:>4}: {:>6} entries, {:>4} pruned, accuracy {:.4f} (-{:.4f}), macro F1 {:.4f}, over budget: {}".format(
+            step, steps[-1]["entries"], steps[-1]["pruned"], steps[-1]["accuracy"], steps[-1]["accuracy_lost"],
+            steps[-1]["macro"], ", ".join(table_name+" +"+str(entries) for table_name, entries in excess.items()) or "-"))
+        if not excess or step == max_steps:
+            break
+        pruned = 0
+        for table_name, entries in excess.items():
+            count = max(1, int(ceil(entries * prune_share)))
+            if table_name.startswith("code_table"):
+                tree_id = int(table_name[len("code_table"):])
+                tree_ = forest.estimators_[tree_id].tree_
+                leaf_hits = np.bincount(forest.estimators_[tree_id].apply(features), minlength=tree_.node_count)
+                for cost, hits, node in sorted(get_collapse_candidates(tree_, leaf_hits))[:count]:
+                    collapse_node(tree_, node)
+                    pruned += 1
+            elif table_name.startswith("table_feature"):
+                fea = int(table_name[len("table_feature"):])
+                removed = set()
+                for candidate in sorted(get_threshold_candidates(forest, fea, features[:, fea]),
+                                        key=lambda candidate: candidate[:2]):
+                    index = int(np.searchsorted(candidate[5], candidate[3]))
+                    # the splits of a removed threshold may move to its neighbours
+                    if len(removed) >= count or removed & {index - 1, index + 1}:
+                        continue
+                    if remove_threshold(forest, candidate):
+                        removed.add(index)
+                pruned += len(removed)
+        if not pruned:
+            break
+        total_pruned += pruned
+    print("pruned in {:.1f} s".format(time.time() - start))
+    return forest, pd.DataFrame(steps)
@@ -0,0 +1,160 @@
+## Buffered log of the flows received in the digests of the control plane.
+## The records of a digest are converted to columns once, buffered, and written
+## in one go when enough rows are buffered or when the last write is too old,
+## instead of opening the file for every record. The age of the buffer is also
+## checked by a timer thread, so that the rows are written when no digest
+## arrives; the log is shared with it under a lock. The log can be rotated after a
+## number of rows and written as csv (dotted addresses, as before) or, with
+## pyarrow installed, as Parquet or Arrow IPC files (addresses as integers).
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+
+## columns of the log, as named in the digest
+LOG_COLUMNS = ['source_addr', 'destin_addr', 'source_port', 'destin_port', 'protocol', 'flow_class', 'register_index']
+## rows buffered before a write
+FLUSH_ROWS = 65536
+## seconds after which the buffered rows are written anyway
+FLUSH_INTERVAL = 1.0
+
+## decimal strings of the 16-bit values, looked up instead of formatted
+DECIMALS = np.array([str(value) for value in range(1 << 16)], dtype=object)
+OCTETS = np.array([str(value)+"." for value in range(256)], dtype=object)
+
+## dotted strings of IPv4 addresses given as integers
+def int_to_ip(addresses):
+    addresses = np.asarray(addresses, dtype=np.int64)
+    return OCTETS[addresses >> 24] + OCTETS[(addresses >> 16) & 0xff] + OCTETS[(addresses >> 8) & 0xff] + \
+        DECIMALS[addresses & 0xff]
+
+## decimal strings of non-negative integers
+def int_to_str(values):
+    values = np.asarray(values, dtype=np.int64)
+    if values.max(initial=0) < len(DECIMALS):
+        return DECIMALS[values]
+    return values.astype(str).astype(object)
+
+## csv lines of the columns of the log
+def get_csv_lines(columns):
+    strings = [int_to_ip(columns[name]) if name in ("source_addr", "destin_addr") else int_to_str(columns[name])
+               for name in LOG_COLUMNS]
+    return "".join(line + "\n" for line in map(",".join, zip(*strings)))
+
+## columns of the records (dicts) of a digest
+def get_digest_columns(records):
+    return {name: np.fromiter((record[name] for record in records), dtype=np.int64, count=len(records))
+            for name in LOG_COLUMNS}
+
+## a log of the classified flows; rotate_rows starts a new file after that many
+## rows (checked at every write, so a file can exceed it by less than flush_rows)
+def open_log(path, log_format="csv", flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL, rotate_rows=None):
+    if log_format != "csv":
+        # optional dependency, only needed for the columnar formats
+        import pyarrow
+    log = {"path": path, "format": log_format, "flush_rows": flush_rows, "flush_interval": flush_interval,
+           "rotate_rows": rotate_rows, "buffer": [], "buffered_rows": 0, "last_flush": time.time(),
+           "file_index": 0, "file_rows": 0, "files": [], "writer": None, "rows": 0, "latencies": [],
+           "lock": threading.Lock(), "closed": threading.Event()}
+    if flush_interval is not None:
+        timer = threading.Thread(target=run_log_timer, args=(log,))
+        timer.daemon = True
+        timer.start()
+    return log
+
+## timer of the log: write the buffered rows once they are flush_interval seconds
+## old, until the log is closed
+def run_log_timer(log):
+    while not log["closed"].wait(max(log["last_flush"] + log["flush_interval"] - time.time(), 0.01)):
+        with log["lock"]:
+            if time.time() - log["last_flush"] >= log["flush_interval"]:
+                flush_log(log)
+
+## path of the current file of the log: name.csv, then name.1.csv, name.2.csv...
+def get_log_file(log):
+    if log["file_index"] == 0:
+        return log["path"]
+    root, extension = os.path.splitext(log["path"])
+    return root + "." + str(log["file_index"]) + extension
+
+## open the current file of the log
+def open_log_file(log, frame):
+    path = get_log_file(log)
+    if log["format"] == "csv":
+        writer = open(path, "w")
+        writer.write(",".join(LOG_COLUMNS) + "\n")
+    elif log["format"] == "parquet":
+        import pyarrow.parquet
+        writer = pyarrow.parquet.ParquetWriter(path, get_arrow_table(frame).schema)
+    else:
+        import pyarrow
+        writer = pyarrow.ipc.new_file(path, get_arrow_table(frame).schema)
+    log["files"].append(path)
+    return writer
+
+## rows of the log as an Arrow table
+def get_arrow_table(frame):
+    import pyarrow
+    return pyarrow.Table.from_pandas(frame, preserve_index=False)
+
+## close the current file of the log
+def close_log_file(log):
+    if log["writer"] is not None:
+        log["writer"].close()
+    log["writer"] = None
+    log["file_rows"] = 0
+
+## write the buffered rows
+def flush_log(log):
+    log["last_flush"] = time.time()
+    if log["buffered_rows"] == 0:
+        return
+    start = time.perf_counter()
+    frame = pd.DataFrame({name: np.concatenate([columns[name] for columns in log["buffer"]]) for name in LOG_COLUMNS})
+    if log["format"] != "csv":
+        frame = frame.astype({"source_addr": np.uint32, "destin_addr": np.uint32, "source_port": np.uint16,
+                              "destin_port": np.uint16, "protocol": np.uint8, "flow_class": np.uint8,
+                              "register_index": np.uint32})
+    if log["writer"] is None:
+        log["writer"] = open_log_file(log, frame)
+    if log["format"] == "csv":
+        log["writer"].write(get_csv_lines(frame))
+        log["writer"].flush()
+    else:
+        log["writer"].write_table(get_arrow_table(frame))
+    log["rows"] += len(frame)
+    log["file_rows"] += len(frame)
+    log["buffer"] = []
+    log["buffered_rows"] = 0
+    if log["rotate_rows"] and log["file_rows"] >= log["rotate_rows"]:
+        close_log_file(log)
+        log["file_index"] += 1
+    log["latencies"].append((time.perf_counter() - start, len(frame)))
+
+## buffer the columns of a digest, and write them when the buffer is full or old
+def log_digest(log, columns):
+    with log["lock"]:
+        log["buffer"].append(columns)
+        log["buffered_rows"] += len(columns[LOG_COLUMNS[0]])
+        if log["buffered_rows"] >= log["flush_rows"] or (log["flush_interval"] is not None and
+                                                         time.time() - log["last_flush"] >= log["flush_interval"]):
+            flush_log(log)
+
+## write the rows left and close the log
+def close_log(log):
+    log["closed"].set()
+    with log["lock"]:
+        flush_log(log)
+        close_log_file(log)
+
+## print the rows written and the latency of the writes
+def report_log(log):
+    latencies = np.array([latency for latency, rows in log["latencies"]]) * 1000
+    written_rows = sum(rows for latency, rows in log["latencies"])
+    if len(latencies) == 0:
+        print("Log: no rows written")
+        return
+    print("Log: {} rows in {} writes and {} files, write latency p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms ({:.0f} rows/s)".format(
+        log["rows"], len(latencies), len(log["files"]), np.percentile(latencies, 50), np.percentile(latencies, 99),
+        latencies.max(), written_rows / max(latencies.sum() / 1000, 1e-9)))
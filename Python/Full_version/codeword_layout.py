@@ -0,0 +1,149 @@
+## Codeword bit layout of the feature tables and generation of the matching P4.
+## The codeword of a tree has one bit per split of the tree, feature by feature
+## (feature0 in the most significant bits), so each feature table writes one
+## slice of every codeword. The widths and slices are computed from the compiled
+## feature tables and written to the P4 includes together with the entries, so
+## that the P4 program and the entries cannot drift apart.
+## The codewords are packed in metadata fields (codeword_fieldN): every codeword
+## stays contiguous, so that its code table matches it as one key named
+## meta.codewordN (the CODEWORDN slice macro of codewords.p4), and the codewords
+## whose last bits fit in the same container bytes share a field, so the fields
+## take fewer PHV bits than one field per codeword. The report gives the PHV
+## bits of the fields in the smallest 32/16/8-bit containers; the PHV allocation
+## of the P4 compiler may still pack them with other metadata.
+from math import ceil
+
+## PHV containers of Tofino, largest first
+PHV_CONTAINER_SIZES = [32, 16, 8]
+## width of a TCAM block and number of entries it holds
+TCAM_BLOCK_WIDTH = 44
+TCAM_BLOCK_DEPTH = 512
+
+## 32/16/8-bit containers (count of every size) holding a metadata field alone
+def get_phv_containers(width):
+    containers = []
+    for size in PHV_CONTAINER_SIZES:
+        containers.append(width // size)
+        width %= size
+    containers[-1] += 1 if width else 0
+    return containers
+
+## PHV bits taken by a metadata field alone, in the smallest set of containers
+def get_phv_bits(width):
+    return sum(size * count for size, count in zip(PHV_CONTAINER_SIZES, get_phv_containers(width)))
+
+## metadata fields of the codewords: the codewords are placed widest first,
+## above the codewords of the field whose containers they share with the most
+## PHV bits saved, or in a field of their own when sharing saves none; returns
+## the width of every field and the (field, least significant bit) of every codeword
+def get_codeword_fields(codeword_widths):
+    field_widths, placements = [], [None] * len(codeword_widths)
+    for tree_id in sorted(range(len(codeword_widths)), key=lambda tree_id: -codeword_widths[tree_id]):
+        width = max(codeword_widths[tree_id], 1)
+        savings = [get_phv_bits(field_width) + get_phv_bits(width) - get_phv_bits(field_width + width)
+                   for field_width in field_widths]
+        if savings and max(savings) > 0:
+            field = savings.index(max(savings))
+        else:
+            field = len(field_widths)
+            field_widths.append(0)
+        placements[tree_id] = (field, field_widths[field])
+        field_widths[field] += width
+    return {"field_widths": field_widths, "placements": placements}
+
+## codeword width of every tree and slice (high, low) of every feature in it;
+## features without splits in a tree get no slice (None); the codeword fields
+## are given by get_codeword_fields
+def get_codeword_layout(feature_tables, num_of_trees):
+    code_widths = [[feature_table["Bits"][tree_id].shape[1] for tree_id in range(num_of_trees)]
+                   for feature_table in feature_tables]
+    codeword_widths = [sum(widths[tree_id] for widths in code_widths) for tree_id in range(num_of_trees)]
+    slices = []
+    for fea, widths in enumerate(code_widths):
+        slices.append([])
+        for tree_id in range(num_of_trees):
+            high = codeword_widths[tree_id] - 1 - sum(code_widths[previous][tree_id] for previous in range(fea))
+            slices[-1].append((high, high - widths[tree_id] + 1) if widths[tree_id] else None)
+    return dict(get_codeword_fields(codeword_widths), codeword_widths=codeword_widths, code_widths=code_widths,
+                slices=slices)
+
+## trees with a code slice written by a feature table
+def get_feature_code_trees(layout, fea):
+    return [tree_id for tree_id, code_slice in enumerate(layout["slices"][fea]) if code_slice is not None]
+
+## P4 defines of the codeword fields (headers.p4 declares one per tree, the
+## unused ones of width 1), of the slice CODEWORDN of the codeword of every
+## tree in its field and of the match type of the voting table keys
+## (included before headers.p4)
+def get_codewords_p4(layout, voting_ternary=True):
+    lines = ["/* -*- P4_16 -*- */", "/* Generated by generate_table_entries_from_RF.py, do not edit */", ""]
+    field_widths = layout["field_widths"]
+    for field in range(len(layout["codeword_widths"])):
+        width = field_widths[field] if field < len(field_widths) else 1
+        lines.append("#define CODEWORD_FIELD"+str(field)+"_WIDTH "+str(width))
+    for tree_id, width in enumerate(layout["codeword_widths"]):
+        field, low = layout["placements"][tree_id]
+        lines.append("#define CODEWORD"+str(tree_id)+" codeword_field"+str(field)+"["+str(low+max(width, 1)-1)+":"+str(low)+"]")
+    lines.append("#define VOTING_MATCH "+("ternary" if voting_ternary else "exact"))
+    return "\n".join(lines) + "\n"
+
+## lines of the SetCodeN actions of a layout, named SetCodeN + suffix; the
+## slices are written in the codeword fields of fields (the layout by default)
+def get_set_code_action_lines(layout, suffix="", fields=None):
+    placements = (fields or layout)["placements"]
+    lines = []
+    for fea, slices in enumerate(layout["slices"]):
+        trees = get_feature_code_trees(layout, fea)
+        params = ", ".join("bit<"+str(layout["code_widths"][fea][tree_id])+"> code"+str(tree_id) for tree_id in trees)
+        lines.append("    action SetCode"+str(fea)+suffix+"("+params+") {")
+        for tree_id in trees:
+            high, low = slices[tree_id]
+            field, offset = placements[tree_id]
+            lines.append("        meta.codeword_field"+str(field)+"["+str(offset+high)+":"+str(offset+low)+"] = code"+
+                         str(tree_id)+";")
+        lines.append("    }")
+    return lines
+
+## P4 feature table actions writing the code slices (included in the Ingress control)
+def get_set_code_actions_p4(layout):
+    lines = ["/* -*- P4_16 -*- */", "/* Generated by generate_table_entries_from_RF.py, do not edit */", ""]
+    return "\n".join(lines + get_set_code_action_lines(layout)) + "\n"
+
+## write the P4 includes of the layout
+def write_p4_includes(layout, include_dir, voting_ternary=True):
+    with open(include_dir+"/codewords.p4", "w") as p4_file:
+        p4_file.write(get_codewords_p4(layout, voting_ternary))
+    with open(include_dir+"/set_code_actions.p4", "w") as p4_file:
+        p4_file.write(get_set_code_actions_p4(layout))
+
+## bits of the generation of the entries in the keys of the code tables (meta.model_version)
+MODEL_VERSION_WIDTH = 1
+
+## TCAM blocks used by a ternary table
+def get_tcam_blocks(key_width, num_of_entries):
+    return ceil(key_width / TCAM_BLOCK_WIDTH) * ceil(max(num_of_entries, 1) / TCAM_BLOCK_DEPTH)
+
+## print codeword widths and fields, PHV bits, action data and table usage of the layout
+def report_resources(layout, table_entry_counts, table_sizes):
+    print("{:<16} {:>9} {:>24} {:>12}".format("codeword", "width", "field bits", "TCAM blocks"))
+    for tree_id, width in enumerate(layout["codeword_widths"]):
+        entries = table_entry_counts.get("code_table"+str(tree_id), 0)
+        field, low = layout["placements"][tree_id]
+        field_bits = "codeword_field{}[{}:{}]".format(field, low+max(width, 1)-1, low)
+        print("{:<16} {:>9} {:>24} {:>12}".format("codeword"+str(tree_id), width, field_bits,
+                                                   get_tcam_blocks(width + MODEL_VERSION_WIDTH, entries)))
+    print("{:<16} {:>9} {:>9} {:>14}".format("field", "width", "PHV bits", "containers"))
+    for field, width in enumerate(layout["field_widths"]):
+        containers = " ".join("{}x{}".format(count, size) for size, count in zip(PHV_CONTAINER_SIZES, get_phv_containers(width)) if count)
+        print("{:<16} {:>9} {:>9} {:>14}".format("codeword_field"+str(field), width, get_phv_bits(width), containers))
+    print("{:<16} {:>9} {:>9} {:>14}".format("total", sum(layout["field_widths"]),
+                                             sum(get_phv_bits(width) for width in layout["field_widths"]),
+                                             "(unpacked {})".format(sum(get_phv_bits(max(width, 1))
+                                                                        for width in layout["codeword_widths"]))))
+    print("{:<16} {:>9} {:>9} {:>12}".format("table", "entries", "size", "action bits"))
+    for table_name, entries in table_entry_counts.items():
+        action_bits = ""
+        # (the tables of the early-exit phases have their own layout)
+        if table_name.startswith("table_feature") and table_name[len("table_feature"):].isdigit():
+            action_bits = sum(layout["code_widths"][int(table_name[len("table_feature"):])])
+        print("{:<16} {:>9} {:>9} {:>12}".format(table_name, entries, table_sizes.get(table_name, "-"), action_bits))
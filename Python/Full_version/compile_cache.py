@@ -0,0 +1,163 @@
+## Content-addressed cache of the compiled parts of a model.
+## Every part is stored in its own file named by a hash of what it depends on:
+##  - the leaves (codes, masks, classes) of a tree: the arrays of the tree,
+##  - the feature table of a feature: the splits of the forest on that feature,
+##  - the ternary entries and TCAM footprint of a feature table: its thresholds,
+##    codes and field width,
+## plus the source of the compiler modules, so that a change of the compiler
+## invalidates the cache. Retraining one tree or changing the splits on one
+## feature only recompiles that tree or feature; a run with the same model and
+## options reads everything from the cache. The least recently used files are
+## deleted when the cache grows over max_bytes. The functions work without a
+## cache (None) too, and then compile everything.
+import os
+import pickle
+import hashlib
+import numpy as np
+from rf_compiler import get_splits, get_feature_table, compile_estimators
+from tcam_expansion import get_feature_ternary_entries, get_tcam_footprint
+
+## directory of the cache
+COMPILE_CACHE_DIR = '.compile_cache'
+## size of the cache on disk above which the least recently used files are deleted
+MAX_CACHE_BYTES = 1 << 30
+## modules whose source is part of every key
+COMPILER_MODULES = ['rf_compiler.py', 'tcam_expansion.py']
+
+## hash of the source of the compiler modules
+def get_compiler_version():
+    digest = hashlib.sha256()
+    for module in COMPILER_MODULES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), "rb") as source_file:
+            digest.update(source_file.read())
+    return digest.hexdigest()
+
+## a cache in a directory, with its hit and miss counters
+def open_compile_cache(directory=COMPILE_CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    os.makedirs(directory, exist_ok=True)
+    return {"directory": directory, "max_bytes": max_bytes, "version": get_compiler_version(),
+            "hits": 0, "misses": 0, "evicted": 0}
+
+## key of a compiled part: hash of its kind, of the compiler version and of the
+## arrays and values it depends on (None without a cache)
+def get_cache_key(cache, kind, *parts):
+    if cache is None:
+        return None
+    digest = hashlib.sha256((kind + cache["version"]).encode())
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(str(part.dtype).encode() + str(part.shape).encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode())
+    return kind + "-" + digest.hexdigest()
+
+## path of the file of a key
+def get_cache_path(cache, key):
+    return os.path.join(cache["directory"], key + ".pkl")
+
+## value of a key, None if it is not in the cache
+def load_cached(cache, key):
+    if cache is None:
+        return None
+    path = get_cache_path(cache, key)
+    try:
+        with open(path, "rb") as cache_file:
+            value = pickle.load(cache_file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        cache["misses"] += 1
+        return None
+    # the modification time of a file is its last use, for the eviction
+    os.utime(path)
+    cache["hits"] += 1
+    return value
+
+## store the value of a key (written to a temporary file first, so that an
+## interrupted run does not leave a truncated file)
+def store_cached(cache, key, value):
+    if cache is None:
+        return
+    path = get_cache_path(cache, key)
+    with open(path + ".tmp", "wb") as cache_file:
+        pickle.dump(value, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+## value of a key, computed and stored when it is not in the cache
+def get_cached(cache, key, compute, *args):
+    value = load_cached(cache, key)
+    if value is None:
+        value = compute(*args)
+        store_cached(cache, key, value)
+    return value
+
+## key of the leaves of a tree
+def get_tree_key(cache, estimator, feature_names):
+    tree_ = estimator.tree_
+    return get_cache_key(cache, "tree", tree_.children_left, tree_.children_right, tree_.feature, tree_.threshold,
+                         tree_.value, tree_.n_outputs, len(feature_names))
+
+## compile_trees with the leaves of the trees already compiled read from the
+## cache; only the other trees are compiled (in parallel)
+def compile_trees_cached(cache, forest, feature_names, max_workers=None):
+    estimators = list(forest.estimators_)
+    keys = [get_tree_key(cache, estimator, feature_names) for estimator in estimators]
+    forest_leaves = [load_cached(cache, key) for key in keys]
+    missing = [tree_id for tree_id, leaves in enumerate(forest_leaves) if leaves is None]
+    compiled = compile_estimators([estimators[tree_id] for tree_id in missing], feature_names, max_workers)
+    for tree_id, leaves in zip(missing, compiled):
+        store_cached(cache, keys[tree_id], leaves)
+        forest_leaves[tree_id] = leaves
+    return forest_leaves
+
+## compile_feature_tables with the feature tables read from the cache when the
+## splits on their feature did not change
+def compile_feature_tables_cached(cache, forest, feature_names):
+    splits = get_splits(forest, feature_names)
+    num_of_trees = len(forest.estimators_)
+    feature_tables = []
+    for feature_name in feature_names:
+        feature_splits = splits[splits["Feature"] == feature_name]
+        key = get_cache_key(cache, "feature", feature_splits["Tree"].to_numpy(), feature_splits["NodeID"].to_numpy(),
+                            feature_splits["Threshold"].to_numpy(), num_of_trees)
+        feature_tables.append(get_cached(cache, key, get_feature_table, splits, feature_name, num_of_trees))
+    return feature_tables
+
+## key of what is derived from a feature table
+def get_feature_table_key(cache, kind, feature_table, num_of_trees, width):
+    return get_cache_key(cache, kind, feature_table["Threshold"], *feature_table["Bits"][:num_of_trees],
+                         num_of_trees, width)
+
+## get_feature_ternary_entries through the cache
+def get_feature_ternary_entries_cached(cache, feature_table, num_of_trees, width):
+    key = get_feature_table_key(cache, "ternary", feature_table, num_of_trees, width)
+    return get_cached(cache, key, get_feature_ternary_entries, feature_table, num_of_trees, width)
+
+## get_tcam_footprint through the cache
+def get_tcam_footprint_cached(cache, feature_table, num_of_trees, width):
+    key = get_feature_table_key(cache, "footprint", feature_table, num_of_trees, width)
+    return get_cached(cache, key, get_tcam_footprint, feature_table, num_of_trees, width)
+
+## delete the least recently used files until the cache holds at most max_bytes
+def evict_compile_cache(cache):
+    files = []
+    for name in os.listdir(cache["directory"]):
+        path = os.path.join(cache["directory"], name)
+        if name.endswith(".pkl"):
+            status = os.stat(path)
+            files.append((status.st_mtime, status.st_size, path))
+    total = sum(size for mtime, size, path in files)
+    for mtime, size, path in sorted(files):
+        if total <= cache["max_bytes"]:
+            break
+        os.remove(path)
+        total -= size
+        cache["evicted"] += 1
+    return total
+
+## evict the files over the size of the cache and print its counters
+def close_compile_cache(cache):
+    if cache is None:
+        return
+    total = evict_compile_cache(cache)
+    print("Compile cache: {} hits, {} misses, {} files evicted, {:.1f} MB in {}".format(
+        cache["hits"], cache["misses"], cache["evicted"], total / 2**20, cache["directory"]))
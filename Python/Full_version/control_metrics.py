@@ -0,0 +1,186 @@
+## Metrics of the control plane: latency and size histograms, a Prometheus text
+## endpoint serving the metrics of the pipeline, and an optional sampling
+## profiler of its phases (key building, writes).
+## The metrics are the dicts of control_pipeline.py; every value is updated by a
+## single thread and the endpoint renders a snapshot of them.
+import sys
+import threading
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+## upper bounds of the latency histograms, in seconds
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+## upper bounds of the histograms of records per digest
+SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096]
+## prefix of the names of the metrics
+METRICS_PREFIX = "flowrest_"
+## metrics that can go down (or are settings); the other numbers are counters
+GAUGES = {"elapsed", "digest_queue_depth", "batch_queue_depth", "digest_queue_max", "batch_queue_max",
+          "occupancy", "max_occupancy", "table_size", "ttl", "high_water", "low_water", "delete_batch",
+          "num_of_slots", "timeout", "margin", "chunk_size", "interval"}
+## label of the metrics holding one value or histogram per label value
+LABELS = {"classes": "flow_class", "write_seconds_by_table": "table", "flows_by_pipe": "pipe"}
+## metrics merged with the maximum of the merged snapshots instead of their sum
+MERGE_MAX = {"elapsed", "digest_queue_max", "batch_queue_max", "max_occupancy", "ttl", "num_of_slots", "timeout",
+             "margin", "chunk_size", "interval", "delete_batch", "switch_time", "local_time"}
+## seconds between two samples of the profiler
+PROFILE_INTERVAL = 0.005
+
+## an empty histogram with the given bucket upper bounds
+def get_histogram(buckets=LATENCY_BUCKETS):
+    return {"buckets": buckets, "counts": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+
+## add a value to a histogram
+def observe(histogram, value):
+    histogram["counts"][bisect_left(histogram["buckets"], value)] += 1
+    histogram["sum"] += value
+    histogram["count"] += 1
+
+## copy of a histogram, safe to read while the original is updated
+def copy_histogram(histogram):
+    return {"buckets": histogram["buckets"], "counts": list(histogram["counts"]), "sum": histogram["sum"],
+            "count": histogram["count"]}
+
+## upper bound of the bucket holding the quantile q of a histogram (None if empty)
+def get_histogram_quantile(histogram, q):
+    if histogram["count"] == 0:
+        return None
+    cumulative = 0
+    for bound, count in zip(histogram["buckets"] + [float("inf")], histogram["counts"]):
+        cumulative += count
+        if cumulative >= q * histogram["count"]:
+            return bound
+
+## merge of two values of a metric: histograms and counters are added, groups
+## of metrics merged by name, the start is the earliest one
+def merge_metric(name, value, other):
+    if isinstance(value, dict) and "buckets" in value:
+        return {"buckets": value["buckets"], "counts": [count + other_count for count, other_count in
+                                                        zip(value["counts"], other["counts"])],
+                "sum": value["sum"] + other["sum"], "count": value["count"] + other["count"]}
+    if isinstance(value, dict):
+        merged = dict(value)
+        for key, item in other.items():
+            merged[key] = merge_metric(key, merged[key], item) if key in merged else item
+        return merged
+    if isinstance(value, (int, float)) and isinstance(other, (int, float)) and not isinstance(value, bool):
+        if name == "start":
+            return min(value, other)
+        return max(value, other) if name in MERGE_MAX else value + other
+    return value if other is None else other
+
+## snapshots of several pipelines (pipes, switches) merged into one
+def merge_snapshots(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        merged = merge_metric(None, merged, snapshot)
+    return merged
+
+## Prometheus lines of a histogram
+def get_histogram_lines(name, histogram, labels=""):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram["buckets"] + ["+Inf"], histogram["counts"]):
+        cumulative += count
+        lines.append('{}_bucket{{{}le="{}"}} {}'.format(name, labels + "," if labels else "", bound, cumulative))
+    lines.append("{}_sum{} {}".format(name, "{"+labels+"}" if labels else "", histogram["sum"]))
+    lines.append("{}_count{} {}".format(name, "{"+labels+"}" if labels else "", histogram["count"]))
+    return lines
+
+## Prometheus text of a snapshot of the metrics (numbers, histograms, values
+## or histograms per label, and nested groups of metrics)
+def get_prometheus_text(snapshot, prefix=METRICS_PREFIX):
+    lines = []
+    for name, value in snapshot.items():
+        metric = prefix + name
+        if name == "start":
+            continue
+        if isinstance(value, dict) and "buckets" in value:
+            lines += ["# TYPE " + metric + " histogram"] + get_histogram_lines(metric, value)
+        elif isinstance(value, dict) and name in LABELS:
+            values = list(value.items())
+            if values and isinstance(values[0][1], dict):
+                lines.append("# TYPE " + metric + " histogram")
+                for label, histogram in values:
+                    lines += get_histogram_lines(metric, histogram, '{}="{}"'.format(LABELS[name], label))
+            else:
+                lines.append("# TYPE " + metric + " counter")
+                lines += ['{}{{{}="{}"}} {}'.format(metric, LABELS[name], label, count) for label, count in values]
+        elif isinstance(value, dict):
+            lines.append(get_prometheus_text(value, metric + "_").rstrip("\n"))
+        elif isinstance(value, (int, float)):
+            lines.append("# TYPE {} {}".format(metric, "gauge" if name in GAUGES else "counter"))
+            lines.append("{} {}".format(metric, value))
+    return "\n".join(line for line in lines if line) + "\n"
+
+## serve the Prometheus text of get_snapshot() on http://address:port/metrics
+## from a daemon thread; returns the server (server.shutdown() stops it)
+def start_metrics_server(get_snapshot, port, address="127.0.0.1"):
+    from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+    def application(environ, start_response):
+        if environ["PATH_INFO"] != "/metrics":
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"not found\n"]
+        body = get_prometheus_text(get_snapshot()).encode()
+        start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    # the requests are not logged on stderr
+    handler = type("QuietHandler", (WSGIRequestHandler,), {"log_message": lambda *args: None})
+    server = make_server(address, port, application, handler_class=handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+## a sampling profiler: every interval seconds, the innermost function run by
+## each thread inside a phase (see profile_phase) is counted for that phase
+def open_profiler(interval=PROFILE_INTERVAL):
+    return {"interval": interval, "phases": {}, "samples": Counter(), "stop": threading.Event(), "thread": None}
+
+## mark the code run by the current thread as a phase of the profiler (no-op
+## without a profiler)
+@contextmanager
+def profile_phase(profiler, phase):
+    if profiler is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    profiler["phases"][thread_id] = phase
+    try:
+        yield
+    finally:
+        profiler["phases"].pop(thread_id, None)
+
+## profiler thread: sample the stacks of the threads in a phase
+def sample_phases(profiler):
+    while not profiler["stop"].wait(profiler["interval"]):
+        frames = sys._current_frames()
+        for thread_id, phase in list(profiler["phases"].items()):
+            frame = frames.get(thread_id)
+            if frame is not None:
+                code = frame.f_code
+                profiler["samples"][(phase, "{}:{} {}".format(code.co_filename.rsplit("/", 1)[-1], frame.f_lineno,
+                                                              code.co_name))] += 1
+
+## start the sampling thread of the profiler
+def start_profiler(profiler):
+    profiler["thread"] = threading.Thread(target=sample_phases, args=(profiler,))
+    profiler["thread"].daemon = True
+    profiler["thread"].start()
+
+## stop the profiler and print the most sampled lines of every phase
+def report_profile(profiler, top=10):
+    profiler["stop"].set()
+    if profiler["thread"] is not None:
+        profiler["thread"].join()
+    samples = list(profiler["samples"].items())
+    for phase in sorted(set(phase for (phase, location), count in samples)):
+        phase_samples = sorted(((count, location) for (sample_phase, location), count in samples if sample_phase == phase),
+                               reverse=True)
+        total = sum(count for count, location in phase_samples)
+        print("profile of {}: {} samples".format(phase, total))
+        for count, location in phase_samples[:top]:
+            print("  {:6.1%} {}".format(count / total, location))
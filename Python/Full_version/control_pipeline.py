@@ -0,0 +1,313 @@
+## Pipelined processing of the digests in the control plane.
+## Receiving a digest, building the keys and writing the tables are done by
+## three threads connected by bounded queues, so that the switch is drained of
+## digests while the writes of the previous ones are in flight:
+##  1. the receiver gets the digests and puts their records in the digest queue,
+##     blocking when it is full (back-pressure),
+##  2. the builder logs the records, counts the collisions (class 255) and
+##     timeouts (class 127), and builds the keys of the classified flows with
+##     the table handles looked up once; the flows of several digests are
+##     coalesced in a batch, handed to the writer when it holds batch_size flows
+##     or when its first flow is batch_deadline seconds old,
+##  3. the writer sends one entry_mod per table and per batch: flow_action_table
+##     (f_action 0 for the classified flows, installed with f_action 1 by the
+##     generator) and the reset of the registers.
+## The metrics are printed every REPORT_INTERVAL seconds and, with metrics_port,
+## served in the Prometheus text format (see control_metrics.py).
+import time
+import queue
+import threading
+from classification_log import log_digest, get_digest_columns
+from flow_eviction import SWEEP_INTERVAL, get_flows_to_add, add_flows, sweep_expired_flows, get_eviction_counters, \
+    report_eviction
+from register_sweeper import run_sweeper, get_sweeper_counters, report_sweeper
+from control_metrics import SIZE_BUCKETS, get_histogram, observe, copy_histogram, get_histogram_quantile, \
+    start_metrics_server, profile_phase
+
+## registers reset for every classified flow
+REGISTERS = ['Ingress.reg_status', 'Ingress.reg_classified_flag', 'Ingress.reg_flow_ID', 'Ingress.reg_time_occ',
+             'Ingress.reg_pkt_count', 'Ingress.reg_pkt_len_total', 'Ingress.reg_pkt_len_max', 'Ingress.reg_ack_flag_count']
+## digests waiting for the builder
+DIGEST_QUEUE_SIZE = 1024
+## batches waiting for the writer
+BATCH_QUEUE_SIZE = 4
+## classified flows per batch of writes
+BATCH_SIZE = 4096
+## seconds a classified flow waits at most before its batch is written
+BATCH_DEADLINE = 0.05
+## seconds without digests before the receiver stops
+DIGEST_TIMEOUT = 800
+## seconds between two reports of the metrics
+REPORT_INTERVAL = 10
+
+## table handles and constant action data, looked up once
+def get_table_handles(bfrt_client, bfrt_info, registers=REGISTERS):
+    flow_action_table = bfrt_info.table_get('Ingress.flow_action_table')
+    register_tables = {name: bfrt_info.table_get(name) for name in registers}
+    return {"flow_action_table": flow_action_table,
+            # f_action == 0 : Classified flow
+            "flow_action_data": flow_action_table.make_data([bfrt_client.DataTuple('f_action', 0)], 'Ingress.set_flow_action'),
+            "registers": register_tables,
+            "register_datas": {name: table.make_data([bfrt_client.DataTuple(name+'.f1', 0)])
+                               for name, table in register_tables.items()},
+            "p4_name": bfrt_info.p4_name_get()}
+
+## counters of the pipeline, each one updated by a single thread
+def get_pipeline_metrics():
+    return {"digests": 0, "records": 0, "collisions": 0, "timeouts": 0, "classified": 0,
+            "coalesced": 0, "batches": 0, "flows_written": 0, "flows_added": 0, "write_seconds": 0.0, "write_errors": 0,
+            "digest_queue_max": 0, "batch_queue_max": 0, "digest_blocked_puts": 0, "digest_blocked_seconds": 0.0,
+            "batch_blocked_puts": 0, "batch_blocked_seconds": 0.0, "classes": {},
+            "digest_size": get_histogram(SIZE_BUCKETS), "digest_get_seconds": get_histogram(),
+            "write_seconds_by_table": {}, "start": time.time()}
+
+## put an item in a bounded queue (digest or batch), measuring the time blocked when it is full
+def put_with_backpressure(items, item, metrics, name):
+    try:
+        items.put_nowait(item)
+    except queue.Full:
+        start = time.time()
+        items.put(item)
+        metrics[name+"_blocked_puts"] += 1
+        metrics[name+"_blocked_seconds"] += time.time() - start
+
+## receiver: records of every digest to the digest queue, None when no digest
+## arrives within the timeout or when stopped
+def receive_digests(interface, learn_filter, digests, metrics, stop, timeout=DIGEST_TIMEOUT):
+    while not stop.is_set():
+        start = time.time()
+        try:
+            digest = interface.digest_get(timeout=timeout)
+        except Exception:
+            break
+        observe(metrics["digest_get_seconds"], time.time() - start)
+        records = [data.to_dict() for data in learn_filter.make_data_list(digest)]
+        metrics["digests"] += 1
+        metrics["records"] += len(records)
+        observe(metrics["digest_size"], len(records))
+        put_with_backpressure(digests, records, metrics, "digest")
+        metrics["digest_queue_max"] = max(metrics["digest_queue_max"], digests.qsize())
+    digests.put(None)
+
+## a batch of writes: keys of the classified flows and of their register
+## indices, a flow or an index seen in several digests is written once
+def get_batch():
+    return {"flows": {}, "indices": {}, "first": None}
+
+## key of a flow (src, dst, dstport, srcport, protocol) in flow_action_table
+def get_flow_key(bfrt_client, flow_table, flow):
+    return flow_table.make_key(
+        [bfrt_client.KeyTuple('hdr.ipv4.src_addr', flow[0]), bfrt_client.KeyTuple('hdr.ipv4.dst_addr', flow[1]),
+         bfrt_client.KeyTuple('meta.hdr_dstport', flow[2]), bfrt_client.KeyTuple('meta.hdr_srcport', flow[3]),
+         bfrt_client.KeyTuple('hdr.ipv4.protocol', flow[4])])
+
+## add the classified flows of a digest to the batch
+def add_records(bfrt_client, handles, batch, records, metrics):
+    classes = metrics["classes"]
+    for record in records:
+        flow_class = record['flow_class']
+        classes[flow_class] = classes.get(flow_class, 0) + 1
+        if flow_class == 255:
+            metrics["collisions"] += 1
+            continue
+        if flow_class == 127:
+            metrics["timeouts"] += 1
+            continue
+        metrics["classified"] += 1
+        flow = (record['source_addr'], record['destin_addr'], record['destin_port'], record['source_port'], record['protocol'])
+        register_index = record['register_index']
+        if flow in batch["flows"] and register_index in batch["indices"]:
+            metrics["coalesced"] += 1
+            continue
+        if batch["first"] is None:
+            batch["first"] = time.time()
+        batch["flows"][flow] = get_flow_key(bfrt_client, handles["flow_action_table"], flow)
+        batch["indices"][register_index] = [table.make_key([bfrt_client.KeyTuple('$REGISTER_INDEX', register_index)])
+                                            for table in handles["registers"].values()]
+
+## builder: log the digests and coalesce their flows in batches for the writer
+def build_batches(bfrt_client, handles, digests, batches, log, metrics,
+                  batch_size=BATCH_SIZE, batch_deadline=BATCH_DEADLINE, profiler=None):
+    batch = get_batch()
+    while True:
+        timeout = None if batch["first"] is None else max(0.0, batch["first"] + batch_deadline - time.time())
+        try:
+            records = digests.get(timeout=timeout)
+        except queue.Empty:
+            records = []
+        if records is None:
+            break
+        if records:
+            with profile_phase(profiler, "build"):
+                if log is not None:
+                    log_digest(log, get_digest_columns(records))
+                add_records(bfrt_client, handles, batch, records, metrics)
+        if batch["first"] is not None and (len(batch["flows"]) >= batch_size or
+                                           time.time() - batch["first"] >= batch_deadline):
+            put_with_backpressure(batches, batch, metrics, "batch")
+            metrics["batch_queue_max"] = max(metrics["batch_queue_max"], batches.qsize())
+            batch = get_batch()
+    if batch["first"] is not None:
+        batches.put(batch)
+    batches.put(None)
+
+## time of a write to a table, from start
+def observe_write(metrics, table_name, start):
+    histograms = metrics["write_seconds_by_table"]
+    if table_name not in histograms:
+        histograms[table_name] = get_histogram()
+    observe(histograms[table_name], time.time() - start)
+
+## f_action 0 for the classified flows, returns the flows written (dict flow: key).
+## The flows are installed by the generator with f_action 1, so they are modified;
+## when the batch fails, every flow is modified alone and only the flows really
+## absent from the table (deleted by the eviction, or never installed) are added
+def write_flow_actions(handles, target, flows, metrics):
+    flow_table = handles["flow_action_table"]
+    flow_keys = list(flows.values())
+    if not flow_keys:
+        return flows
+    try:
+        flow_table.entry_mod(target, flow_keys, [handles["flow_action_data"]] * len(flow_keys), p4_name=handles["p4_name"])
+        return flows
+    except Exception:
+        written = {}
+        for flow, key in flows.items():
+            try:
+                flow_table.entry_mod(target, [key], [handles["flow_action_data"]], p4_name=handles["p4_name"])
+            except Exception:
+                try:
+                    flow_table.entry_add(target, [key], [handles["flow_action_data"]], p4_name=handles["p4_name"])
+                except Exception as error:
+                    metrics["write_errors"] += 1
+                    print("Write error:", error)
+                    continue
+                metrics["flows_added"] += 1
+            written[flow] = key
+        return written
+
+## writes of a batch: flow_action_table, then the reset of the registers (also
+## when some flows could not be written, so that their slots are freed)
+def write_batch(handles, target, batch, metrics, eviction=None):
+    start = time.time()
+    if eviction is None:
+        write_flow_actions(handles, target, batch["flows"], metrics)
+    else:
+        new_flows = get_flows_to_add(eviction, handles["flow_action_table"], target, batch["flows"], handles["p4_name"])
+        start = time.time()
+        add_flows(eviction, write_flow_actions(handles, target, new_flows, metrics))
+    observe_write(metrics, 'Ingress.flow_action_table', start)
+    register_keys = list(batch["indices"].values())
+    for position, (name, table) in enumerate(handles["registers"].items()):
+        start = time.time()
+        table.entry_mod(target, key_list=[keys[position] for keys in register_keys],
+                        data_list=[handles["register_datas"][name]] * len(register_keys),
+                        flags={"from_hw": True}, p4_name=handles["p4_name"])
+        observe_write(metrics, name, start)
+
+## writer: one write per table for every batch; with an eviction index only the
+## flows not pinned yet are written, after deleting the expired and least
+## recently used entries (see flow_eviction.py)
+def write_batches(handles, target, batches, metrics, eviction=None, profiler=None):
+    while True:
+        try:
+            batch = batches.get(timeout=None if eviction is None else SWEEP_INTERVAL)
+        except queue.Empty:
+            sweep_expired_flows(eviction, handles["flow_action_table"], target, handles["p4_name"])
+            continue
+        if batch is None:
+            break
+        start = time.time()
+        try:
+            with profile_phase(profiler, "write"):
+                write_batch(handles, target, batch, metrics, eviction)
+        except Exception as error:
+            # a failed batch must not stop the pipeline
+            metrics["write_errors"] += 1
+            print("Write error:", error)
+        metrics["batches"] += 1
+        metrics["flows_written"] += len(batch["flows"])
+        metrics["write_seconds"] += time.time() - start
+
+## metrics with the current depth of the queues and the eviction and sweeper counters
+def get_metrics_snapshot(metrics, digests=None, batches=None, eviction=None, sweeper=None):
+    snapshot = dict(metrics)
+    # the dicts updated by the other threads are copied
+    snapshot["classes"] = dict(metrics["classes"])
+    snapshot["digest_size"] = copy_histogram(metrics["digest_size"])
+    snapshot["digest_get_seconds"] = copy_histogram(metrics["digest_get_seconds"])
+    snapshot["write_seconds_by_table"] = {name: copy_histogram(histogram)
+                                          for name, histogram in dict(metrics["write_seconds_by_table"]).items()}
+    if eviction is not None:
+        snapshot["eviction"] = get_eviction_counters(eviction)
+    if sweeper is not None:
+        snapshot["sweeper"] = get_sweeper_counters(sweeper)
+    snapshot["elapsed"] = time.time() - metrics["start"]
+    snapshot["digest_queue_depth"] = digests.qsize() if digests is not None else 0
+    snapshot["batch_queue_depth"] = batches.qsize() if batches is not None else 0
+    return snapshot
+
+## print the metrics of the pipeline
+def report_metrics(snapshot):
+    elapsed = max(snapshot["elapsed"], 1e-9)
+    print("digests {} ({:.0f}/s) records {} ({:.0f}/s) classified {} collisions {} timeouts {}".format(
+        snapshot["digests"], snapshot["digests"]/elapsed, snapshot["records"], snapshot["records"]/elapsed,
+        snapshot["classified"], snapshot["collisions"], snapshot["timeouts"]))
+    print("queues: digests {}/{} (max {}, full {} times for {:.3f} s) batches {}/{} (max {}, full {} times for {:.3f} s)".format(
+        snapshot["digest_queue_depth"], DIGEST_QUEUE_SIZE, snapshot["digest_queue_max"], snapshot["digest_blocked_puts"],
+        snapshot["digest_blocked_seconds"], snapshot["batch_queue_depth"], BATCH_QUEUE_SIZE, snapshot["batch_queue_max"],
+        snapshot["batch_blocked_puts"], snapshot["batch_blocked_seconds"]))
+    print("writes: {} batches, {} flows ({} coalesced, {} added), {:.3f} s writing, {} errors".format(
+        snapshot["batches"], snapshot["flows_written"], snapshot["coalesced"], snapshot["flows_added"], snapshot["write_seconds"],
+        snapshot["write_errors"]))
+    latencies = [("digest_get", snapshot["digest_get_seconds"])] + list(snapshot["write_seconds_by_table"].items())
+    print("latency p50/p99 (ms): " + ", ".join("{} {}/{}".format(name.replace("Ingress.", ""), *[
+        "-" if bound is None else "inf" if bound == float("inf") else "{:g}".format(bound * 1000)
+        for bound in (get_histogram_quantile(histogram, 0.5), get_histogram_quantile(histogram, 0.99))])
+        for name, histogram in latencies))
+    if "eviction" in snapshot:
+        report_eviction(snapshot["eviction"])
+    if "sweeper" in snapshot:
+        report_sweeper(snapshot["sweeper"])
+
+## run the three stages (and the register sweeper, if given) until no digest
+## arrives within digest_timeout, reporting the metrics every report_interval
+## seconds (None: no report, the metrics are read by the caller)
+def run_pipeline(bfrt_client, interface, bfrt_info, learn_filter, target, log=None, metrics=None,
+                 digest_timeout=DIGEST_TIMEOUT, batch_size=BATCH_SIZE, batch_deadline=BATCH_DEADLINE, stop=None,
+                 eviction=None, sweeper=None, metrics_port=None, profiler=None, report_interval=REPORT_INTERVAL):
+    handles = get_table_handles(bfrt_client, bfrt_info)
+    metrics = get_pipeline_metrics() if metrics is None else metrics
+    stop = threading.Event() if stop is None else stop
+    digests = queue.Queue(maxsize=DIGEST_QUEUE_SIZE)
+    batches = queue.Queue(maxsize=BATCH_QUEUE_SIZE)
+    threads = [threading.Thread(target=receive_digests, args=(interface, learn_filter, digests, metrics, stop, digest_timeout)),
+               threading.Thread(target=build_batches, args=(bfrt_client, handles, digests, batches, log, metrics,
+                                                            batch_size, batch_deadline, profiler)),
+               threading.Thread(target=write_batches, args=(handles, target, batches, metrics, eviction, profiler))]
+    if sweeper is not None:
+        threads.insert(0, threading.Thread(target=run_sweeper, args=(bfrt_client, handles, target, sweeper, stop)))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    server = None
+    if metrics_port is not None:
+        server = start_metrics_server(lambda: get_metrics_snapshot(metrics, digests, batches, eviction, sweeper),
+                                      metrics_port)
+    try:
+        while threads[-1].is_alive():
+            threads[-1].join(report_interval)
+            if report_interval is not None:
+                report_metrics(get_metrics_snapshot(metrics, digests, batches, eviction, sweeper))
+        stop.set()
+    except KeyboardInterrupt:
+        # the receiver may be waiting for a digest: the builder is stopped directly
+        # and the batches already built are written
+        stop.set()
+        digests.put(None)
+        for thread in threads[-2:]:
+            thread.join()
+        report_metrics(get_metrics_snapshot(metrics, digests, batches, eviction, sweeper))
+    if server is not None:
+        server.shutdown()
+    return metrics
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+## Control plane of several Tofino switches (see control_shards.py): one worker
+## process and BF Runtime session per switch, the flows written in the tables of
+## the pipe of their ingress port, the metrics of the switches merged.
+## usage: python3 control_plane_sharded.py LOG_FILE
+##        the digests of every switch are logged in LOG_FILE with its name added
+
+import sys
+from bfrt_session import connect_switch
+from control_shards import run_switches
+
+filename_out = sys.argv[1]
+
+## switches served by the control plane: BF Runtime server, client_id and
+## device_id, and pipes written one by one (None: all the pipes at once, as
+## control_plane_unibs.py). The tables are symmetric by default; to write the
+## pipes one by one, install the entries on the program just loaded with
+## install_table_entries.py ENTRIES_FILE.npz GRPC_ADDR BATCH_SIZE --pipes 0,1,2,3
+## (flow_action_table and the registers made asymmetric, the flows installed in
+## every pipe), update them with model_update.py ... --pipes 0,1,2,3, and set
+## "pipes": [0, 1, 2, 3] with "pipe_scope": True; session_per_pipe writes every
+## pipe through its own session
+SWITCHES = [{"name": "tofino1", "grpc_addr": "_CONTROL_SERVER_IP:PORT", "client_id": 1, "device_id": 0,
+             "pipes": None, "pipe_scope": False, "session_per_pipe": False},
+            {"name": "tofino2", "grpc_addr": "_CONTROL_SERVER_IP:PORT", "client_id": 1, "device_id": 0,
+             "pipes": None, "pipe_scope": False, "session_per_pipe": False}]
+
+## log of the digests: csv, or parquet/arrow with pyarrow installed
+LOG_FORMAT = "csv"
+## rows per log file (None: a single file)
+LOG_ROTATE_ROWS = None
+
+## entries of flow_action_table expire after FLOW_TTL seconds without digests and
+## the least recently used ones are deleted over HIGH_WATER (fractions of the
+## table of every pipe)
+FLOW_TTL = 120
+HIGH_WATER = 0.9
+LOW_WATER = 0.8
+
+## register slots (MAX_REGISTER_ENTRIES) and timeout_threshold of the P4 program:
+## the slots of every pipe idle for longer than SLOT_TIMEOUT + SLOT_MARGIN are
+## reset every SWEEP_INTERVAL seconds (None: no sweeper)
+NUM_OF_SLOTS = 65536
+SLOT_TIMEOUT = 512
+SLOT_MARGIN = 512
+SWEEP_INTERVAL = 5.0
+
+## port of the Prometheus endpoint http://127.0.0.1:METRICS_PORT/metrics (None: no endpoint)
+METRICS_PORT = 9108
+
+options = {"connect": connect_switch, "log_path": filename_out, "log_format": LOG_FORMAT,
+           "log_rotate_rows": LOG_ROTATE_ROWS,
+           "eviction": {"ttl": FLOW_TTL, "high_water": HIGH_WATER, "low_water": LOW_WATER},
+           "sweeper": None if SWEEP_INTERVAL is None else {"num_of_slots": NUM_OF_SLOTS, "timeout": SLOT_TIMEOUT,
+                                                           "margin": SLOT_MARGIN, "interval": SWEEP_INTERVAL}}
+
+# Receive the digests of every switch, update flow_action_table and reset the
+# registers of the classified flows in their pipe, until no digest arrives
+metrics = run_switches(SWITCHES, options, metrics_port=METRICS_PORT)
@@ -2,155 +2,77 @@
 
 from __future__ import print_function
 
-import os
 import sys
 import pdb
 
-SDE_INSTALL   = os.environ['SDE_INSTALL']
-SDE_PYTHON2   = os.path.join(SDE_INSTALL, 'lib', 'python2.7', 'site-packages')
-sys.path.append(SDE_PYTHON2)
-sys.path.append(os.path.join(SDE_PYTHON2, 'tofino'))
-
-PYTHON3_VER   = '{}.{}'.format(
-                    sys.version_info.major,
-                    sys.version_info.minor)
-SDE_PYTHON3   = os.path.join(SDE_INSTALL, 'lib', 'python' + PYTHON3_VER, 'site-packages')
-sys.path.append(SDE_PYTHON3)
-sys.path.append(os.path.join(SDE_PYTHON3, 'tofino'))
-sys.path.append(os.path.join(SDE_PYTHON3, 'tofino', 'bfrt_grpc'))
-
-import grpc
-import bfrt_grpc.bfruntime_pb2 as bfruntime_pb2
-import bfrt_grpc.client as bfrt_client
-
 import time
-import socket, struct
+from bfrt_session import connect
+from classification_log import open_log, close_log, report_log
+from control_pipeline import run_pipeline
+from flow_eviction import open_flow_eviction
+from register_sweeper import open_register_sweeper
+from control_metrics import open_profiler, start_profiler, report_profile
 
 filename_out = sys.argv[1]
 
-#
-# Connect to the BF Runtime Server
-#
-interface = bfrt_client.ClientInterface(
-    grpc_addr = '_CONTROL_SERVER_IP:PORT',
-    client_id = 1,
-    device_id = 0)
-print('Connected to BF Runtime Server')
+## BF Runtime server of the switch
+GRPC_ADDR = '_CONTROL_SERVER_IP:PORT'
 
 #
-# Get the information about the running program
+# Connect to the BF Runtime Server, get the information about the running
+# program and establish that you are using it on the connection
 #
-bfrt_info = interface.bfrt_info_get()
+bfrt_client, interface, bfrt_info = connect(GRPC_ADDR)
+print('Connected to BF Runtime Server')
 print('The target runs the program ', bfrt_info.p4_name_get())
-#
-# Establish that you are using this program on the given connection
-#
-interface.bind_pipeline_config(bfrt_info.p4_name_get())
 
 learn_filter = bfrt_info.learn_get("digest")
 
-# List of registers
-## UNIBS
-registers = ['Ingress.reg_status','Ingress.reg_classified_flag','Ingress.reg_flow_ID','Ingress.reg_time_occ',
-            'Ingress.reg_pkt_count', 'Ingress.reg_pkt_len_total', 'Ingress.reg_pkt_len_max', 'Ingress.reg_ack_flag_count']
-
-#
-# Getting info about one specific table
-#
-flow_act_tbl = bfrt_info.table_get('Ingress.flow_action_table')
-print('Table max packet length info:', flow_act_tbl)
-
 # Target pipe_id=0xffff
 target = bfrt_client.Target(device_id=0, pipe_id=0xffff)
 
-header = 'source_addr,destin_addr,source_port,destin_port,protocol,flow_class,register_index'
-
-count = 0
-
-with open(filename_out, "w") as text_file:
-    text_file.write(header)
-    text_file.write("\n")
-
-## To show some statistics
-flow_counter = 0
-collision_counter = 0
-timeout_counter = 0
-
-while True:
-
-    try:
-        digest = interface.digest_get(timeout=800)
-    except:
-        break
-    
-    digest_type = 1
-    data_list = learn_filter.make_data_list(digest)
-    
-    
-    if digest_type == 1:
-        count = count + 1
-
-        flow_counter = flow_counter + len(data_list)
-            
-        keys_reg = {'Ingress.reg_status': [], 'Ingress.reg_classified_flag': [], 'Ingress.reg_flow_ID': [],'Ingress.reg_time_occ': [],
-                    'Ingress.reg_pkt_count': [], 'Ingress.reg_pkt_len_total': [], 'Ingress.reg_pkt_len_max': [], 'Ingress.reg_ack_flag_count': []}
-        datas_reg = {'Ingress.reg_status': [], 'Ingress.reg_classified_flag': [], 'Ingress.reg_flow_ID': [],'Ingress.reg_time_occ': [],
-                    'Ingress.reg_pkt_count': [], 'Ingress.reg_pkt_len_total': [], 'Ingress.reg_pkt_len_max': [], 'Ingress.reg_ack_flag_count': []}
-        keys_table = []
-        datas_table = []
-        for dd in data_list:
-            
-            data_dict = dd.to_dict()
-            
-            # convert ip address into normal format
-            source_addr = socket.inet_ntoa(struct.pack('!L', data_dict['source_addr']))
-            destin_addr = socket.inet_ntoa(struct.pack('!L', data_dict['destin_addr']))
-            source_port = str(data_dict['source_port'])
-            destin_port = str(data_dict['destin_port'])
-            protocol = str(data_dict['protocol'])
-            flow_class = str(data_dict['flow_class'])
-            register_index = data_dict['register_index']
-
-            csv_row = source_addr + ',' + destin_addr + ',' + source_port + ',' + destin_port + ',' + protocol + ',' + flow_class
-            
-            with open(filename_out, "a") as text_file:
-                    text_file.write(csv_row)
-                    text_file.write("\n")
-
-            if flow_class == '255':
-                print('######### collision #########')
-                collision_counter = collision_counter + 1
-                
-            elif flow_class == '127':
-                print('######### Timeout #########')
-                timeout_counter = timeout_counter + 1
-                
-            # elif flow_class == '200':
-            #     print('######### Recirc #########')
-
-            else:
-                    
-                keys_table.append(flow_act_tbl.make_key(
-                                [bfrt_client.KeyTuple('hdr.ipv4.src_addr', data_dict['source_addr']), bfrt_client.KeyTuple('hdr.ipv4.dst_addr', data_dict['destin_addr']), 
-                                bfrt_client.KeyTuple('meta.hdr_dstport', data_dict['destin_port']), bfrt_client.KeyTuple('meta.hdr_srcport', data_dict['source_port']),
-                                bfrt_client.KeyTuple('hdr.ipv4.protocol', data_dict['protocol'])]))
-
-                ## f_action == 0 : Classified flow
-                datas_table.append(flow_act_tbl.make_data([
-                                        bfrt_client.DataTuple('f_action', 0)
-                                    ], 'Ingress.set_flow_action'))
-
-                for reg_name in registers:
-                    reg_tbl = bfrt_info.table_get(reg_name)
-                    keys_reg[reg_name].append(reg_tbl.make_key([bfrt_client.KeyTuple('$REGISTER_INDEX', register_index)]))
-                    datas_reg[reg_name].append(reg_tbl.make_data([bfrt_client.DataTuple(reg_name+'.f1', 0)]))
-
-        ### Update table and refresh registers:
-        flow_act_tbl.entry_mod(target, keys_table, datas_table, p4_name=bfrt_info.p4_name_get())
-        for reg_name in registers:
-            reg_tbl = bfrt_info.table_get(reg_name)
-            reg_tbl.entry_mod(target, key_list=keys_reg[reg_name], data_list=datas_reg[reg_name], flags={"from_hw":True}, p4_name=bfrt_info.p4_name_get())
-
-            
-    print('\nCollision Counter:\n', collision_counter)
-    print('\nTimeout Counter:\n', timeout_counter)
+## log of the digests: csv, or parquet/arrow with pyarrow installed
+LOG_FORMAT = "csv"
+## rows per log file (None: a single file)
+LOG_ROTATE_ROWS = None
+
+log = open_log(filename_out, LOG_FORMAT, rotate_rows=LOG_ROTATE_ROWS)
+
+## entries of flow_action_table expire after FLOW_TTL seconds without digests and
+## the least recently used ones are deleted over HIGH_WATER (fractions of the table)
+FLOW_TTL = 120
+HIGH_WATER = 0.9
+LOW_WATER = 0.8
+
+eviction = open_flow_eviction(ttl=FLOW_TTL, high_water=HIGH_WATER, low_water=LOW_WATER)
+
+## register slots (MAX_REGISTER_ENTRIES) and timeout_threshold of the P4 program:
+## the slots idle for longer than SLOT_TIMEOUT + SLOT_MARGIN are reset every
+## SWEEP_INTERVAL seconds (None: no sweeper)
+NUM_OF_SLOTS = 65536
+SLOT_TIMEOUT = 512
+SLOT_MARGIN = 512
+SWEEP_INTERVAL = 5.0
+
+sweeper = None
+if SWEEP_INTERVAL is not None:
+    sweeper = open_register_sweeper(NUM_OF_SLOTS, SLOT_TIMEOUT, SLOT_MARGIN, interval=SWEEP_INTERVAL)
+
+## port of the Prometheus endpoint http://127.0.0.1:METRICS_PORT/metrics (None: no endpoint)
+METRICS_PORT = 9108
+## sample the key building and the writes to find where the time goes
+PROFILE = False
+
+profiler = open_profiler() if PROFILE else None
+if profiler is not None:
+    start_profiler(profiler)
+
+# Receive the digests, update flow_action_table and reset the registers of the
+# classified flows (see control_pipeline.py), until no digest arrives
+metrics = run_pipeline(bfrt_client, interface, bfrt_info, learn_filter, target, log, eviction=eviction,
+                       sweeper=sweeper, metrics_port=METRICS_PORT, profiler=profiler)
+
+close_log(log)
+report_log(log)
+if profiler is not None:
+    report_profile(profiler)
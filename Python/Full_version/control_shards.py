@@ -0,0 +1,243 @@
+## Sharded control plane for several switches and pipes.
+## Every switch is served by its own worker process, with its own BF Runtime
+## session, so that the key building and the writes of the switches run in
+## parallel. In a worker, the receiver gets the digests of the switch, logs them
+## and splits their records by the pipe owning the ingress port of the flow
+## (ingress_port[8:7]); every pipe runs the pipeline of control_pipeline.py
+## (builder and writer threads) on its records, writing flow_action_table and
+## the registers of that pipe only (target pipe_id = pipe), with its own
+## eviction index and register sweeper. With session_per_pipe a pipe also writes
+## through its own session (client_id + 1 + pipe). A switch without "pipes"
+## writes all the pipes at once (pipe_id 0xffff), as control_plane_unibs.py.
+## The workers send a snapshot of their metrics every report_interval seconds;
+## the snapshots of the switches are merged, printed and served in the
+## Prometheus text format, with the metrics of every switch under switches_NAME.
+import os
+import re
+import time
+import signal
+import queue
+import threading
+import multiprocessing
+from types import SimpleNamespace
+from classification_log import open_log, close_log, report_log, log_digest, get_digest_columns
+from control_pipeline import DIGEST_QUEUE_SIZE, DIGEST_TIMEOUT, BATCH_SIZE, BATCH_DEADLINE, REPORT_INTERVAL, \
+    run_pipeline, get_pipeline_metrics, get_metrics_snapshot, report_metrics
+from control_metrics import merge_snapshots, start_metrics_server
+from flow_eviction import open_flow_eviction
+from register_sweeper import open_register_sweeper
+
+## pipes of a Tofino switch, the pipe of a port is in its bits 8:7
+NUM_OF_PIPES = 4
+## seconds the last snapshots and the end of the workers are waited for after an interruption
+SNAPSHOT_TIMEOUT = 5.0
+
+## pipe of a device port
+def get_port_pipe(port):
+    return (port >> 7) & (NUM_OF_PIPES - 1)
+
+## log of a switch: the name of the switch added to the name of the log
+def get_switch_log_path(path, name):
+    root, extension = os.path.splitext(path)
+    return root + "_" + name + extension
+
+## digest source of a pipe, fed with the records of the pipe by the receiver of the
+## switch; it waits until the receiver stops, whatever the timeout of the pipeline
+def get_queue_digest_source(records_queue):
+
+    def digest_get(timeout=None):
+        records = records_queue.get()
+        if records is None:
+            raise RuntimeError("receiver of the switch stopped")
+        return records
+
+    interface = SimpleNamespace(digest_get=digest_get)
+    learn_filter = SimpleNamespace(make_data_list=lambda records: [SimpleNamespace(to_dict=lambda record=record: record)
+                                                                   for record in records])
+    return interface, learn_filter
+
+## receiver of a switch: log the digests and put their records in the queue of
+## their pipe (records of a pipe not served by the switch are counted and dropped)
+def split_digests(interface, learn_filter, pipe_queues, counters, log, stop, timeout=DIGEST_TIMEOUT):
+    while not stop.is_set():
+        try:
+            digest = interface.digest_get(timeout=timeout)
+        except Exception:
+            break
+        records = [data.to_dict() for data in learn_filter.make_data_list(digest)]
+        counters["digests"] += 1
+        if log is not None:
+            log_digest(log, get_digest_columns(records))
+        if None in pipe_queues:
+            pipe_queues[None].put(records)
+            continue
+        pipe_records = {}
+        for record in records:
+            pipe_records.setdefault(get_port_pipe(record['ingress_port']), []).append(record)
+        for pipe, records in pipe_records.items():
+            if pipe in pipe_queues:
+                pipe_queues[pipe].put(records)
+            else:
+                counters["pipe_misses"] += len(records)
+    for pipe_queue in pipe_queues.values():
+        pipe_queue.put(None)
+
+## snapshot of the metrics of a switch: the pipelines of its pipes merged, the
+## digests counted by the receiver and the flows written per pipe
+def get_switch_snapshot(pipe_metrics, counters, evictions, sweepers):
+    snapshots = {pipe: get_metrics_snapshot(metrics, eviction=evictions[pipe], sweeper=sweepers[pipe])
+                 for pipe, metrics in pipe_metrics.items()}
+    snapshot = merge_snapshots(snapshots.values())
+    snapshot.update(counters)
+    if None not in snapshots:
+        snapshot["flows_by_pipe"] = {pipe: pipe_snapshot["flows_written"] for pipe, pipe_snapshot in snapshots.items()}
+    return snapshot
+
+## worker of a switch: its receiver and the pipelines of its pipes, until no
+## digest arrives; a snapshot of the metrics is put in snapshots every
+## report_interval seconds, and a last one with "done"
+def run_switch(switch, options, snapshots, stop):
+    name = switch["name"]
+    try:
+        session = options["connect"](switch)
+        pipes = switch.get("pipes") or [None]
+        log = None
+        if options.get("log_path"):
+            log = open_log(get_switch_log_path(options["log_path"], name), options.get("log_format", "csv"),
+                           rotate_rows=options.get("log_rotate_rows"))
+        pipe_queues = {pipe: queue.Queue(maxsize=DIGEST_QUEUE_SIZE) for pipe in pipes}
+        counters = {"digests": 0, "pipe_misses": 0}
+        pipe_metrics = {pipe: get_pipeline_metrics() for pipe in pipes}
+        evictions = {pipe: open_flow_eviction(**options["eviction"]) if options.get("eviction") is not None else None
+                     for pipe in pipes}
+        sweepers = {pipe: open_register_sweeper(**options["sweeper"]) if options.get("sweeper") is not None else None
+                    for pipe in pipes}
+        threads = [threading.Thread(target=split_digests, args=(session["interface"], session["learn_filter"],
+                                                                pipe_queues, counters, log, stop,
+                                                                options.get("digest_timeout", DIGEST_TIMEOUT)))]
+        for index, pipe in enumerate(pipes):
+            pipe_session = session
+            if pipe is not None and switch.get("session_per_pipe"):
+                pipe_session = options["connect"](dict(switch, client_id=switch.get("client_id", 1) + 1 + index))
+            bfrt_client = pipe_session["bfrt_client"]
+            target = bfrt_client.Target(device_id=switch.get("device_id", 0), pipe_id=0xffff if pipe is None else pipe)
+            interface, learn_filter = get_queue_digest_source(pipe_queues[pipe])
+            threads.append(threading.Thread(target=run_pipeline, args=(bfrt_client, interface, pipe_session["bfrt_info"],
+                                                                      learn_filter, target), kwargs={
+                "metrics": pipe_metrics[pipe], "eviction": evictions[pipe], "sweeper": sweepers[pipe],
+                "batch_size": options.get("batch_size", BATCH_SIZE),
+                "batch_deadline": options.get("batch_deadline", BATCH_DEADLINE), "report_interval": None}))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        interval = options.get("report_interval", REPORT_INTERVAL)
+        stopped = False
+        while any(thread.is_alive() for thread in threads[1:]):
+            if stopped:
+                threads[-1].join(interval)
+            elif stop.wait(interval):
+                # the receiver may be waiting for a digest: the pipes are stopped
+                # directly and write the batches already built
+                stopped = True
+                for pipe_queue in pipe_queues.values():
+                    pipe_queue.put(None)
+            snapshots.put((name, get_switch_snapshot(pipe_metrics, counters, evictions, sweepers)))
+        for thread in threads[1:]:
+            thread.join()
+        if log is not None:
+            close_log(log)
+            report_log(log)
+        snapshot = get_switch_snapshot(pipe_metrics, counters, evictions, sweepers)
+    except Exception as error:
+        print("Switch {}: {}".format(name, error))
+        snapshot = {"error": str(error)}
+    snapshots.put((name, dict(snapshot, done=True)))
+
+## worker process of a switch: an interruption is handled by the parent, which
+## sets stop
+def run_switch_process(switch, options, snapshots, stop):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_switch(switch, options, snapshots, stop)
+
+## metrics of the switches merged, with the ones of every switch under "switches"
+def get_merged_snapshot(switch_snapshots):
+    snapshots = [snapshot for snapshot in switch_snapshots.values() if "error" not in snapshot]
+    merged = merge_snapshots([{name: value for name, value in snapshot.items() if name != "done"}
+                              for snapshot in snapshots])
+    merged.pop("flows_by_pipe", None)
+    # metric names: the names of the switches with only letters, digits and underscores
+    merged["switches"] = {re.sub(r"\W", "_", name): {key: value for key, value in snapshot.items() if key != "done"}
+                          for name, snapshot in switch_snapshots.items()}
+    return merged
+
+## print the merged metrics and one line per switch
+def report_switches(merged):
+    if "digests" in merged:
+        report_metrics(dict({"digest_queue_depth": 0, "batch_queue_depth": 0}, **merged))
+    for name, snapshot in merged["switches"].items():
+        if "error" in snapshot:
+            print("switch {}: error {}".format(name, snapshot["error"]))
+            continue
+        elapsed = max(snapshot["elapsed"], 1e-9)
+        print("switch {}: digests {} records {} ({:.0f}/s) flows written {} in {} batches, {} errors, {} records "
+              "of other pipes, flows by pipe {}".format(
+                  name, snapshot["digests"], snapshot["records"], snapshot["records"]/elapsed, snapshot["flows_written"],
+                  snapshot["batches"], snapshot["write_errors"], snapshot["pipe_misses"],
+                  snapshot.get("flows_by_pipe", "-")))
+
+## run a worker per switch (forked processes, threads without fork) until no
+## digest arrives at any of them; options: "connect" (switch -> session, see
+## bfrt_session.connect_switch), "log_path", "log_format", "log_rotate_rows",
+## "eviction" and "sweeper" (arguments of open_flow_eviction and
+## open_register_sweeper, None: no eviction or sweeper), "batch_size",
+## "batch_deadline", "digest_timeout", "report_interval"; returns the merged metrics
+def run_switches(switches, options, metrics_port=None):
+    interval = options.get("report_interval", REPORT_INTERVAL)
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        snapshots, stop = context.Queue(), context.Event()
+        workers = [context.Process(target=run_switch_process, args=(switch, options, snapshots, stop)) for switch in switches]
+    else:
+        snapshots, stop = queue.Queue(), threading.Event()
+        workers = [threading.Thread(target=run_switch, args=(switch, options, snapshots, stop)) for switch in switches]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    switch_snapshots = {}
+    done = set()
+    server = None
+    if metrics_port is not None:
+        server = start_metrics_server(lambda: get_merged_snapshot(dict(switch_snapshots)), metrics_port)
+    last_report = time.time()
+    try:
+        while len(done) < len(workers):
+            try:
+                name, snapshot = snapshots.get(timeout=interval)
+                switch_snapshots[name] = snapshot
+                if snapshot.get("done"):
+                    done.add(name)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    break
+            if time.time() - last_report >= interval:
+                report_switches(get_merged_snapshot(switch_snapshots))
+                last_report = time.time()
+    except KeyboardInterrupt:
+        # the receivers stop after their current digest and the pipes write their batches
+        stop.set()
+        deadline = time.time() + SNAPSHOT_TIMEOUT
+        while len(done) < len(workers) and time.time() < deadline:
+            try:
+                name, snapshot = snapshots.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            switch_snapshots[name] = snapshot
+            if snapshot.get("done"):
+                done.add(name)
+    for worker in workers:
+        worker.join(SNAPSHOT_TIMEOUT)
+    merged = get_merged_snapshot(switch_snapshots)
+    report_switches(merged)
+    if server is not None:
+        server.shutdown()
+    return merged
@@ -0,0 +1,311 @@
+## Early-exit inference: the flows are classified at their 1st or 2nd packet when
+## the trees are confident enough, at the 3rd packet (model of the generator)
+## otherwise. Every early phase (packet count) has its own model, with the trees,
+## classes and features of the final model but trained on the features after
+## that packet, and a threshold on the certainty of its leaves (the percentage
+## of the training flows of the leaf in its class, as compiled in the code
+## tables). The leaves below the threshold get no code table entry, so a tree
+## reaching them votes class 0, and the voting table of the phase only has the
+## entries of a strict majority of the trees: a flow leaves the inference at the
+## first phase where a majority of the trees reach confident leaves of the same
+## class, the other flows go on to the next phase.
+## The threshold of a phase is the lowest certainty whose early classifications
+## are at least as accurate as min_accuracy (by default the accuracy of the switch
+## at the 3rd packet) on held-out flows not classified by the previous phases.
+## The tables of a phase (table_featureN_pK, code_tableN_pK, voting_table_pK, with
+## the actions SetCodeN_pK) are declared in early_exit_tables.p4 and applied
+## from early_exit_apply.p4, both generated with the entries; they write the same
+## codeword and class metadata as the tables of the 3rd packet, so the codewords
+## take the largest width of the phases.
+import json
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from rf_compiler import get_leaf_class
+from compile_cache import compile_feature_tables_cached, compile_trees_cached
+from entries_minimizer import minimize_entries
+from entries_artifact import get_feature_table_entries, get_feature_table_ternary_entries, get_code_table_entries, \
+    get_voting_table_entries, get_num_of_entries, from_column
+from voting_compiler import get_majority_voting_entries
+from tcam_expansion import get_feature_ternary_entries
+from codeword_layout import get_codeword_layout, get_codeword_fields, get_feature_code_trees, get_set_code_action_lines
+from pipeline_emulator import get_emulator, emulate_pipeline
+from feature_quantization import get_feature_widths, quantize_forest
+from budget_pruning import TREE_LEAF, get_switch_features, get_switch_classes, get_voting_tables
+
+## packet counts that can be an early phase (the 3rd packet is the final model)
+EARLY_EXIT_PACKETS = [1, 2]
+## fewest held-out flows a phase must classify for its threshold to be chosen
+MIN_EARLY_FLOWS = 30
+## class of the leaves below the threshold while the entries are minimized
+ABSTAIN_CLASS = -1
+## P4 includes of the tables of the phases (in the Ingress control) and of their
+## apply (after the tables of the 3rd packet)
+EARLY_EXIT_TABLES_P4 = "early_exit_tables.p4"
+EARLY_EXIT_APPLY_P4 = "early_exit_apply.p4"
+
+## suffix of the tables and actions of a phase
+def get_phase_suffix(packets):
+    return "_p" + str(packets)
+
+## rows of the flows present in every dataset (one row per flow id), in the same order
+def align_phase_rows(datasets, key="flow.id"):
+    datasets = [dataset.drop_duplicates(key).set_index(key) for dataset in datasets]
+    flows = datasets[-1].index
+    for dataset in datasets[:-1]:
+        flows = flows[flows.isin(dataset.index)]
+    return [dataset.loc[flows].reset_index() for dataset in datasets]
+
+## one model per phase with the hyperparameters of the final model, trained on
+## the features of the flows after that many packets {packets: (X, y)}
+def fit_phase_models(clf, phase_data):
+    return {packets: clone(clf).fit(X, y) for packets, (X, y) in phase_data.items()}
+
+## certainty of every leaf of a tree (0 for the splits)
+def get_node_certainties(tree_):
+    certainties = np.zeros(tree_.node_count, dtype=np.int64)
+    for node in np.flatnonzero(tree_.children_left == TREE_LEAF):
+        certainties[node] = get_leaf_class(tree_, node)[1]
+    return certainties
+
+## class (numbered from 1) and certainty of the leaf reached by every flow in every tree
+def get_tree_votes(forest, features):
+    classes, certainties = [], []
+    for estimator in forest.estimators_:
+        tree_ = estimator.tree_
+        leaves = estimator.apply(features)
+        classes.append(tree_.value[leaves, 0].argmax(axis=1) + 1)
+        certainties.append(get_node_certainties(tree_)[leaves])
+    return np.stack(classes, axis=1), np.stack(certainties, axis=1)
+
+## class of the early exit of every flow (numbered from 1, 0: no exit): the class
+## of a strict majority of the trees reaching a leaf of at least certainty
+def get_early_classes(classes, certainties, certainty):
+    votes = np.where(certainties >= certainty, classes, 0)
+    agreeing = np.where(votes > 0, (votes[:, :, None] == votes[:, None, :]).sum(axis=2), 0)
+    winners = votes[np.arange(len(votes)), agreeing.argmax(axis=1)]
+    return np.where(agreeing.max(axis=1, initial=0) * 2 > votes.shape[1], winners, 0)
+
+## lowest threshold whose early exits are at least min_accuracy accurate on at
+## least min_flows flows (None: the phase classifies no flow)
+def choose_certainty(classes, certainties, labels, min_accuracy, min_flows=MIN_EARLY_FLOWS):
+    for certainty in np.unique(certainties):
+        early = get_early_classes(classes, certainties, certainty)
+        exits = early > 0
+        if exits.sum() >= min_flows and (early[exits] == labels[exits]).mean() >= min_accuracy:
+            return int(certainty)
+    return None
+
+## thresholds of the early phases on held-out flows: phase_features {packets: X}
+## and final_features are the features of the same flows (see align_phase_rows)
+## after that many packets and after the 3rd one, in the columns of the model.
+## The phases are chosen in order, each one on the flows not classified by the
+## previous ones; returns the table of the phases, the thresholds {packets: certainty}
+## and the accuracy of the switch with and without early exit
+def search_early_exit(clf, final_features, phase_models, phase_features, y, feature_widths=None, min_accuracy=None,
+                      min_flows=MIN_EARLY_FLOWS):
+    if feature_widths is None:
+        feature_widths = get_feature_widths(len(clf.feature_names_in_))
+    labels = np.searchsorted(clf.classes_, np.asarray(y)) + 1
+    voting_tables = get_voting_tables(len(clf.estimators_), len(clf.classes_))
+    final = np.searchsorted(clf.classes_, get_switch_classes(clf, get_switch_features(final_features, feature_widths),
+                                                             voting_tables)) + 1
+    if min_accuracy is None:
+        min_accuracy = float((final == labels).mean())
+    predicted = final.copy()
+    remaining = np.ones(len(labels), dtype=bool)
+    rows, thresholds = [], {}
+    for packets in sorted(phase_models):
+        model = phase_models[packets]
+        if packets not in EARLY_EXIT_PACKETS or list(model.classes_) != list(clf.classes_):
+            raise ValueError("the model of packet {} is not an early phase of the model".format(packets))
+        flows = np.flatnonzero(remaining)
+        classes, certainties = get_tree_votes(model, get_switch_features(phase_features[packets], feature_widths)[flows])
+        certainty = choose_certainty(classes, certainties, labels[flows], min_accuracy, min_flows)
+        row = {"packets": packets, "flows": len(flows), "certainty": certainty, "early_flows": 0,
+               "early_accuracy": None, "final_accuracy": None}
+        if certainty is not None:
+            early = get_early_classes(classes, certainties, certainty)
+            exits = flows[early > 0]
+            row.update({"early_flows": len(exits), "early_accuracy": float((early[early > 0] == labels[exits]).mean()),
+                        "final_accuracy": float((final[exits] == labels[exits]).mean())})
+            predicted[exits] = early[early > 0]
+            remaining[exits] = False
+            thresholds[packets] = certainty
+        rows.append(row)
+    accuracy = {"final": float((final == labels).mean()), "early_exit": float((predicted == labels).mean()),
+                "min_accuracy": min_accuracy, "early_flows": int((~remaining).sum())}
+    return pd.DataFrame(rows), thresholds, accuracy
+
+## store and load the phases of the generator {packets: (model file, certainty)}
+def save_early_exit(phases, path):
+    with open(path, "w") as config_file:
+        json.dump({str(packets): {"model": model_file, "certainty": certainty}
+                   for packets, (model_file, certainty) in phases.items()}, config_file, indent=1)
+
+def load_early_exit(path):
+    with open(path) as config_file:
+        return {int(packets): (phase["model"], phase["certainty"]) for packets, phase in json.load(config_file).items()}
+
+## feature tables, code table leaves and codeword layout of a phase; the leaves
+## below the certainty are minimized as a class of their own, then dropped
+def compile_phase(compile_cache, forest, feature_names, packets, certainty, feature_widths, minimize=True):
+    feature_tables = compile_feature_tables_cached(compile_cache, forest, feature_names)
+    forest_leaves = compile_trees_cached(compile_cache, forest, feature_names)
+    phase = {"packets": packets, "certainty": certainty, "forest": forest, "compiled_feature_tables": feature_tables,
+             "leaves": sum(len(leaves) for leaves in forest_leaves),
+             "confident_leaves": sum(int((leaves["Certainty"] >= certainty).sum()) for leaves in forest_leaves)}
+    forest_leaves = [leaves.assign(Class=np.where(leaves["Certainty"] >= certainty, leaves["Class"], ABSTAIN_CLASS))
+                     for leaves in forest_leaves]
+    if minimize:
+        feature_tables, forest_leaves, minimization = minimize_entries(feature_tables, forest_leaves, feature_widths)
+    phase["feature_tables"] = feature_tables
+    phase["forest_leaves"] = [leaves[leaves["Class"] != ABSTAIN_CLASS].reset_index(drop=True) for leaves in forest_leaves]
+    phase["layout"] = get_codeword_layout(feature_tables, len(forest.estimators_))
+    return phase
+
+## tables of the entries artifact of a phase, named with its suffix; the code and
+## voting tables share the actions of the tables of the 3rd packet
+def get_phase_tables(phase, num_of_classes, feature_widths, ternary_features=False):
+    suffix = get_phase_suffix(phase["packets"])
+    num_of_trees = len(phase["layout"]["codeword_widths"])
+    tables = []
+    for fea, feature_table in enumerate(phase["feature_tables"]):
+        if ternary_features:
+            ternary_entries = get_feature_ternary_entries(feature_table, num_of_trees, feature_widths[fea])
+            table = get_feature_table_ternary_entries(fea, ternary_entries, num_of_trees,
+                                                      get_feature_code_trees(phase["layout"], fea))
+        else:
+            table = get_feature_table_entries(fea, feature_table, num_of_trees)
+        tables.append(dict(table, table=table["table"]+suffix, action=table["action"]+suffix))
+    for tree_id, leaves in enumerate(phase["forest_leaves"]):
+        table = get_code_table_entries(tree_id, leaves)
+        tables.append(dict(table, table=table["table"]+suffix))
+    table = get_voting_table_entries(get_majority_voting_entries(num_of_trees, num_of_classes), num_of_trees)
+    tables.append(dict(table, table=table["table"]+suffix))
+    return tables
+
+## compile the phases of an early-exit file (see save_early_exit) for the generator,
+## with the quantization of the final model {feature: (shift, width)} if any
+def get_early_exit_phases(compile_cache, path, clf, feature_widths, minimize=True, ternary_features=False,
+                          quantization=None):
+    feature_names = clf.feature_names_in_
+    phases = []
+    for packets, (model_file, certainty) in sorted(load_early_exit(path).items()):
+        forest = pd.read_pickle(model_file)
+        if packets not in EARLY_EXIT_PACKETS or len(forest.estimators_) != len(clf.estimators_) or \
+                list(forest.classes_) != list(clf.classes_) or list(forest.feature_names_in_) != list(feature_names):
+            raise ValueError("{}: packet {} is not an early phase of the model (packet {}, same trees, classes and "
+                             "features)".format(model_file, packets, " or ".join(map(str, EARLY_EXIT_PACKETS))))
+        if quantization:
+            forest = quantize_forest(forest, feature_names, quantization)
+        phase = compile_phase(compile_cache, forest, feature_names, packets, certainty, feature_widths, minimize)
+        phase["tables"] = get_phase_tables(phase, len(clf.classes_), feature_widths, ternary_features)
+        phases.append(phase)
+    return phases
+
+## bfrt_python lines adding the entries of a table of the artifact
+def get_table_script_lines(table):
+    names = list(table["columns"])
+    params = [name.split(".")[-1].lstrip("$") for name in names]
+    columns = [from_column(table["columns"][name]) for name in names]
+    call = "p4." + table["table"] + ".add_with_" + table["action"].split(".")[-1]
+    return "".join(call + "(" + ", ".join(param + "=" + str(value) for param, value in zip(params, row)) + ")\n"
+                   for row in zip(*columns))
+
+## emulate the tables of a phase on feature rows and compare them with the early
+## exits of its model; returns the number of rows that differ
+def check_phase(phase, feature_widths, features):
+    suffix = get_phase_suffix(phase["packets"])
+    tables = [dict(table, table=table["table"][:-len(suffix)]) for table in phase["tables"]]
+    final_classes, tree_classes = emulate_pipeline(get_emulator(tables, phase["layout"], feature_widths), features)
+    classes, certainties = get_tree_votes(phase["forest"], get_switch_features(features, feature_widths))
+    expected = get_early_classes(classes, certainties, phase["certainty"])
+    mismatches = int((final_classes != expected).sum())
+    print("{:<16} {:>9} rows differ from the early exits of packet {} ({} rows classified)".format(
+        "voting_table"+suffix, mismatches, phase["packets"], int((expected > 0).sum())))
+    return mismatches
+
+## layout of the tables of the 3rd packet with the widest codewords of the
+## phases and their fields, for the codeword metadata shared by all of them (codewords.p4)
+def get_shared_layout(layout, phases):
+    widths = [max([width] + [phase["layout"]["codeword_widths"][tree_id] for phase in phases])
+              for tree_id, width in enumerate(layout["codeword_widths"])]
+    return dict(layout, codeword_widths=widths, **get_codeword_fields(widths))
+
+## size of every table of the phases: the size of the matching table of the 3rd
+## packet, or its entries when they do not fit
+def get_early_exit_table_sizes(phases, table_sizes):
+    sizes = {}
+    for phase in phases:
+        suffix = get_phase_suffix(phase["packets"])
+        for table in phase["tables"]:
+            name = table["table"].split(".")[-1]
+            sizes[name] = max(table_sizes.get(name[:-len(suffix)], 0), get_num_of_entries(table), 1)
+    return sizes
+
+## P4 declaration of a table with the nop default action
+def get_table_p4_lines(name, keys, actions, size):
+    lines = ["    table "+name+" {", "        key = {"]
+    lines += ["            "+key+";" for key in keys]
+    lines += ["        }", "        actions = {"+actions+"}", "        size = "+str(size)+";",
+              "        const default_action = nop();", "    }"]
+    return lines
+
+## P4 actions and tables of the phases (included in the Ingress control after
+## the voting table); the feature tables match the fields of the tables of the
+## 3rd packet and the codewords are in the fields of the shared layout
+def get_early_exit_tables_p4(phases, shared_layout, table_keys, sizes):
+    lines = ["/* -*- P4_16 -*- */", "/* Generated by generate_table_entries_from_RF.py, do not edit */"]
+    for phase in phases:
+        suffix = get_phase_suffix(phase["packets"])
+        num_of_trees = len(phase["layout"]["codeword_widths"])
+        lines += ["", "    /* Early exit at packet "+str(phase["packets"])+": leaves of certainty >= "+
+                  str(phase["certainty"])+", strict majority of the trees */"]
+        lines += get_set_code_action_lines(phase["layout"], suffix, shared_layout)
+        for fea in range(len(phase["feature_tables"])):
+            name = "table_feature"+str(fea)
+            field, match_type, width = table_keys[name][0]
+            lines += get_table_p4_lines(name+suffix, [field+": "+match_type+' @name("feature'+str(fea)+'")',
+                                                      "meta.model_version: ternary"],
+                                        "@defaultonly nop; SetCode"+str(fea)+suffix+";", sizes[name+suffix])
+        for tree_id in range(num_of_trees):
+            name = "code_table"+str(tree_id)+suffix
+            lines += get_table_p4_lines(name, ["meta.CODEWORD"+str(tree_id)+': ternary @name("meta.codeword'+str(tree_id)+'")',
+                                               "meta.model_version: ternary"],
+                                        "@defaultonly nop; SetClass"+str(tree_id)+";", sizes[name])
+        lines += get_table_p4_lines("voting_table"+suffix, ["meta.class"+str(tree_id)+": ternary"
+                                                            for tree_id in range(num_of_trees)],
+                                    "set_final_class; @defaultonly nop;", sizes["voting_table"+suffix])
+    return "\n".join(lines) + "\n"
+
+## P4 applying the tables of the phases (included in the apply block after the
+## tables of the 3rd packet, one else branch per phase)
+def get_early_exit_apply_p4(phases):
+    lines = ["/* -*- P4_16 -*- */", "/* Generated by generate_table_entries_from_RF.py, do not edit */"]
+    for phase in phases:
+        suffix = get_phase_suffix(phase["packets"])
+        lines.append("                else if (meta.pkt_count == "+str(phase["packets"])+") {")
+        lines += ["                    table_feature"+str(fea)+suffix+".apply();" for fea in range(len(phase["feature_tables"]))]
+        lines += ["                    code_table"+str(tree_id)+suffix+".apply();"
+                  for tree_id in range(len(phase["layout"]["codeword_widths"]))]
+        lines += ["                    voting_table"+suffix+".apply();", "                }"]
+    return "\n".join(lines) + "\n"
+
+## write the P4 includes of the phases (without phases the flows are only
+## classified at the 3rd packet); returns the sizes of their tables
+def write_early_exit_includes(phases, shared_layout, include_dir, table_keys, table_sizes):
+    sizes = get_early_exit_table_sizes(phases, table_sizes)
+    with open(include_dir+"/"+EARLY_EXIT_TABLES_P4, "w") as p4_file:
+        p4_file.write(get_early_exit_tables_p4(phases, shared_layout, table_keys, sizes))
+    with open(include_dir+"/"+EARLY_EXIT_APPLY_P4, "w") as p4_file:
+        p4_file.write(get_early_exit_apply_p4(phases))
+    return sizes
+
+## print the threshold, leaves and codewords of every phase
+def report_early_exit(phases):
+    for phase in phases:
+        print("early exit at packet {}: certainty >= {}, {} of {} leaves kept in {} code table entries, "
+              "codeword widths {}".format(phase["packets"], phase["certainty"], phase["confident_leaves"],
+                                          phase["leaves"], sum(len(leaves) for leaves in phase["forest_leaves"]),
+                                          phase["layout"]["codeword_widths"]))
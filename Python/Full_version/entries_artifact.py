@@ -0,0 +1,156 @@
+## Compact serialized table entries for the Flowrest tables.
+## Every table is stored with its BF Runtime names (table, action, key fields)
+## and one typed column per key and data field, in a single .npz file.
+## Integers wider than 64 bits (e.g. codewords) are stored as big-endian bytes.
+import json
+import numpy as np
+from rf_compiler import get_feature_ranges, bits_to_ints
+
+## end of the last range of the feature tables (range match)
+FEATURE_RANGE_END = 65535
+## generation of the model the feature and code table entries belong to: the
+## entries match every generation (mask 0) until model_update.py restricts them
+MODEL_VERSION_FIELD = "meta.model_version"
+
+## store a list of unsigned integers as a typed column
+def to_column(values):
+    if isinstance(values, np.ndarray) and values.dtype.kind in "iu":
+        return values.astype(np.uint64)
+    values = [int(value) for value in values]
+    max_value = max(values, default=0)
+    if max_value < 2**64:
+        return np.asarray(values, dtype=np.uint64)
+    num_bytes = (max_value.bit_length() + 7) // 8
+    column = b"".join(value.to_bytes(num_bytes, "big") for value in values)
+    return np.frombuffer(column, dtype=np.uint8).reshape(len(values), num_bytes)
+
+## read a typed column back as python integers
+def from_column(column):
+    if column.ndim == 1:
+        return column.tolist()
+    return [int.from_bytes(row.tobytes(), "big") for row in column]
+
+## names of the columns holding a key field for each match type
+def get_key_columns(field_name, match_type):
+    if match_type == "range":
+        return [field_name+"_start", field_name+"_end"]
+    if match_type == "ternary":
+        return [field_name, field_name+"_mask"]
+    return [field_name]
+
+## a table of the artifact; keys is a list of (field name, match type),
+## columns maps every key column and data field to its values
+def make_table(table_name, action_name, keys, data, columns):
+    return {"table": table_name, "action": action_name, "keys": keys, "data": data,
+            "columns": {name: to_column(values) for name, values in columns.items()}}
+
+## number of entries of a table of the artifact
+def get_num_of_entries(table):
+    return len(next(iter(table["columns"].values()), []))
+
+## version columns of entries matching every generation of the model
+def get_model_version_columns(num_of_entries):
+    return {MODEL_VERSION_FIELD: [0] * num_of_entries, MODEL_VERSION_FIELD+"_mask": [0] * num_of_entries}
+
+## a table of the artifact with only the entries at the given indices
+def select_entries(table, indices):
+    indices = np.asarray(indices, dtype=np.int64)
+    return dict(table, columns={name: column[indices] for name, column in table["columns"].items()})
+
+## entries of table_featureN: one range per row of the feature table
+def get_feature_table_entries(fea, feature_table, num_of_trees):
+    starts, ends = get_feature_ranges(feature_table)
+    ends = ends.copy()
+    ends[-1] = FEATURE_RANGE_END
+    columns = {"feature"+str(fea)+"_start": starts, "feature"+str(fea)+"_end": ends}
+    columns.update(get_model_version_columns(len(starts)))
+    # trees without splits on the feature have no code parameter in SetCodeN
+    code_trees = [tree_id for tree_id in range(num_of_trees) if feature_table["Bits"][tree_id].shape[1]]
+    for tree_id in code_trees:
+        columns["code"+str(tree_id)] = bits_to_ints(feature_table["Bits"][tree_id])
+    return make_table("Ingress.table_feature"+str(fea), "Ingress.SetCode"+str(fea),
+                      [("feature"+str(fea), "range"), (MODEL_VERSION_FIELD, "ternary")], ["code"+str(tree_id) for tree_id in code_trees], columns)
+
+## entries of table_featureN compiled to ternary entries (see tcam_expansion.py)
+def get_feature_table_ternary_entries(fea, ternary_entries, num_of_trees, code_trees=None):
+    field = "feature"+str(fea)
+    if code_trees is None:
+        code_trees = range(num_of_trees)
+    columns = {field: [], field+"_mask": [], "$MATCH_PRIORITY": []}
+    columns.update({"code"+str(tree_id): [] for tree_id in code_trees})
+    for value, mask, priority, codes in ternary_entries:
+        columns[field].append(value)
+        columns[field+"_mask"].append(mask)
+        columns["$MATCH_PRIORITY"].append(priority)
+        for tree_id in code_trees:
+            columns["code"+str(tree_id)].append(codes[tree_id])
+    columns.update(get_model_version_columns(len(columns[field])))
+    return make_table("Ingress.table_feature"+str(fea), "Ingress.SetCode"+str(fea),
+                      [(field, "ternary"), (MODEL_VERSION_FIELD, "ternary"), ("$MATCH_PRIORITY", "exact")],
+                      ["code"+str(tree_id) for tree_id in code_trees], columns)
+
+## entries of code_tableN: one ternary entry per leaf
+def get_code_table_entries(tree_id, leaves):
+    field = "meta.codeword"+str(tree_id)
+    columns = {field: leaves["Code"], field+"_mask": leaves["Mask"],
+               "classe": leaves["Class"] + 1, "cert": leaves["Certainty"]}
+    columns.update(get_model_version_columns(len(leaves)))
+    return make_table("Ingress.code_table"+str(tree_id), "Ingress.SetClass"+str(tree_id),
+                      [(field, "ternary"), (MODEL_VERSION_FIELD, "ternary")], ["classe", "cert"], columns)
+
+## entries of the voting table, from the (classes, masks, priority, class_result)
+## ternary entries or the (classes, class_result) exact entries
+def get_voting_table_entries(voting_entries, num_of_trees, ternary=True):
+    fields = ["meta.class"+str(tree_id) for tree_id in range(num_of_trees)]
+    columns = {}
+    for field in fields:
+        for name in get_key_columns(field, "ternary" if ternary else "exact"):
+            columns[name] = []
+    columns["class_result"] = []
+    if ternary:
+        columns["$MATCH_PRIORITY"] = []
+        for classes, masks, priority, classe in voting_entries:
+            for field, value, mask in zip(fields, classes, masks):
+                columns[field].append(value)
+                columns[field+"_mask"].append(mask)
+            columns["$MATCH_PRIORITY"].append(priority)
+            columns["class_result"].append(classe)
+        keys = [(field, "ternary") for field in fields] + [("$MATCH_PRIORITY", "exact")]
+    else:
+        for classes, classe in voting_entries:
+            for field, value in zip(fields, classes):
+                columns[field].append(value)
+            columns["class_result"].append(classe)
+        keys = [(field, "exact") for field in fields]
+    return make_table("Ingress.voting_table", "Ingress.set_final_class", keys, ["class_result"], columns)
+
+## entries of the flow_action_table, one per flow 5-tuple
+FLOW_ACTION_KEYS = ["hdr.ipv4.src_addr", "hdr.ipv4.dst_addr", "meta.hdr_srcport", "meta.hdr_dstport", "hdr.ipv4.protocol"]
+
+def get_flow_action_table_entries(src_addr, dst_addr, src_port, dst_port, protocol, f_action):
+    columns = dict(zip(FLOW_ACTION_KEYS, [src_addr, dst_addr, src_port, dst_port, protocol]))
+    columns["f_action"] = f_action
+    return make_table("Ingress.flow_action_table", "Ingress.set_flow_action",
+                      [(field, "exact") for field in FLOW_ACTION_KEYS], ["f_action"], columns)
+
+## save the tables of the artifact in a .npz file
+def save_entries(path, tables):
+    arrays = {}
+    meta = []
+    for index, table in enumerate(tables):
+        meta.append({name: table[name] for name in ("table", "action", "keys", "data")})
+        meta[-1]["columns"] = list(table["columns"])
+        for column_index, column in enumerate(table["columns"].values()):
+            arrays["t"+str(index)+"_c"+str(column_index)] = column
+    np.savez_compressed(path, __meta__=np.array(json.dumps(meta)), **arrays)
+
+## load the tables of an artifact saved with save_entries
+def load_entries(path):
+    tables = []
+    with np.load(path) as artifact:
+        for index, meta in enumerate(json.loads(str(artifact["__meta__"]))):
+            columns = {name: artifact["t"+str(index)+"_c"+str(column_index)]
+                       for column_index, name in enumerate(meta.pop("columns"))}
+            meta["keys"] = [tuple(key) for key in meta["keys"]]
+            tables.append(dict(meta, columns=columns))
+    return tables
@@ -0,0 +1,241 @@
+## Lossless minimization of the compiled code tables and feature tables.
+## The feature table of a feature splits its field in ranges (rows) and the bits
+## of a tree in that table are a thermometer code of the row: the bit of a split
+## is 1 in every row above its threshold. The ternary entry of a leaf matches a
+## set of consecutive rows of every feature, so a leaf is a box of row intervals,
+## and the leaves of a tree partition the rows of all the features in boxes.
+## The boxes are minimized per tree, keeping the class of every point:
+##  - rows that the field cannot hold (thresholds above its width) are dropped,
+##    with the leaves that only cover them,
+##  - boxes of the same class whose union is a box are merged (same class sibling
+##    leaves, and more generally any same class neighbours),
+##  - every box is grown over the rows of its own class (boxes may then overlap,
+##    always with the same class) and the boxes inside another one are dropped.
+## The codeword of a tree then only keeps one bit per bound of its boxes, and the
+## ranges of a feature table between two bounds used by no tree are merged.
+## Every entry of a code table matches 2 bits per feature at most; the entries
+## keep the smallest certainty of the leaves they cover.
+import numpy as np
+import pandas as pd
+from rf_compiler import get_feature_ranges
+
+## number of expansion rounds at most (a round that removes no box stops them)
+MAX_EXPANSION_ROUNDS = 4
+
+## rows of a feature table the field can hold
+def get_reachable_rows(feature_table, width):
+    starts, ends = get_feature_ranges(feature_table)
+    return max(int(np.count_nonzero(starts <= (1 << width) - 1)), 1)
+
+## first row where every bit column of a thermometer code is 1
+def get_split_rows(bits):
+    return bits.shape[0] - bits.sum(axis=0).astype(np.int64)
+
+## boxes (first row, last row of every feature) of the leaves of a tree, from
+## the splits on their path; None for the leaves that match no row the fields can hold
+def get_leaf_boxes(leaves, feature_tables, tree_id, num_of_rows):
+    # feature and first row on the right of the split of every node
+    node_splits = {}
+    for fea, feature_table in enumerate(feature_tables):
+        split_rows = get_split_rows(feature_table["Bits"][tree_id])
+        for node, row in zip(feature_table["Nodes"][tree_id], split_rows):
+            node_splits[int(node)] = (fea, int(row))
+    boxes = []
+    for path, branch in zip(leaves["Path"], leaves["Branch"]):
+        low = [0]*len(num_of_rows)
+        high = [rows - 1 for rows in num_of_rows]
+        for node, right in zip(path, branch):
+            fea, row = node_splits[int(node)]
+            if right:
+                low[fea] = max(low[fea], row)
+            else:
+                high[fea] = min(high[fea], row - 1)
+        boxes.append((low, high) if all(first <= last for first, last in zip(low, high)) else None)
+    return boxes
+
+## merge the boxes of the same class whose union is a box, until none can be merged
+def merge_boxes(boxes):
+    changed = True
+    while changed:
+        changed = False
+        num_of_features = len(boxes[0]["low"]) if boxes else 0
+        for fea in range(num_of_features):
+            groups = {}
+            for box in boxes:
+                key = (box["class"], tuple(box["low"][:fea] + box["low"][fea+1:]),
+                       tuple(box["high"][:fea] + box["high"][fea+1:]))
+                groups.setdefault(key, []).append(box)
+            merged = []
+            for group in groups.values():
+                group.sort(key=lambda box: box["low"][fea])
+                current = group[0]
+                for box in group[1:]:
+                    if box["low"][fea] <= current["high"][fea] + 1:
+                        current["high"][fea] = max(current["high"][fea], box["high"][fea])
+                        current["certainty"] = min(current["certainty"], box["certainty"])
+                        current["leaves"] += box["leaves"]
+                        changed = True
+                    else:
+                        merged.append(current)
+                        current = box
+                merged.append(current)
+            boxes = merged
+    return boxes
+
+## boxes compared at once by expand_boxes and drop_covered_boxes
+BOX_CHUNK = 256
+
+## low and high rows and classes of boxes as arrays
+def get_box_arrays(boxes):
+    low = np.array([box["low"] for box in boxes], dtype=np.int64).reshape(len(boxes), -1)
+    high = np.array([box["high"] for box in boxes], dtype=np.int64).reshape(len(boxes), -1)
+    return low, high, np.array([box["class"] for box in boxes], dtype=np.int64)
+
+## grow every box over the rows of its class, feature by feature, up to the
+## boxes of the other classes or the ends of the rows. The grown boxes stay in
+## the rows of their class, so they only have to be compared with the boxes
+## before the expansion.
+def expand_boxes(boxes, num_of_rows):
+    other_low, other_high, other_classes = get_box_arrays(boxes)
+    low, high, classes = other_low.copy(), other_high.copy(), other_classes
+    num_of_features = low.shape[1]
+    for chunk in range(0, len(boxes), BOX_CHUNK):
+        rows = slice(chunk, chunk + BOX_CHUNK)
+        overlaps = (other_low[None] <= high[rows, None]) & (other_high[None] >= low[rows, None])
+        num_of_overlaps = overlaps.sum(axis=2)
+        others = other_classes[None] != classes[rows, None]
+        for fea in range(num_of_features):
+            # boxes of other classes facing the boxes along the feature
+            facing = others & (num_of_overlaps - overlaps[:, :, fea] == num_of_features - 1)
+            below = facing & (other_high[None, :, fea] < low[rows, None, fea])
+            above = facing & (other_low[None, :, fea] > high[rows, None, fea])
+            low[rows, fea] = np.where(below, other_high[None, :, fea], -1).max(axis=1, initial=-1) + 1
+            high[rows, fea] = np.where(above, other_low[None, :, fea], num_of_rows[fea]).min(
+                axis=1, initial=num_of_rows[fea]) - 1
+            grown = (other_low[None, :, fea] <= high[rows, None, fea]) & (other_high[None, :, fea] >= low[rows, None, fea])
+            num_of_overlaps += grown.astype(np.int64) - overlaps[:, :, fea]
+            overlaps[:, :, fea] = grown
+    for box, box_low, box_high in zip(boxes, low.tolist(), high.tolist()):
+        box["low"], box["high"] = box_low, box_high
+    return boxes
+
+## drop the boxes inside another box of their class (the first of equal boxes is kept)
+def drop_covered_boxes(boxes):
+    low, high, classes = get_box_arrays(boxes)
+    kept = np.ones(len(boxes), dtype=bool)
+    for chunk in range(0, len(boxes), BOX_CHUNK):
+        rows = slice(chunk, chunk + BOX_CHUNK)
+        inside = (classes[None] == classes[rows, None]) & (low[None] <= low[rows, None]).all(axis=2) & \
+                 (high[None] >= high[rows, None]).all(axis=2)
+        equal = (low[None] == low[rows, None]).all(axis=2) & (high[None] == high[rows, None]).all(axis=2)
+        index = np.arange(chunk, min(chunk + BOX_CHUNK, len(boxes)))
+        # a box covers the ones strictly inside it, and the equal boxes after it
+        covering = inside & (~equal | (np.arange(len(boxes))[None] < index[:, None]))
+        kept[rows] = ~covering.any(axis=1)
+    return [box for box, keep in zip(boxes, kept) if keep]
+
+## minimal boxes of the leaves of a tree
+def minimize_boxes(boxes, num_of_rows):
+    boxes = merge_boxes(boxes)
+    for expansion in range(MAX_EXPANSION_ROUNDS):
+        num_of_boxes = len(boxes)
+        boxes = merge_boxes(drop_covered_boxes(expand_boxes(boxes, num_of_rows)))
+        if len(boxes) == num_of_boxes:
+            break
+    return boxes
+
+## rows where a bound of the boxes of a tree starts, per feature
+def get_box_bounds(boxes, num_of_rows):
+    bounds = []
+    for fea, rows in enumerate(num_of_rows):
+        fea_bounds = {box["low"][fea] for box in boxes if box["low"][fea] > 0}
+        fea_bounds |= {box["high"][fea] + 1 for box in boxes if box["high"][fea] < rows - 1}
+        bounds.append(sorted(fea_bounds))
+    return bounds
+
+## code and mask of every box on the codeword of the bounds (one bit per bound,
+## feature0 in the most significant bits, increasing rows)
+def get_box_entries(boxes, bounds):
+    width = sum(len(fea_bounds) for fea_bounds in bounds)
+    # position of the bit of every bound in the codeword
+    positions = []
+    for fea, fea_bounds in enumerate(bounds):
+        first = width - sum(len(previous) for previous in bounds[:fea]) - 1
+        positions.append({bound: first - index for index, bound in enumerate(fea_bounds)})
+    rows = []
+    for box in sorted(boxes, key=lambda box: min(box["leaves"])):
+        code, mask = 0, 0
+        for fea, fea_positions in enumerate(positions):
+            if box["low"][fea] in fea_positions:
+                code |= 1 << fea_positions[box["low"][fea]]
+                mask |= 1 << fea_positions[box["low"][fea]]
+            if box["high"][fea] + 1 in fea_positions:
+                mask |= 1 << fea_positions[box["high"][fea] + 1]
+        rows.append((min(box["leaves"]), code, mask, box["class"], box["certainty"], sorted(box["leaves"])))
+    columns = ["Leaf", "Code", "Mask", "Class", "Certainty", "Leaves"]
+    return pd.DataFrame({name: pd.Series([row[i] for row in rows], dtype=object)
+                         for i, name in enumerate(columns)}).astype({"Leaf": np.int64, "Class": np.int64,
+                                                                     "Certainty": np.int64})
+
+## feature table with the rows between the bounds of all the trees merged
+def get_minimized_feature_table(feature_table, tree_bounds, tree_split_rows, num_of_rows):
+    thresholds = feature_table["Threshold"]
+    starts, ends = get_feature_ranges(feature_table)
+    row_starts = np.array(sorted(set([0]).union(*[set(bounds) for bounds in tree_bounds])), dtype=np.int64)
+    row_ends = np.append(row_starts[1:] - 1, num_of_rows - 1)
+    new_thresholds = thresholds[row_ends].astype(thresholds.dtype)
+    # the last row stands for the values above the previous ones
+    new_thresholds[-1] = starts[row_starts[-1]]
+    minimized = {"Threshold": new_thresholds, "Nodes": [], "Bits": []}
+    for tree_id, bounds in enumerate(tree_bounds):
+        bounds = np.asarray(bounds, dtype=np.int64)
+        minimized["Bits"].append((row_starts[:, None] >= bounds[None, :]).astype(np.uint8))
+        # node of a split of the tree on every bound, -1 for the bounds of merged boxes
+        nodes = feature_table["Nodes"][tree_id]
+        split_rows = tree_split_rows[tree_id]
+        minimized["Nodes"].append(np.array([nodes[np.flatnonzero(split_rows == bound)[0]]
+                                            if (split_rows == bound).any() else -1 for bound in bounds], dtype=np.int64))
+    return minimized
+
+## minimized feature tables and leaves of every tree, with the counts before and after
+def minimize_entries(feature_tables, forest_leaves, feature_widths):
+    num_of_rows = [get_reachable_rows(feature_table, width) for feature_table, width in zip(feature_tables, feature_widths)]
+    stats = {"leaves": [], "unreachable": [], "entries": [], "codeword_widths": [], "minimized_widths": [],
+             "ranges": [len(feature_table["Threshold"]) for feature_table in feature_tables]}
+    tree_bounds = []
+    tree_split_rows = []
+    minimized_leaves = []
+    for tree_id, leaves in enumerate(forest_leaves):
+        split_rows = [get_split_rows(feature_table["Bits"][tree_id]) for feature_table in feature_tables]
+        boxes = []
+        for leaf, box, classe, certainty in zip(leaves["Leaf"], get_leaf_boxes(leaves, feature_tables, tree_id, num_of_rows),
+                                                leaves["Class"], leaves["Certainty"]):
+            if box is not None:
+                boxes.append({"low": box[0], "high": box[1], "class": int(classe), "certainty": int(certainty),
+                              "leaves": [int(leaf)]})
+        stats["leaves"].append(len(leaves))
+        stats["unreachable"].append(len(leaves) - len(boxes))
+        boxes = minimize_boxes(boxes, num_of_rows)
+        bounds = get_box_bounds(boxes, num_of_rows)
+        minimized_leaves.append(get_box_entries(boxes, bounds))
+        tree_bounds.append(bounds)
+        tree_split_rows.append(split_rows)
+        stats["entries"].append(len(boxes))
+        stats["codeword_widths"].append(sum(len(rows) for rows in split_rows))
+        stats["minimized_widths"].append(sum(len(fea_bounds) for fea_bounds in bounds))
+    minimized_tables = [get_minimized_feature_table(feature_table, [bounds[fea] for bounds in tree_bounds],
+                                                    [split_rows[fea] for split_rows in tree_split_rows], num_of_rows[fea])
+                        for fea, feature_table in enumerate(feature_tables)]
+    stats["minimized_ranges"] = [len(feature_table["Threshold"]) for feature_table in minimized_tables]
+    return minimized_tables, minimized_leaves, stats
+
+## print the entries and codeword widths before and after the minimization
+def report_minimization(stats):
+    print("{:<16} {:>9} {:>11} {:>9} {:>15}".format("table", "entries", "unreachable", "minimized", "codeword bits"))
+    for tree_id, leaves in enumerate(stats["leaves"]):
+        print("{:<16} {:>9} {:>11} {:>9} {:>8} -> {:>3}".format("code_table"+str(tree_id), leaves,
+                                                                stats["unreachable"][tree_id], stats["entries"][tree_id],
+                                                                stats["codeword_widths"][tree_id],
+                                                                stats["minimized_widths"][tree_id]))
+    for fea, ranges in enumerate(stats["ranges"]):
+        print("{:<16} {:>9} {:>11} {:>9}".format("table_feature"+str(fea), ranges, "", stats["minimized_ranges"][fea]))
@@ -0,0 +1,218 @@
+## A fake switch for running the control plane pipeline without the SDE: a fake
+## bfrt_grpc client, program information, digest source and tables, with the
+## same calls as the ones used by control_pipeline.py, register_sweeper.py,
+## install_table_entries.py and model_update.py.
+## usage: python3 fake_switch.py [NUM_OF_DIGESTS] [METRICS_PORT] [NUM_OF_SWITCHES]
+##        runs the pipeline on random digests and prints the metrics endpoint;
+##        with NUM_OF_SWITCHES, runs the sharded control plane of control_shards.py
+##        on that many fake switches of 4 pipes each
+import sys
+import time
+import zlib
+import threading
+from types import SimpleNamespace
+import numpy as np
+from control_pipeline import run_pipeline, get_flow_key, DIGEST_TIMEOUT
+from flow_eviction import open_flow_eviction
+from bfrt_session import PIPE_SCOPE_TABLES, get_table_targets
+
+## records per digest
+RECORDS_PER_DIGEST = 64
+## share of the records with class 255 (collision) and 127 (timeout)
+COLLISION_RATE = 0.05
+TIMEOUT_RATE = 0.05
+## classes of the classified flows
+NUM_OF_CLASSES = 16
+## seconds between two digests
+DIGEST_INTERVAL = 0.001
+## pipes of the ingress ports of the flows, and ports per pipe
+NUM_OF_PIPES = 4
+PORTS_PER_PIPE = 72
+
+## a fake bfrt_grpc.client module; the key tuples of the ternary and range
+## fields keep their mask and bounds
+def get_fake_client():
+    return SimpleNamespace(KeyTuple=lambda name, value=None, mask=None, prefix_len=None, low=None, high=None:
+                           (name, value) if mask is None and low is None and high is None else (name, value, mask, low, high),
+                           DataTuple=lambda name, val=None, **kwargs: (name, val),
+                           Target=lambda **kwargs: SimpleNamespace(**kwargs))
+
+## a fake table: the keys and data are tuples, the entries a dict. As on the
+## switch, adding a key already in the table and modifying or deleting a key
+## not in the table fail (the other keys of the call are written); every index
+## of a register is in the table. A table is symmetric, written in all the pipes
+## at once (pipe_id 0xffff), until its scope is set to single pipes while empty;
+## then it is written pipe by pipe, its entries keyed by (pipe, key). The calls
+## are counted per operation
+def get_fake_table(name, write_latency=0.0, register=False):
+    entries = {}
+    calls = {"add": 0, "mod": 0, "del": 0}
+    scope = {"single_pipe": False}
+
+    def check(failed, error):
+        if failed:
+            raise RuntimeError("{} {}: {} keys, first {}".format(name, error, len(failed), failed[0]))
+
+    def get_pipe(target):
+        pipe = getattr(target, "pipe_id", 0xffff)
+        if scope["single_pipe"] and pipe == 0xffff:
+            raise RuntimeError(name + " is asymmetric: it is written one pipe at a time")
+        if not scope["single_pipe"] and pipe != 0xffff:
+            raise RuntimeError(name + " is symmetric: it is written in all the pipes at once")
+        return pipe
+
+    def get_entry_keys(target, key_list):
+        pipe = get_pipe(target)
+        return [(pipe, key) for key in key_list] if scope["single_pipe"] else list(key_list)
+
+    def entry_add(target, key_list=None, data_list=None, flags=None, p4_name=None):
+        time.sleep(write_latency)
+        calls["add"] += 1
+        failed = []
+        for key, data in zip(get_entry_keys(target, key_list), data_list):
+            if key in entries:
+                failed.append(key)
+            else:
+                entries[key] = data
+        check(failed, "ALREADY_EXISTS")
+
+    def entry_mod(target, key_list=None, data_list=None, flags=None, p4_name=None):
+        time.sleep(write_latency)
+        calls["mod"] += 1
+        failed = []
+        for key, data in zip(get_entry_keys(target, key_list), data_list):
+            if register or key in entries:
+                entries[key] = data
+            else:
+                failed.append(key)
+        check(failed, "NOT_FOUND")
+
+    def entry_del(target, key_list=None, flags=None, p4_name=None):
+        calls["del"] += 1
+        if key_list is None:
+            pipe = get_pipe(target)
+            for key in [key for key in entries if not scope["single_pipe"] or key[0] == pipe]:
+                del entries[key]
+            return
+        failed = [key for key in get_entry_keys(target, key_list) if entries.pop(key, None) is None]
+        check(failed, "NOT_FOUND")
+
+    def entry_get(target, key_list=None, flags=None, p4_name=None):
+        for key, entry_key in zip(key_list, get_entry_keys(target, key_list)):
+            value = entries.get(entry_key, ((name+'.f1', 0),))[0][1]
+            yield (SimpleNamespace(to_dict=lambda value=value: {name+'.f1': [value]}),
+                   SimpleNamespace(to_dict=lambda key=key: {key[0][0]: {'value': key[0][1]}}))
+
+    def attribute_entry_scope_set(target, predefined_pipe_scope=True, predefined_pipe_scope_val=None):
+        if entries:
+            raise RuntimeError(name + ": the scope of a table is set while it is empty")
+        scope["single_pipe"] = predefined_pipe_scope
+
+    return SimpleNamespace(name=name, entries=entries, calls=calls, scope=scope, make_key=lambda keys: tuple(sorted(keys, key=lambda key: key[0])),
+                           make_data=lambda datas, action=None: tuple(datas), entry_add=entry_add, entry_mod=entry_mod,
+                           entry_del=entry_del, entry_get=entry_get, attribute_entry_scope_set=attribute_entry_scope_set)
+
+## fake program information with its tables
+def get_fake_bfrt_info(write_latency=0.0):
+    tables = {}
+
+    def table_get(name):
+        if name not in tables:
+            tables[name] = get_fake_table(name, write_latency, register=name.startswith('Ingress.reg_'))
+        return tables[name]
+
+    return SimpleNamespace(tables=tables, table_get=table_get, p4_name_get=lambda: "unibs_flowrest")
+
+## random digest records, with the fields of the digest of unibs_flowrest.p4
+def get_fake_records(rng, num_of_records):
+    flow_classes = rng.integers(0, NUM_OF_CLASSES, num_of_records)
+    outcome = rng.random(num_of_records)
+    flow_classes[outcome < COLLISION_RATE + TIMEOUT_RATE] = 127
+    flow_classes[outcome < COLLISION_RATE] = 255
+    columns = {"source_addr": rng.integers(0, 1 << 32, num_of_records), "destin_addr": rng.integers(0, 1 << 32, num_of_records),
+               "source_port": rng.integers(0, 1 << 16, num_of_records), "destin_port": rng.integers(0, 1 << 16, num_of_records),
+               "protocol": rng.choice([6, 17], num_of_records), "flow_class": flow_classes,
+               "register_index": rng.integers(0, 1 << 16, num_of_records),
+               "ingress_port": (rng.integers(0, NUM_OF_PIPES, num_of_records) << 7) |
+                               rng.integers(0, PORTS_PER_PIPE, num_of_records)}
+    return [{name: int(values[row]) for name, values in columns.items()} for row in range(num_of_records)]
+
+## the digests of a fake digest source, the same ones for the same seed
+def get_fake_digests(num_of_digests, records_per_digest=RECORDS_PER_DIGEST, seed=42):
+    rng = np.random.default_rng(seed)
+    for _ in range(num_of_digests):
+        yield get_fake_records(rng, records_per_digest)
+
+## install the flows of the digests of a fake digest source in flow_action_table
+## with f_action 1, as done by the generated table entries; with pipes the
+## tables of bfrt_session.PIPE_SCOPE_TABLES are made asymmetric first and the
+## flows are installed in every pipe, as by install_table_entries.py --pipes
+def install_fake_flows(bfrt_client, bfrt_info, num_of_digests, records_per_digest=RECORDS_PER_DIGEST, seed=42,
+                       pipes=None):
+    if pipes:
+        for name in PIPE_SCOPE_TABLES:
+            bfrt_info.table_get(name).attribute_entry_scope_set(bfrt_client.Target(device_id=0, pipe_id=0xffff))
+    flow_table = bfrt_info.table_get('Ingress.flow_action_table')
+    data = flow_table.make_data([bfrt_client.DataTuple('f_action', 1)], 'Ingress.set_flow_action')
+    targets = get_table_targets(bfrt_client, 'Ingress.flow_action_table', pipes)
+    for records in get_fake_digests(num_of_digests, records_per_digest, seed):
+        keys = [get_flow_key(bfrt_client, flow_table, (record['source_addr'], record['destin_addr'],
+                                                       record['destin_port'], record['source_port'], record['protocol']))
+                for record in records]
+        for target in targets:
+            flow_table.entry_add(target, keys, [data] * len(keys))
+
+## a fake digest source (interface and learn filter) sending num_of_digests
+## digests, one every interval seconds, then timing out
+def get_fake_digest_source(num_of_digests, records_per_digest=RECORDS_PER_DIGEST, interval=DIGEST_INTERVAL, seed=42):
+    digests = get_fake_digests(num_of_digests, records_per_digest, seed)
+
+    def digest_get(timeout=DIGEST_TIMEOUT):
+        records = next(digests, None)
+        if records is None:
+            raise RuntimeError("digest_get timed out")
+        time.sleep(interval)
+        return records
+
+    interface = SimpleNamespace(digest_get=digest_get)
+    learn_filter = SimpleNamespace(make_data_list=lambda digest: [SimpleNamespace(to_dict=lambda record=record: record)
+                                                                  for record in digest])
+    return interface, learn_filter
+
+## session of a fake switch for control_shards.py (see bfrt_session.connect_switch):
+## the switch dict may give "num_of_digests", "digest_interval" and "write_latency"
+def get_fake_session(switch):
+    num_of_digests = switch.get("num_of_digests", 2000)
+    seed = zlib.crc32(switch["name"].encode())
+    interface, learn_filter = get_fake_digest_source(num_of_digests, interval=switch.get("digest_interval", DIGEST_INTERVAL),
+                                                     seed=seed)
+    bfrt_client = get_fake_client()
+    bfrt_info = get_fake_bfrt_info(switch.get("write_latency", 0.0))
+    install_fake_flows(bfrt_client, bfrt_info, num_of_digests, seed=seed,
+                       pipes=switch.get("pipes") if switch.get("pipe_scope") else None)
+    return {"bfrt_client": bfrt_client, "interface": interface, "learn_filter": learn_filter, "bfrt_info": bfrt_info}
+
+if __name__ == '__main__':
+    num_of_digests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    metrics_port = int(sys.argv[2]) if len(sys.argv) > 2 else 9108
+    if len(sys.argv) > 3:
+        from control_shards import run_switches
+        switches = [{"name": "switch"+str(index), "pipes": list(range(NUM_OF_PIPES)), "pipe_scope": True,
+                     "num_of_digests": num_of_digests}
+                    for index in range(int(sys.argv[3]))]
+        run_switches(switches, {"connect": get_fake_session, "eviction": {}, "digest_timeout": 1.0,
+                                "report_interval": 1.0}, metrics_port)
+        sys.exit(0)
+    bfrt_client = get_fake_client()
+    interface, learn_filter = get_fake_digest_source(num_of_digests)
+    bfrt_info = get_fake_bfrt_info()
+    install_fake_flows(bfrt_client, bfrt_info, num_of_digests)
+    result = {}
+    pipeline = threading.Thread(target=lambda: result.update(run_pipeline(
+        bfrt_client, interface, bfrt_info, learn_filter, bfrt_client.Target(device_id=0, pipe_id=0xffff),
+        eviction=open_flow_eviction(), metrics_port=metrics_port)))
+    pipeline.start()
+    time.sleep(1)
+    from urllib.request import urlopen
+    print(urlopen("http://127.0.0.1:{}/metrics".format(metrics_port)).read().decode())
+    pipeline.join()
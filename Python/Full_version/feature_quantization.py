@@ -0,0 +1,220 @@
+## Search of the bit-width quantization of every feature of an RF model.
+## A feature is quantized by keeping width bits from bit shift up, saturated:
+## q = min(value >> shift, 2**width - 1) (extractKBits of the notebooks keeps the
+## top bits of a fixed width). The switch still matches the whole field: a split
+## q <= b - 1 of a quantized feature is the split value <= (b << shift) - 1 of the
+## field, so the thresholds of the quantized forest are moved back to the field
+## and the entries are generated from it as from any model. The thresholds are
+## then aligned on blocks of 2**shift values, which merges close thresholds
+## (fewer table_featureN entries) and expands to fewer TCAM prefixes.
+## For every feature alone and every (shift, width) the forest is retrained on
+## the quantized feature ("retrain") or its thresholds are rounded to the blocks
+## ("rethreshold"), then the feature tables are compiled, minimized as the
+## generator installs them (entries_minimizer.py), and the model scored.
+## The settings that are not worse than another one in both TCAM cost and score
+## form the Pareto front of the feature; the chosen configuration takes for every
+## feature the cheapest setting of the front that loses at most tolerance of the
+## macro F1 score, and drops the quantization of the features that cost the most
+## accuracy until the whole configuration loses at most tolerance too.
+import os
+import copy
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import classification_report
+from rf_compiler import TREE_UNDEFINED
+from table_usage import get_installed_tables
+from tcam_expansion import get_tcam_footprint
+from p4_tables import get_p4_table_sizes, get_p4_table_keys
+
+P4_FILE = '../../P4/Full_version/unibs_flowrest.p4'
+## shifts and widths searched for every feature (limited to the width of its field)
+QUANTIZATION_SHIFTS = [0, 1, 2, 3, 4, 5, 6, 8]
+QUANTIZATION_WIDTHS = [4, 6, 8, 10, 12, 14, 16]
+## macro F1 score that the chosen configuration may lose
+QUANTIZATION_TOLERANCE = 0.005
+
+## widths of the fields matched by the feature tables of the P4 program (16 bits if unknown)
+def get_feature_widths(num_of_features, p4_file=P4_FILE):
+    table_keys = get_p4_table_keys(p4_file) if os.path.exists(p4_file) else {}
+    return [table_keys.get("table_feature"+str(fea), [(None, None, 16)])[0][2] for fea in range(num_of_features)]
+
+## (shift, width) settings of a field; (0, field_width) keeps the feature as it is
+def get_settings(field_width, shifts=QUANTIZATION_SHIFTS, widths=QUANTIZATION_WIDTHS):
+    settings = [(shift, width) for shift in shifts for width in widths if shift + width <= field_width]
+    if (0, field_width) not in settings:
+        settings.append((0, field_width))
+    return settings
+
+## True when a setting keeps every value of a field
+def is_identity(setting, field_width):
+    return setting[0] == 0 and setting[1] >= field_width
+
+## quantized values of a feature
+def quantize_values(values, shift, width):
+    values = np.maximum(np.asarray(values, dtype=np.int64), 0)
+    return np.minimum(values >> shift, (1 << width) - 1)
+
+## features with the quantized columns of a configuration {feature: (shift, width)}
+def quantize_features(X, config):
+    X = X.copy()
+    for feature, (shift, width) in config.items():
+        X[feature] = quantize_values(X[feature], shift, width)
+    return X
+
+## copy of a forest with the thresholds of the quantized features on the blocks of
+## their field: thresholds on the quantized values for a forest trained on them
+## (quantized_input), else thresholds on the field rounded to the nearest block
+def quantize_forest(forest, feature_names, config, quantized_input=False):
+    forest = copy.deepcopy(forest)
+    feature_names = list(feature_names)
+    for estimator in forest.estimators_:
+        tree_ = estimator.tree_
+        # the arrays of the tree are views on its nodes, written in place
+        thresholds = tree_.threshold
+        for feature, (shift, width) in config.items():
+            nodes = np.flatnonzero((tree_.feature == feature_names.index(feature)) & (thresholds != TREE_UNDEFINED))
+            # first value on the right of every split
+            right = np.floor(thresholds[nodes]) + 1
+            blocks = right if quantized_input else np.rint(right / (1 << shift))
+            # a split must keep values on both sides: q <= 2**width - 2 at most
+            blocks = np.clip(blocks, 1, (1 << width) - 1)
+            thresholds[nodes] = blocks * (1 << shift) - 1
+    return forest
+
+## the model, data and options are shared with the forked workers
+QUANTIZATION_DATA = None
+
+## model of a configuration, retrained on the quantized features or rethresholded
+def get_quantized_model(data, config):
+    if data["mode"] == "retrain" and config:
+        model = clone(data["clf"]).fit(quantize_features(data["X_train"], config), data["y_train"])
+        return quantize_forest(model, data["feature_names"], config, quantized_input=True)
+    return quantize_forest(data["clf"], data["feature_names"], config)
+
+## feature table entries, TCAM cost and scores of a configuration
+def evaluate_config(config):
+    data = QUANTIZATION_DATA
+    start = time.time()
+    model = get_quantized_model(data, config)
+    num_of_trees = len(model.estimators_)
+    feature_tables, forest_leaves = get_installed_tables(model, data["feature_names"], data["feature_widths"],
+                                                         data["minimize"])
+    footprints = {}
+    for fea, feature_table in enumerate(feature_tables):
+        footprints["table_feature"+str(fea)] = get_tcam_footprint(feature_table, num_of_trees, data["feature_widths"][fea])
+    y_pred = model.predict(data["X_test"])
+    class_report = classification_report(data["y_test"], y_pred, target_names=data["classes"], output_dict=True)
+    entries = "ternary" if data["ternary_features"] else "ranges"
+    return {"config": config, "footprints": footprints,
+            "entries": sum(footprint[entries] for footprint in footprints.values()),
+            "range_expansion": sum(footprint["range_expansion"] for footprint in footprints.values()),
+            "ternary": sum(footprint["ternary"] for footprint in footprints.values()),
+            "overflows": [table_name for table_name, footprint in footprints.items()
+                          if footprint[entries] > data["table_sizes"].get(table_name, float("inf"))],
+            "macro": class_report['macro avg']['f1-score'], "weighted": class_report['weighted avg']['f1-score'],
+            "seconds": time.time() - start}
+
+## evaluate configurations in forked worker processes, in this process without fork
+def evaluate_configs(configs, max_workers=None):
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(configs))
+    if max_workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [evaluate_config(config) for config in configs]
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        return list(executor.map(evaluate_config, configs))
+
+## settings of a feature not dominated by another one: at most the TCAM cost
+## (range expansion, then entries, then bits kept) with at least the macro F1 score
+def get_pareto_front(results, feature, field_width):
+    cost = lambda result: (result["range_expansion"], result["entries"], result["config"].get(feature, (0, field_width))[1])
+    return [result for result in results
+            if not any(cost(other) <= cost(result) and other["macro"] >= result["macro"] and
+                       (cost(other) < cost(result) or other["macro"] > result["macro"]) for other in results)]
+
+## cheapest setting of the front of every feature within tolerance of the baseline,
+## then the features that lose the most alone are kept whole until the combined
+## configuration is within tolerance too
+def choose_config(fronts, baseline, tolerance, max_workers=None):
+    chosen = {}
+    for feature, front in fronts.items():
+        within = [result for result in front if result["config"] and result["macro"] >= baseline["macro"] - tolerance]
+        if within:
+            chosen[feature] = min(within, key=lambda result: (result["range_expansion"], result["entries"], -result["macro"]))
+    config = {feature: result["config"][feature] for feature, result in chosen.items()}
+    result = evaluate_configs([config], 1)[0] if config else baseline
+    while result["macro"] < baseline["macro"] - tolerance and config:
+        worst = min(config, key=lambda feature: chosen[feature]["macro"])
+        del config[worst]
+        result = evaluate_configs([config], 1)[0] if config else baseline
+    return result
+
+## search the quantization of every feature of a model, in parallel; returns the
+## table of the settings (with their Pareto front), the chosen configuration and
+## its model, with the thresholds on the fields of the switch
+def search_quantization(clf, classes, X_train, y_train, X_test, y_test, mode="rethreshold",
+                        shifts=QUANTIZATION_SHIFTS, widths=QUANTIZATION_WIDTHS, tolerance=QUANTIZATION_TOLERANCE,
+                        p4_file=P4_FILE, feature_widths=None, ternary_features=False, minimize=True, max_workers=None,
+                        outfile=None):
+    global QUANTIZATION_DATA
+    feature_names = list(clf.feature_names_in_)
+    if feature_widths is None:
+        feature_widths = get_feature_widths(len(feature_names), p4_file)
+    QUANTIZATION_DATA = {"clf": clf, "feature_names": feature_names, "feature_widths": feature_widths, "mode": mode,
+                         "X_train": X_train[feature_names], "y_train": y_train, "X_test": X_test[feature_names],
+                         "y_test": y_test, "classes": classes, "ternary_features": ternary_features, "minimize": minimize,
+                         "table_sizes": get_p4_table_sizes(p4_file) if os.path.exists(p4_file) else {}}
+    start = time.time()
+    configs = [{}]
+    for fea, feature in enumerate(feature_names):
+        configs += [{feature: setting} for setting in get_settings(feature_widths[fea], shifts, widths)
+                    if not is_identity(setting, feature_widths[fea])]
+    results = evaluate_configs(configs, max_workers)
+    baseline = results[0]
+    fronts = {}
+    for fea, feature in enumerate(feature_names):
+        feature_results = [baseline] + [result for result in results[1:] if feature in result["config"]]
+        fronts[feature] = get_pareto_front(feature_results, feature, feature_widths[fea])
+    chosen = choose_config(fronts, baseline, tolerance, max_workers)
+    model = get_quantized_model(QUANTIZATION_DATA, chosen["config"])
+    QUANTIZATION_DATA = None
+    table = get_quantization_table(results, fronts, feature_names, feature_widths)
+    print("{} settings in {:.1f} s, chosen {}: {} -> {} feature table entries, {} -> {} TCAM entries by range expansion, "
+          "macro F1 {:.4f} -> {:.4f}".format(len(configs), time.time() - start, chosen["config"], baseline["entries"],
+                                            chosen["entries"], baseline["range_expansion"], chosen["range_expansion"],
+                                            baseline["macro"], chosen["macro"]))
+    if outfile:
+        table.to_csv(outfile, sep=";", index=False)
+    return table, chosen["config"], model
+
+## results of the search as a table, one row per feature and setting
+def get_quantization_table(results, fronts, feature_names, feature_widths):
+    rows = []
+    for fea, feature in enumerate(feature_names):
+        front = [id(result) for result in fronts[feature]]
+        for result in results:
+            if result["config"] and feature not in result["config"]:
+                continue
+            shift, width = result["config"].get(feature, (0, feature_widths[fea]))
+            footprint = result["footprints"]["table_feature"+str(fea)]
+            rows.append({"feature": feature, "shift": shift, "width": width, "table_ranges": footprint["ranges"],
+                         "table_expansion": footprint["range_expansion"], "table_ternary": footprint["ternary"],
+                         "entries": result["entries"], "range_expansion": result["range_expansion"],
+                         "ternary": result["ternary"], "macro": result["macro"], "weighted": result["weighted"],
+                         "pareto": id(result) in front, "fits": not result["overflows"], "seconds": result["seconds"]})
+    return pd.DataFrame(rows)
+
+## store and load a configuration {feature: (shift, width)}
+def save_quantization(config, path):
+    with open(path, "w") as config_file:
+        json.dump({feature: {"shift": shift, "width": width} for feature, (shift, width) in config.items()},
+                  config_file, indent=1)
+
+def load_quantization(path):
+    with open(path) as config_file:
+        return {feature: (setting["shift"], setting["width"]) for feature, setting in json.load(config_file).items()}
@@ -0,0 +1,133 @@
+## Entries of flow_action_table from the flow ids of a trace ("flow.id" column:
+## "src_addr dst_addr src_port dst_port protocol"), for millions of flows.
+## The csv file is read in chunks of the flow id column only, the 5-tuples of a
+## chunk are parsed from the matrix of its characters into integer columns, and
+## the flows already seen in a previous chunk are dropped with a set of the packed
+## 5-tuples (13 bytes each). The entries of every chunk are
+## written to the bfrt_python script as they come, and the packed 5-tuples are
+## kept for the entries artifact. Rows that are not an IPv4 5-tuple (IPv6
+## addresses, ports over 65535, missing fields, ...) are counted and reported
+## instead of being dropped silently.
+import time
+import numpy as np
+import pandas as pd
+from classification_log import int_to_str
+from entries_artifact import get_flow_action_table_entries
+
+## column of the flow ids in the csv file
+FLOW_ID_COLUMN = "flow.id"
+## rows of the csv file read at once
+FLOW_CHUNK_ROWS = 250000
+## f_action of the flows of the table (0: forwarding, 1: inference)
+FLOW_ACTION = 1
+## rejected rows shown in the report
+REJECTED_EXAMPLES = 5
+
+## 5-tuple packed in network order, the bytes of a flow are its key in the set
+FLOW_KEY_DTYPE = np.dtype([("src_addr", ">u4"), ("dst_addr", ">u4"), ("src_port", ">u2"), ("dst_port", ">u2"),
+                           ("protocol", "u1")])
+## longest flow id: "255.255.255.255 255.255.255.255 65535 65535 255"
+FLOW_ID_LENGTH = 47
+## the 10 separators of a flow id, True for a space and False for a dot
+FLOW_ID_SPACES = np.array([False, False, False, True, False, False, False, True, True, True])
+## largest value and number of digits of the 11 numbers of a flow id
+FIELD_MAX = np.array([255] * 8 + [65535, 65535, 255])
+FIELD_DIGITS = np.array([3] * 8 + [5, 5, 3])
+
+## packed 5-tuples of the flow ids and the mask of the valid ones; the characters
+## of the chunk are a matrix, the numbers are found between the separators and
+## summed from their digits
+def parse_flow_ids(flow_ids):
+    flow_ids = np.asarray(flow_ids, dtype=object)
+    num_of_rows = len(flow_ids)
+    short = np.array([len(flow_id) <= FLOW_ID_LENGTH for flow_id in flow_ids], dtype=bool)
+    strings = np.where(short, flow_ids, "").astype("U"+str(FLOW_ID_LENGTH))
+    # code points over 255 are no digit or separator either
+    chars = np.minimum(strings.view(np.uint32), 255).astype(np.uint8).reshape(num_of_rows, FLOW_ID_LENGTH)
+    digits = (chars >= ord("0")) & (chars <= ord("9"))
+    spaces = chars == ord(" ")
+    separators = spaces | (chars == ord("."))
+    valid = short & (digits | separators | (chars == 0)).all(axis=1) & (separators.sum(axis=1) == 10)
+    # columns of the 10 separators of the rows, then first and end column of the 11 numbers
+    rows = np.flatnonzero(valid)
+    columns = np.nonzero(separators[rows])[1].astype(np.int8).reshape(-1, 10)
+    valid[rows] = (spaces[rows[:, None], columns] == FLOW_ID_SPACES).all(axis=1)
+    columns = columns[valid[rows]]
+    rows = rows[valid[rows]]
+    starts = np.hstack([np.zeros((len(rows), 1), dtype=np.int8), columns + 1])
+    ends = np.hstack([columns, (chars[rows] != 0).sum(axis=1, dtype=np.int8)[:, None]])
+    lengths = ends - starts
+    # the numbers summed from their last digit, at most 5 digits
+    row_chars = chars[rows].astype(np.int16) - ord("0")
+    values = np.zeros((len(rows), 11), dtype=np.int32)
+    for place in range(5):
+        has_digit = lengths > place
+        digit = np.take_along_axis(row_chars, np.where(has_digit, ends - 1 - place, 0), axis=1).astype(np.int32)
+        values += np.where(has_digit, digit * 10 ** place, 0)
+    # a dotted address has no leading zero (as ipaddress), the ports and protocol may have
+    leading_zeros = (np.take_along_axis(row_chars, starts[:, :8], axis=1) == 0) & (lengths[:, :8] > 1)
+    fits = ((lengths >= 1) & (lengths <= FIELD_DIGITS) & (values <= FIELD_MAX)).all(axis=1) & ~leading_zeros.any(axis=1)
+    valid[rows] = fits
+    values = values[fits].astype(np.int64)
+    keys = np.zeros(len(values), dtype=FLOW_KEY_DTYPE)
+    keys["src_addr"] = (values[:, 0] << 24) | (values[:, 1] << 16) | (values[:, 2] << 8) | values[:, 3]
+    keys["dst_addr"] = (values[:, 4] << 24) | (values[:, 5] << 16) | (values[:, 6] << 8) | values[:, 7]
+    keys["src_port"] = values[:, 8]
+    keys["dst_port"] = values[:, 9]
+    keys["protocol"] = values[:, 10]
+    return keys, valid
+
+## flows of the keys not in seen (added to it), in the order of their first row
+def drop_seen_flows(keys, seen):
+    new = np.zeros(len(keys), dtype=bool)
+    for index, key in enumerate(keys.view(np.dtype((np.void, FLOW_KEY_DTYPE.itemsize))).tolist()):
+        if key not in seen:
+            seen.add(key)
+            new[index] = True
+    return keys[new]
+
+## bfrt_python lines adding the flows to flow_action_table
+def get_flow_entry_lines(keys, f_action=FLOW_ACTION):
+    columns = [int_to_str(keys[name]) for name in FLOW_KEY_DTYPE.names]
+    return "".join("flow_action_table.add_with_set_flow_action(src_addr={}, dst_addr={}, hdr_srcport={}, "
+                   "hdr_dstport={}, protocol={}, f_action={})\n".format(*flow, f_action) for flow in zip(*columns))
+
+## read the flow ids of a csv file in chunks and write the entries of the new flows
+## of every chunk to entries_file (None: no script); returns the packed 5-tuples of
+## the flows (if keep_keys) and the counters of the rows
+def write_flow_action_entries(path, entries_file=None, keep_keys=True, chunk_rows=FLOW_CHUNK_ROWS,
+                              f_action=FLOW_ACTION):
+    start = time.time()
+    stats = {"rows": 0, "flows": 0, "duplicates": 0, "rejected": 0, "rejected_examples": [], "chunks": 0}
+    seen = set()
+    flow_keys = []
+    for chunk in pd.read_csv(path, usecols=[FLOW_ID_COLUMN], dtype=str, keep_default_na=False, chunksize=chunk_rows):
+        flow_ids = chunk[FLOW_ID_COLUMN].values
+        keys, valid = parse_flow_ids(flow_ids)
+        new_keys = drop_seen_flows(keys, seen)
+        stats["chunks"] += 1
+        stats["rows"] += len(flow_ids)
+        stats["rejected"] += int((~valid).sum())
+        stats["duplicates"] += len(keys) - len(new_keys)
+        stats["flows"] += len(new_keys)
+        missing = REJECTED_EXAMPLES - len(stats["rejected_examples"])
+        if missing > 0:
+            stats["rejected_examples"] += list(flow_ids[~valid][:missing])
+        if entries_file is not None and len(new_keys):
+            entries_file.write(get_flow_entry_lines(new_keys, f_action))
+        if keep_keys:
+            flow_keys.append(new_keys)
+    stats["seconds"] = time.time() - start
+    flow_keys = np.concatenate(flow_keys) if flow_keys else np.zeros(0, dtype=FLOW_KEY_DTYPE)
+    return (flow_keys if keep_keys else None), stats
+
+## flow_action_table of the entries artifact from the packed 5-tuples
+def get_flow_action_artifact_table(flow_keys, f_action=FLOW_ACTION):
+    columns = [flow_keys[name].astype(np.uint64) for name in FLOW_KEY_DTYPE.names]
+    return get_flow_action_table_entries(*columns, np.full(len(flow_keys), f_action, dtype=np.uint64))
+
+def report_flow_action_entries(stats):
+    print("flow_action_table: {} flows from {} rows in {} chunks ({:.1f} s), {} duplicate rows, {} rejected rows".format(
+        stats["flows"], stats["rows"], stats["chunks"], stats["seconds"], stats["duplicates"], stats["rejected"]))
+    for flow_id in stats["rejected_examples"]:
+        print("  rejected: {!r}".format(flow_id))
@@ -0,0 +1,118 @@
+## Eviction of the classified flows pinned in flow_action_table.
+## The table (size 20000 in unibs_flowrest.p4) is not declared with idle_timeout,
+## so there are no hardware idle notifications: the last use of every entry is
+## kept in a local LRU index, refreshed whenever a digest reports the flow again.
+## Entries older than the TTL are deleted, and when the occupancy goes over the
+## high-water mark the least recently used entries are deleted down to the
+## low-water mark, so that new classified flows can always be pinned.
+## The flows are installed with f_action 1 by the generator and pinned by the
+## writer with entry_mod (entry_add only for the keys not in the table, see
+## control_pipeline.write_flow_actions); deleting a pinned entry does not change
+## the forwarding, since a miss also sets f_action 0 (set_miss_flow_action).
+## Deletes are sent in batches of delete_batch keys with one entry_del each.
+import time
+from collections import OrderedDict
+
+## entries of flow_action_table in the P4 program
+FLOW_TABLE_SIZE = 20000
+## seconds after which an entry not refreshed is deleted
+FLOW_TTL = 120
+## occupancy (fraction of the table) triggering the eviction of the oldest entries
+HIGH_WATER = 0.9
+## occupancy (fraction of the table) left after an eviction on the high-water mark
+LOW_WATER = 0.8
+## keys per entry_del
+DELETE_BATCH = 1024
+## seconds between two sweeps of the expired entries when no flow is written
+SWEEP_INTERVAL = 1.0
+
+## LRU index of the entries of flow_action_table and eviction counters
+def open_flow_eviction(table_size=FLOW_TABLE_SIZE, ttl=FLOW_TTL, high_water=HIGH_WATER, low_water=LOW_WATER,
+                       delete_batch=DELETE_BATCH):
+    return {"entries": OrderedDict(), "ttl": ttl, "table_size": table_size,
+            "high_water": int(table_size * high_water), "low_water": int(table_size * low_water),
+            "delete_batch": delete_batch, "last_sweep": time.time(),
+            "added": 0, "refreshed": 0, "evicted_ttl": 0, "evicted_capacity": 0, "delete_calls": 0,
+            "delete_errors": 0, "max_occupancy": 0}
+
+## refresh the entries of the flows already pinned, return the flows (dict flow: key) to add
+def touch_flows(eviction, flows, now=None):
+    now = time.time() if now is None else now
+    entries = eviction["entries"]
+    new_flows = {}
+    for flow, key in flows.items():
+        if flow in entries:
+            entries[flow] = (entries[flow][0], now)
+            entries.move_to_end(flow)
+            eviction["refreshed"] += 1
+        else:
+            new_flows[flow] = key
+    return new_flows
+
+## pop from the index the entries to delete: expired ones, then the least
+## recently used ones if adding num_of_new entries goes over the high-water mark
+def pop_evicted_flows(eviction, num_of_new=0, now=None):
+    now = time.time() if now is None else now
+    entries = eviction["entries"]
+    evicted = []
+    deadline = now - eviction["ttl"]
+    while entries:
+        flow, (key, last_use) = next(iter(entries.items()))
+        if last_use >= deadline:
+            break
+        entries.popitem(last=False)
+        evicted.append(key)
+    eviction["evicted_ttl"] += len(evicted)
+    if len(entries) + num_of_new > eviction["high_water"]:
+        target = max(eviction["low_water"] - num_of_new, 0)
+        while len(entries) > target:
+            evicted.append(entries.popitem(last=False)[1][0])
+            eviction["evicted_capacity"] += 1
+    eviction["last_sweep"] = now
+    return evicted
+
+## add the new flows to the index
+def add_flows(eviction, new_flows, now=None):
+    now = time.time() if now is None else now
+    for flow, key in new_flows.items():
+        eviction["entries"][flow] = (key, now)
+    eviction["added"] += len(new_flows)
+    eviction["max_occupancy"] = max(eviction["max_occupancy"], len(eviction["entries"]))
+
+## delete the keys from the table, delete_batch keys at a time
+def delete_entries(eviction, table, target, keys, p4_name=None):
+    for start in range(0, len(keys), eviction["delete_batch"]):
+        try:
+            table.entry_del(target, key_list=keys[start:start+eviction["delete_batch"]], p4_name=p4_name)
+        except Exception as error:
+            # the entries are dropped from the index anyway: at worst they stay in
+            # the table until it is cleared
+            eviction["delete_errors"] += 1
+            print("Delete error:", error)
+        eviction["delete_calls"] += 1
+
+## flows of a batch to add to the table, after making room for them
+def get_flows_to_add(eviction, table, target, flows, p4_name=None, now=None):
+    now = time.time() if now is None else now
+    new_flows = touch_flows(eviction, flows, now)
+    delete_entries(eviction, table, target, pop_evicted_flows(eviction, len(new_flows), now), p4_name)
+    return new_flows
+
+## delete the expired entries, at most every SWEEP_INTERVAL seconds
+def sweep_expired_flows(eviction, table, target, p4_name=None, now=None):
+    now = time.time() if now is None else now
+    if now - eviction["last_sweep"] >= SWEEP_INTERVAL:
+        delete_entries(eviction, table, target, pop_evicted_flows(eviction, 0, now), p4_name)
+
+## counters of the eviction, with the current occupancy
+def get_eviction_counters(eviction):
+    counters = {name: value for name, value in eviction.items() if name not in ("entries", "last_sweep")}
+    counters["occupancy"] = len(eviction["entries"])
+    return counters
+
+## print the occupancy of the table and the eviction counters
+def report_eviction(counters):
+    print("flow_action_table: {}/{} entries (max {}, high-water {}), {} added, {} refreshed, {} expired, {} evicted over the high-water mark, {} deletes, {} errors".format(
+        counters["occupancy"], counters["table_size"], counters["max_occupancy"], counters["high_water"],
+        counters["added"], counters["refreshed"], counters["evicted_ttl"], counters["evicted_capacity"],
+        counters["delete_calls"], counters["delete_errors"]))
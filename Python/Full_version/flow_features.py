@@ -0,0 +1,179 @@
+## Extraction of the flow features of the first packets of every flow of a pcap,
+## computed as the registers of unibs_flowrest.p4 compute them.
+## usage: python3 flow_features.py TRACE.pcap FEATURES.csv [NUM_OF_PACKETS] [WORKERS]
+## For each of the first NUM_OF_PACKETS (3: the classification) packets of a
+## flow, one row with the features after that packet:
+##  - Packet Count: reg_pkt_count, 8 bits,
+##  - Packet Length Total: reg_pkt_len_total, sum of the IPv4 total_len on 16 bits
+##    (wrapping, like the bit<16> addition of the register),
+##  - Max Packet Length: reg_pkt_len_max, 16 bits,
+##  - ACK Flag Count: reg_ack_flag_count, 8 bits (wrapping), TCP only,
+##  - Current Packet Length: hdr.ipv4.total_len,
+##  - Source Port, Destination Port (0 for other protocols than TCP and UDP), Protocol,
+## and the flow.id "src_addr dst_addr src_port dst_port protocol" of the csv files
+## of the analysis. The flows are assumed to own a clean register slot.
+## The pcap is read in chunks of CHUNK_BYTES by pcap_reader.py; the packets
+## are sharded by a hash of their 5-tuple across worker processes, each one
+## keeping the state of its flows (at most max_flows, the least recently seen
+## are forgotten and start again as new flows) and writing its own csv file.
+import os
+import sys
+import multiprocessing
+import numpy as np
+import pandas as pd
+from classification_log import int_to_ip, int_to_str
+from pcap_reader import read_pcap_chunks, CHUNK_BYTES
+
+## packets of a flow with a row of features (classification at the 3rd packet)
+NUM_OF_PACKETS = 3
+## flows kept by every worker
+MAX_FLOWS = 1 << 22
+## chunks waiting for every worker
+SHARD_QUEUE_SIZE = 4
+## columns of the output, with the names of the csv files of the analysis
+FEATURE_COLUMNS = ['flow.id', 'Source Port', 'Destination Port', 'Protocol', 'Packet Count', 'Current Packet Length',
+                   'Max Packet Length', 'Packet Length Total', 'ACK Flag Count']
+
+## the 5-tuple of every packet as two integer keys
+def get_flow_keys(packets):
+    return (packets["src_addr"] << 32) | packets["dst_addr"], \
+        (packets["src_port"] << 24) | (packets["dst_port"] << 8) | packets["protocol"]
+
+## shard of every packet, from a hash of its 5-tuple
+def get_shards(packets, num_of_shards):
+    key0, key1 = get_flow_keys(packets)
+    mixed = (key0.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) ^ key1.astype(np.uint64)
+    mixed = mixed * np.uint64(0xBF58476D1CE4E5B9)
+    return ((mixed >> np.uint64(32)) % np.uint64(num_of_shards)).astype(np.int64)
+
+## state of the flows of a worker: packets seen (at most num_of_packets), the
+## registers after the last one and the time of the last packet
+def get_flow_state():
+    return pd.DataFrame({"key0": pd.Series(dtype=np.int64), "key1": pd.Series(dtype=np.int64),
+                         "count": pd.Series(dtype=np.int64), "total": pd.Series(dtype=np.int64),
+                         "max": pd.Series(dtype=np.int64), "ack": pd.Series(dtype=np.int64),
+                         "last": pd.Series(dtype=np.int64)}).set_index(["key0", "key1"])
+
+## features of the packets of a chunk that are among the first num_of_packets
+## of their flow, and the updated state
+def update_flows(state, packets, num_of_packets=NUM_OF_PACKETS, max_flows=MAX_FLOWS):
+    frame = pd.DataFrame(packets)
+    frame["key0"], frame["key1"] = get_flow_keys(packets)
+    frame = frame.sort_values("timestamp", kind="stable")
+    previous = state.reindex(pd.MultiIndex.from_frame(frame[["key0", "key1"]]), fill_value=0)
+    flows = frame.groupby(["key0", "key1"], sort=False)
+    frame["Packet Count"] = previous["count"].values + flows.cumcount().values + 1
+    frame["last"] = flows["timestamp"].transform("max")
+    frame["seen"] = flows["timestamp"].transform("size")
+    rows = frame[frame["Packet Count"] <= num_of_packets].copy()
+    previous = previous[frame["Packet Count"].values <= num_of_packets]
+    kept = rows.groupby(["key0", "key1"], sort=False)
+    # the registers wrap at their width
+    rows["Packet Length Total"] = (previous["total"].values + kept["total_len"].cumsum().values) & 0xffff
+    rows["Max Packet Length"] = np.maximum(previous["max"].values, kept["total_len"].cummax().values)
+    rows["ACK Flag Count"] = (previous["ack"].values + kept["ack_flag"].cumsum().values) & 0xff
+    rows["Packet Count"] &= 0xff
+    # state of the flows of the chunk after their last packet
+    updated = frame.groupby(["key0", "key1"], sort=False).agg(last=("last", "max"), seen=("seen", "max"))
+    previous_count = state["count"].reindex(updated.index, fill_value=0)
+    last_rows = rows.groupby(["key0", "key1"], sort=False)[["Packet Length Total", "Max Packet Length",
+                                                            "ACK Flag Count"]].last()
+    updated["count"] = np.minimum(previous_count.values + updated["seen"].values, num_of_packets)
+    updated = updated.join(last_rows)
+    # the flows already past num_of_packets keep their registers
+    for column, register in (("Packet Length Total", "total"), ("Max Packet Length", "max"), ("ACK Flag Count", "ack")):
+        updated[register] = updated[column].fillna(state[register].reindex(updated.index)).fillna(0).astype(np.int64)
+    updated = updated[["count", "total", "max", "ack", "last"]]
+    state = pd.concat([state[~state.index.isin(updated.index)], updated])
+    evicted = max(len(state) - max_flows, 0)
+    if evicted:
+        # the least recently seen flows are forgotten
+        state = state.iloc[np.argsort(state["last"].values, kind="stable")[evicted:]]
+    return rows, state, evicted
+
+## csv lines of the rows of features
+def get_feature_lines(rows):
+    flow_ids = int_to_ip(rows["src_addr"].values) + " " + int_to_ip(rows["dst_addr"].values) + " " + \
+        int_to_str(rows["src_port"].values) + " " + int_to_str(rows["dst_port"].values) + " " + \
+        int_to_str(rows["protocol"].values)
+    strings = [flow_ids, int_to_str(rows["src_port"].values), int_to_str(rows["dst_port"].values),
+               int_to_str(rows["protocol"].values)] + \
+              [int_to_str(rows[name].values) for name in FEATURE_COLUMNS[4:8]] + \
+              [int_to_str(rows["ACK Flag Count"].values)]
+    return "".join(line + "\n" for line in map(",".join, zip(*strings)))
+
+## worker: features of the chunks of packets of a shard, written to path
+def extract_shard(chunks, path, num_of_packets=NUM_OF_PACKETS, max_flows=MAX_FLOWS):
+    state = get_flow_state()
+    counters = {"packets": 0, "rows": 0, "evicted": 0}
+    with open(path, "w") as features_file:
+        features_file.write(",".join(FEATURE_COLUMNS) + "\n")
+        for packets in chunks:
+            rows, state, evicted = update_flows(state, packets, num_of_packets, max_flows)
+            rows = rows.rename(columns={"total_len": "Current Packet Length"})
+            features_file.write(get_feature_lines(rows))
+            counters["packets"] += len(packets["timestamp"])
+            counters["rows"] += len(rows)
+            counters["evicted"] += evicted
+    counters["flows"] = len(state)
+    return counters
+
+## forked worker process: chunks from a queue until None, counters to the results
+def run_shard(chunks, results, shard, path, num_of_packets, max_flows):
+    results.put((shard, extract_shard(iter(chunks.get, None), path, num_of_packets, max_flows)))
+
+## path of the file of a shard: name.0.csv, name.1.csv...
+def get_shard_path(path, shard):
+    root, extension = os.path.splitext(path)
+    return root + "." + str(shard) + extension
+
+## extract the features of a pcap with one worker process per shard, then merge
+## the files of the shards in path
+def extract_features(pcap_path, path, num_of_packets=NUM_OF_PACKETS, num_of_workers=None, max_flows=MAX_FLOWS,
+                     chunk_bytes=CHUNK_BYTES):
+    if num_of_workers is None:
+        num_of_workers = os.cpu_count() or 1
+    if num_of_workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        counters = [extract_shard(read_pcap_chunks(pcap_path, chunk_bytes), path, num_of_packets, max_flows)]
+    else:
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        shard_queues = [context.Queue(maxsize=SHARD_QUEUE_SIZE) for shard in range(num_of_workers)]
+        workers = [context.Process(target=run_shard, args=(shard_queues[shard], results, shard,
+                                                           get_shard_path(path, shard), num_of_packets, max_flows))
+                   for shard in range(num_of_workers)]
+        for worker in workers:
+            worker.start()
+        for packets in read_pcap_chunks(pcap_path, chunk_bytes):
+            shards = get_shards(packets, num_of_workers)
+            for shard in range(num_of_workers):
+                selected = shards == shard
+                shard_queues[shard].put({name: values[selected] for name, values in packets.items()})
+        for shard_queue in shard_queues:
+            shard_queue.put(None)
+        counters = [counter for shard, counter in sorted(results.get() for worker in workers)]
+        for worker in workers:
+            worker.join()
+        merge_shards(path, num_of_workers)
+    total = {name: sum(counter[name] for counter in counters) for name in counters[0]}
+    print("{} packets, {} flows, {} rows of features, {} flows forgotten over {} flows per worker".format(
+        total["packets"], total["flows"], total["rows"], total["evicted"], max_flows))
+    return total
+
+## concatenate the files of the shards (without their header) in path
+def merge_shards(path, num_of_shards):
+    with open(path, "w") as features_file:
+        features_file.write(",".join(FEATURE_COLUMNS) + "\n")
+        for shard in range(num_of_shards):
+            with open(get_shard_path(path, shard)) as shard_file:
+                shard_file.readline()
+                while True:
+                    block = shard_file.read(CHUNK_BYTES)
+                    if not block:
+                        break
+                    features_file.write(block)
+            os.remove(get_shard_path(path, shard))
+
+if __name__ == "__main__":
+    extract_features(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else NUM_OF_PACKETS,
+                     int(sys.argv[4]) if len(sys.argv) > 4 else None)
@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+## Trace-driven simulation of the flow registers of unibs_flowrest.p4, to size
+## MAX_REGISTER_ENTRIES (INDEX_WIDTH) and timeout_threshold for a given traffic.
+## usage: python3 flow_register_simulator.py TRACE.pcap|TRACE.csv [INDEX_WIDTHS] [TIMEOUTS] [REPORT.csv] [CONTROLLER_DELAY]
+##        e.g. python3 flow_register_simulator.py trace.pcap 12,14,16 256,512,1024
+##
+## Every packet goes through the same logic as the ingress of the P4 program:
+##  - the slot is the CRC16 of the 5-tuple (idx_calc), the flow identity its CRC32
+##    (flow_id_calc), both over src_addr, dst_addr, src_port, dst_port, protocol,
+##  - the time is global_tstamp[47:20] (units of 2^20 ns, about 1.05 ms),
+##  - an empty slot (reg_status 0) is taken by the flow,
+##  - a packet of another flow in a slot used less than timeout_threshold ago is
+##    a collision (class 255), otherwise it is recirculated (class 127) and
+##    takes the slot,
+##  - the flow is classified when its 8-bit packet counter reaches 3, and its
+##    digest makes the controller reset the registers of the slot and set
+##    f_action 0 for the flow controller_delay seconds later (None: no
+##    controller, the slot is only taken back after timeout_threshold); the
+##    packets of the flow after that bypass the registers.
+## Flows with the same CRC32 in the same slot are not told apart by the switch,
+## they are reported as aliased packets. All the packets of the flows not
+## classified yet are assumed to hit flow_action_table (f_action != 0).
+## The trace is read in chunks (pcap_reader.py) and replayed in the order of
+## the file, sorted by time within a chunk; only the registers of the slots,
+## the pending resets and the counters of the flows are kept between chunks.
+## Every worker of a sweep reads the trace once for all its configurations.
+import os
+import sys
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import numpy as np
+import pandas as pd
+from p4_tables import get_p4_source, get_p4_define
+from pcap_reader import read_pcap_chunks, CHUNK_BYTES
+
+P4_FILE = '../../P4/Full_version/unibs_flowrest.p4'
+## packet counter value that triggers the classification (meta.pkt_count == 3)
+CLASSIFICATION_PACKET = 3
+## seconds from the classification of a flow to the reset of its slot and its
+## f_action 0 by the controller (digest, receiver, writer)
+CONTROLLER_DELAY = 0.01
+## interval between two samples of the slot occupancy, in ns
+OCCUPANCY_INTERVAL = 10**9
+## rows of a csv trace read at once
+CSV_CHUNK_ROWS = 1 << 20
+## columns of the packets of a trace (timestamp in ns)
+PACKET_COLUMNS = ["timestamp", "src_addr", "dst_addr", "src_port", "dst_port", "protocol"]
+
+## dotted IPv4 addresses (or integers) to integers
+def ip_to_int(addresses):
+    addresses = pd.Series(addresses)
+    if addresses.dtype.kind in "iu":
+        return addresses.values.astype(np.int64)
+    octets = addresses.astype(str).str.split(".", expand=True).astype(np.int64).values
+    return (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+
+## read the packets of a csv file with one row per packet and the PACKET_COLUMNS
+## (timestamp in seconds, addresses dotted or as integers), chunk_rows at a time
+def read_packet_csv_chunks(path, chunk_rows=CSV_CHUNK_ROWS):
+    for packets in pd.read_csv(path, chunksize=chunk_rows):
+        packets["timestamp"] = np.round(packets["timestamp"].astype(float) * 10**9).astype(np.int64)
+        for column in ("src_addr", "dst_addr"):
+            packets[column] = ip_to_int(packets[column])
+        yield packets
+
+## read a trace, pcap or csv, one DataFrame of packets per chunk
+def read_trace_chunks(path, chunk_bytes=CHUNK_BYTES):
+    if path.endswith(".csv"):
+        return read_packet_csv_chunks(path)
+    return (pd.DataFrame(packets) for packets in read_pcap_chunks(path, chunk_bytes))
+
+## lookup tables of the reflected CRCs (poly is the reversed polynomial)
+def get_crc_table(poly):
+    table = np.arange(256, dtype=np.uint64)
+    for bit in range(8):
+        table = np.where(table & 1, (table >> np.uint64(1)) ^ np.uint64(poly), table >> np.uint64(1))
+    return table
+
+CRC16_TABLE = get_crc_table(0xA001)
+CRC32_TABLE = get_crc_table(0xEDB88320)
+
+## CRC of every row of a byte matrix, one byte column at a time
+def get_crc(data, table, init, xor_out):
+    crc = np.full(len(data), init, dtype=np.uint64)
+    for column in data.T:
+        crc = table[(crc ^ column) & np.uint64(0xff)] ^ (crc >> np.uint64(8))
+    return crc ^ np.uint64(xor_out)
+
+## CRC16 (idx_calc) and CRC32 (flow_id_calc) of the 5-tuples, as the field
+## list {src_addr, dst_addr, src_port, dst_port, protocol} in network order
+def get_flow_hashes(flows):
+    fields = [(flows["src_addr"], 4), (flows["dst_addr"], 4), (flows["src_port"], 2), (flows["dst_port"], 2),
+              (flows["protocol"], 1)]
+    data = np.concatenate([np.asarray(values, dtype=">u8").view(np.uint8).reshape(-1, 8)[:, 8-size:]
+                           for values, size in fields], axis=1).astype(np.uint64)
+    return get_crc(data, CRC16_TABLE, 0, 0), get_crc(data, CRC32_TABLE, 0xFFFFFFFF, 0xFFFFFFFF)
+
+## digests of the inference of one flow in the ingress of the P4 program, from
+## the final_class of its packets 1, 2 and 3 (0: no early exit, or a miss of the
+## voting table), all of them reaching the inference (f_action not set to 0 by
+## the controller yet): reg_classified_flag keeps the first class of the flow, an
+## early class is digested once, and a flow not classified early is digested at
+## the 3rd packet whatever its class. Returns the (packet, class) of the digests
+## and reg_classified_flag after every packet
+def get_inference_digests(packet_classes):
+    digests, flags = [], []
+    classified_flag = 0
+    for pkt_count, final_class in enumerate(packet_classes, 1):
+        is_first = pkt_count == 1
+        # update_classified_flag returns the flag before the packet
+        previous_flag = classified_flag
+        if is_first or classified_flag == 0:
+            classified_flag = final_class
+        if pkt_count == CLASSIFICATION_PACKET:
+            if previous_flag == 0:
+                digests.append((pkt_count, final_class))
+        elif final_class != 0 and (is_first or previous_flag == 0):
+            digests.append((pkt_count, final_class))
+        flags.append(classified_flag)
+    return digests, flags
+
+## state of a simulation kept from one chunk of the trace to the next: the
+## registers of every slot, the resets of the controller not applied yet, and
+## the counters of every flow seen (no packet is kept)
+def get_simulation_state(index_width, timeout, controller_delay=CONTROLLER_DELAY):
+    num_of_slots = 1 << index_width
+    return {"index_width": index_width, "timeout": timeout, "controller_delay": controller_delay,
+            "status": np.zeros(num_of_slots, dtype=bool), "time_occ": np.zeros(num_of_slots, dtype=np.int64),
+            "slot_flow_id": [0] * num_of_slots, "slot_owner": [-1] * num_of_slots, "pkt_count": [0] * num_of_slots,
+            "resets": deque(), "flows": {}, "flow_slot": [], "flow_id": [],
+            "num_of_packets": np.zeros(0, dtype=np.int64), "first_packet": np.zeros(0, dtype=np.int64),
+            "classified_at": np.zeros(0, dtype=np.int64), "collided": np.zeros(0, dtype=bool),
+            "bypass": np.zeros(0, dtype=bool), "packets": 0, "collisions": 0, "recirculations": 0, "aliased": 0,
+            "classifications": 0, "bypassed": 0, "occupancy": [], "next_sample": None}
+
+## flow of every packet of a chunk (sorted by time), flows numbered in order of
+## their first packet in the trace; the flows not seen yet are added to the state
+def add_chunk_flows(state, packets):
+    # flows numbered in order of their first packet in the chunk
+    flow_of_packet = packets.groupby(PACKET_COLUMNS[1:], sort=False).ngroup().values
+    keys = packets[PACKET_COLUMNS[1:]].drop_duplicates()
+    flows = state["flows"]
+    chunk_flows = np.empty(len(keys), dtype=np.int64)
+    new = np.zeros(len(keys), dtype=bool)
+    for chunk_flow, key in enumerate(keys.itertuples(index=False, name=None)):
+        flow = flows.get(key)
+        if flow is None:
+            flow = flows[key] = len(flows)
+            new[chunk_flow] = True
+        chunk_flows[chunk_flow] = flow
+    num_of_new = int(new.sum())
+    if num_of_new:
+        crc16, crc32 = get_flow_hashes(keys[new])
+        num_of_slots = 1 << state["index_width"]
+        # register indices wider than the CRC16 take the low bits of the CRC32
+        index_hash = crc16 if state["index_width"] <= 16 else crc32
+        state["flow_slot"] += (index_hash & np.uint64(num_of_slots - 1)).astype(np.int64).tolist()
+        state["flow_id"] += crc32.tolist()
+        first_packet = packets["timestamp"].values[np.unique(flow_of_packet, return_index=True)[1]][new]
+        state["first_packet"] = np.concatenate([state["first_packet"], first_packet.astype(np.int64)])
+        for name, dtype, value in [("num_of_packets", np.int64, 0), ("classified_at", np.int64, -1),
+                                   ("collided", bool, False), ("bypass", bool, False)]:
+            state[name] = np.concatenate([state[name], np.full(num_of_new, value, dtype=dtype)])
+    flow_of_packet = chunk_flows[flow_of_packet]
+    state["num_of_packets"] += np.bincount(flow_of_packet, minlength=len(state["flows"]))
+    return flow_of_packet
+
+## replay the packets of a chunk in the registers of the switch, with the
+## resets of the controller applied controller_delay seconds after the digests
+def simulate_chunk(state, packets):
+    packets = packets.sort_values("timestamp", kind="stable")
+    flow_of_packet = add_chunk_flows(state, packets)
+    timeout, controller_delay = state["timeout"], state["controller_delay"]
+    status, time_occ = state["status"], state["time_occ"]
+    slot_flow_id, slot_owner, pkt_count = state["slot_flow_id"], state["slot_owner"], state["pkt_count"]
+    flow_slot, flow_id, resets = state["flow_slot"], state["flow_id"], state["resets"]
+    classified_at, collided, bypass = state["classified_at"], state["collided"], state["bypass"]
+    occupancy = state["occupancy"]
+    timestamps = packets["timestamp"].values.astype(np.int64)
+    # global_tstamp[47:20]
+    nows = ((timestamps & ((1 << 48) - 1)) >> 20).tolist()
+    if state["next_sample"] is None and len(timestamps):
+        state["next_sample"] = timestamps[0]
+    next_sample = state["next_sample"]
+    collisions = recirculations = aliased = classifications = bypassed = 0
+    for packet, (flow, now) in enumerate(zip(flow_of_packet.tolist(), nows)):
+        timestamp = timestamps[packet]
+        while timestamp >= next_sample:
+            # slots of flows seen less than timeout_threshold ago
+            live = status & (((now - time_occ) & 0xffffffff) < timeout)
+            occupancy.append((next_sample, int(live.sum()), int(status.sum())))
+            next_sample += OCCUPANCY_INTERVAL
+        while resets and resets[0][0] <= timestamp:
+            # the controller resets the slot by index, whoever holds it now
+            reset_slot, reset_flow = resets.popleft()[1:]
+            status[reset_slot] = False
+            slot_flow_id[reset_slot], slot_owner[reset_slot], pkt_count[reset_slot], time_occ[reset_slot] = 0, -1, 0, 0
+            bypass[reset_flow] = True
+        if bypass[flow]:
+            bypassed += 1
+            continue
+        slot = flow_slot[flow]
+        if not status[slot]:
+            status[slot] = True
+            slot_flow_id[slot], slot_owner[slot], pkt_count[slot], time_occ[slot] = flow_id[flow], flow, 1, now
+        elif slot_flow_id[slot] != flow_id[flow]:
+            if ((now - time_occ[slot]) & 0xffffffff) < timeout:
+                collisions += 1
+                collided[flow] = True
+            else:
+                # the recirculated packet takes the slot as a first packet
+                recirculations += 1
+                slot_flow_id[slot], slot_owner[slot], pkt_count[slot], time_occ[slot] = flow_id[flow], flow, 1, now
+        else:
+            if slot_owner[slot] != flow:
+                aliased += 1
+            pkt_count[slot] = (pkt_count[slot] + 1) & 0xff
+            time_occ[slot] = now
+            if pkt_count[slot] == CLASSIFICATION_PACKET:
+                classifications += 1
+                if classified_at[flow] < 0:
+                    classified_at[flow] = timestamp
+                if controller_delay is not None:
+                    resets.append((timestamp + int(controller_delay * 10**9), slot, flow))
+    state["next_sample"] = next_sample
+    state["packets"] += len(timestamps)
+    for name, value in [("collisions", collisions), ("recirculations", recirculations), ("aliased", aliased),
+                        ("classifications", classifications), ("bypassed", bypassed)]:
+        state[name] += value
+
+## replay the chunks of packets of a trace in the registers of the switch
+def simulate_registers(chunks, index_width, timeout, controller_delay=CONTROLLER_DELAY):
+    state = get_simulation_state(index_width, timeout, controller_delay)
+    for packets in chunks:
+        simulate_chunk(state, packets)
+    return get_simulation_report(state)
+
+## summary of a simulation
+def get_simulation_report(state):
+    num_of_flows = len(state["flows"])
+    num_of_packets = max(state["packets"], 1)
+    eligible = state["num_of_packets"] >= CLASSIFICATION_PACKET
+    classified_at = state["classified_at"]
+    classified = classified_at >= 0
+    # time from the first packet of the flow to its classification, in ms
+    delays = (classified_at[classified] - state["first_packet"][classified]) / 10**6
+    occupancy = np.array(state["occupancy"], dtype=np.int64).reshape(-1, 3)
+    num_of_slots = 1 << state["index_width"]
+    return {"index_width": state["index_width"], "slots": num_of_slots, "timeout": state["timeout"],
+            "packets": state["packets"], "flows": num_of_flows,
+            "collision_rate": state["collisions"] / num_of_packets,
+            "recirculation_rate": state["recirculations"] / num_of_packets,
+            "aliased_rate": state["aliased"] / num_of_packets,
+            "bypass_rate": state["bypassed"] / num_of_packets,
+            "collided_flows": state["collided"].sum() / max(num_of_flows, 1),
+            "classified_flows": classified.sum() / max(eligible.sum(), 1),
+            "classifications": state["classifications"],
+            "ttc_p50_ms": np.percentile(delays, 50) if len(delays) else np.nan,
+            "ttc_p99_ms": np.percentile(delays, 99) if len(delays) else np.nan,
+            "mean_occupancy": occupancy[:, 1].mean() / num_of_slots if len(occupancy) else 0.0,
+            "max_occupancy": occupancy[:, 1].max() / num_of_slots if len(occupancy) else 0.0,
+            "occupancy": occupancy}
+
+## simulate several configurations in one pass over the chunks of a trace
+def simulate_configs(path, configs, chunk_bytes=CHUNK_BYTES):
+    states = [get_simulation_state(*config) for config in configs]
+    for packets in read_trace_chunks(path, chunk_bytes):
+        for state in states:
+            simulate_chunk(state, packets)
+    return [get_simulation_report(state) for state in states]
+
+## the path of the trace is shared with the forked workers, every worker reads
+## the trace once for its share of the configurations
+SIMULATION_TRACE = None
+
+def simulate_share(configs):
+    return simulate_configs(SIMULATION_TRACE["path"], configs, SIMULATION_TRACE["chunk_bytes"])
+
+## simulate every pair of index width and timeout, the configurations shared
+## out between the worker processes
+def sweep_registers(path, index_widths, timeouts, max_workers=None, controller_delay=CONTROLLER_DELAY,
+                    chunk_bytes=CHUNK_BYTES):
+    global SIMULATION_TRACE
+    SIMULATION_TRACE = {"path": path, "chunk_bytes": chunk_bytes}
+    configs = list(product(index_widths, timeouts, [controller_delay]))
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(configs))
+    if max_workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return simulate_share(configs)
+    shares = [configs[worker::max_workers] for worker in range(max_workers)]
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        reports = {}
+        for share, share_reports in zip(shares, executor.map(simulate_share, shares)):
+            reports.update(zip(share, share_reports))
+    return [reports[config] for config in configs]
+
+## table of the simulations, without the occupancy time series
+def get_sweep_table(reports):
+    return pd.DataFrame([{name: value for name, value in report.items() if name != "occupancy"} for report in reports])
+
+## print the simulations
+def report_sweep(reports):
+    print("{:>6} {:>8} {:>8} {:>10} {:>10} {:>9} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "width", "slots", "timeout", "collision", "recirc", "collided", "classified", "ttc p50", "ttc p99", "occupancy",
+        "bypass"))
+    for report in reports:
+        print("{:>6} {:>8} {:>8} {:>10.4%} {:>10.4%} {:>9.4%} {:>10.4%} {:>8.1f}ms {:>8.1f}ms {:>10.4%} {:>10.4%}".format(
+            report["index_width"], report["slots"], report["timeout"], report["collision_rate"],
+            report["recirculation_rate"], report["collided_flows"], report["classified_flows"],
+            report["ttc_p50_ms"], report["ttc_p99_ms"], report["max_occupancy"], report["bypass_rate"]))
+
+if __name__ == "__main__":
+    source = get_p4_source(P4_FILE) if os.path.exists(P4_FILE) else ""
+    # the values of the P4 program by default
+    index_widths = [int(width) for width in sys.argv[2].split(",")] if len(sys.argv) > 2 else \
+        [get_p4_define("INDEX_WIDTH", source) or 16]
+    timeouts = [int(timeout) for timeout in sys.argv[3].split(",")] if len(sys.argv) > 3 else \
+        [get_p4_define("timeout_threshold", source) or 512]
+    # seconds, or "none" for no controller
+    controller_delay = CONTROLLER_DELAY if len(sys.argv) <= 5 else \
+        None if sys.argv[5].lower() == "none" else float(sys.argv[5])
+    reports = sweep_registers(sys.argv[1], index_widths, timeouts, controller_delay=controller_delay)
+    print(reports[0]["packets"], "packets", reports[0]["flows"], "flows")
+    report_sweep(reports)
+    if len(sys.argv) > 4:
+        get_sweep_table(reports).to_csv(sys.argv[4], index=False)
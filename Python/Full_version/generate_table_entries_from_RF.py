@@ -1,5 +1,5 @@
-## This file is adapted to an RF model with 3 trees. 
-## Adapt it to your model accordingly.
+## This file generates the entries of an RF model with any number of trees and classes.
+## The tables and actions of the P4 program must be adapted to the model accordingly.
 import os
 import sys
 import pickle as pickle
@@ -11,9 +11,22 @@ import re
 # from netaddr import IPAddress
 from statistics import mode
 import random
-import ipaddress
 # To calculate hash of flow_id
 import zlib
+from rf_compiler import get_feature_codes_with_ranges, format_bits
+from voting_compiler import get_voting_entries, write_voting_entries
+from entries_artifact import get_feature_table_entries, get_feature_table_ternary_entries, get_code_table_entries, get_voting_table_entries, save_entries, get_num_of_entries
+from p4_tables import get_p4_table_sizes, get_p4_table_keys, get_p4_source, get_p4_macro, report_table_usage
+from tcam_expansion import report_tcam_footprint
+from codeword_layout import get_codeword_layout, get_feature_code_trees, write_p4_includes, report_resources
+from pipeline_emulator import get_emulation_samples, check_entries, is_exact
+from compile_cache import open_compile_cache, compile_feature_tables_cached, compile_trees_cached, \
+    get_feature_ternary_entries_cached, get_tcam_footprint_cached, close_compile_cache
+from feature_quantization import quantize_forest, load_quantization
+from entries_minimizer import minimize_entries, report_minimization
+from flow_action_entries import write_flow_action_entries, get_flow_action_artifact_table, report_flow_action_entries
+from early_exit import get_early_exit_phases, get_table_script_lines, check_phase, get_shared_layout, \
+    write_early_exit_includes, report_early_exit
 
 np.random.seed(42)
 
@@ -24,206 +37,61 @@ clf = pd.read_pickle('YOUR_TRAINED_MODEL.pkl')
 feature_names = clf.feature_names_in_
 print(feature_names)
 
-## definition of useful functions
-## gets all splits and conditions
-def get_splits(forest, feature_names):
-    data = []
-    #generate dataframe with all thresholds and features
-    for t in range(len(forest.estimators_)):
-        clf = forest[t]
-        n_nodes = clf.tree_.node_count
-        features  = [feature_names[i] for i in clf.tree_.feature]
-        for i in range(0, n_nodes):
-            node_id = i
-            left_child_id = clf.tree_.children_left[i]
-            right_child_id = clf.tree_.children_right[i]
-            threshold = clf.tree_.threshold[i]
-            feature = features[i]
-            if threshold != -2.0:
-                data.append([t, node_id, left_child_id,
-                             right_child_id, threshold, feature])
-    data = pd.DataFrame(data)
-    data.columns = ["Tree","NodeID","LeftID","RightID","Threshold","Feature"]
-    return data
-
-## gets the feature table of each feature from the splits
-def get_feature_table(splits_data, feature_name):
-    feature_data = splits_data[splits_data["Feature"]==feature_name]
-    feature_data = feature_data.sort_values(by="Threshold")
-    feature_data = feature_data.reset_index(drop=True)
-    ##
-    # feature_data["Threshold"] = (feature_data["Threshold"]).astype(int)
-    feature_data["Threshold"] = feature_data["Threshold"].astype(int)
-    ##
-    code_table = pd.DataFrame()
-    code_table["Threshold"] = feature_data["Threshold"]
-    #print(feature_data)
-    #create a column for each split in each tree
-    for tree_id, node in zip(list(feature_data["Tree"]), list(feature_data["NodeID"])):
-        colname = "s"+str(tree_id)+"_"+str(node)
-        code_table[colname] = np.where((code_table["Threshold"] <=
-                                        feature_data[(feature_data["NodeID"]== node) &
-                                                     (feature_data["Tree"]==tree_id)]["Threshold"].values[0]), 0, 1)
-    #add a row to represent the values above the largest threshold
-    temp = [max(code_table["Threshold"])+1]
-    temp.extend(list([1]*(len(code_table.columns)-1)))
-    code_table.loc[len(code_table)] = temp
-    code_table = code_table.drop_duplicates(subset=['Threshold'])
-    code_table = code_table.reset_index(drop=True)
-    return code_table
-
-## get feature tables with ranges and codes only
-def get_feature_codes_with_ranges(feature_table, num_of_trees):
-    Codes = pd.DataFrame()
-    for tree_id in range(num_of_trees):
-        colname = "code"+str(tree_id)
-        Codes[colname] = feature_table[feature_table[[col for col in feature_table.columns if ('s'+str(tree_id)+'_') in col]].columns[0:]].apply(lambda x: ''.join(x.dropna().astype(str)),axis=1)
-        Codes[colname] = ["0b" + x for x in Codes[colname]]
-    feature_table["Range"] = [0]*len(feature_table)
-    feature_table["Range"].loc[0] = "0,"+str(feature_table["Threshold"].loc[0])
-    for i in range(1, len(feature_table)):
-        if (i==(len(feature_table))-1):
-            feature_table["Range"].loc[i] = str(feature_table["Threshold"].loc[i])+","+str(feature_table["Threshold"].loc[i])
-        else:
-            feature_table["Range"].loc[i] = str(feature_table["Threshold"].loc[i-1]+1) + ","+str(feature_table["Threshold"].loc[i])
-    Ranges = feature_table["Range"]
-    return Ranges, Codes
-
-## get list of splits crossed to get to leaves
-def retrieve_branches(estimator):
-    number_nodes = estimator.tree_.node_count
-    children_left_list = estimator.tree_.children_left
-    children_right_list = estimator.tree_.children_right
-    feature = estimator.tree_.feature
-    threshold = estimator.tree_.threshold
-    # Calculate if a node is a leaf
-    is_leaves_list = [(False if cl != cr else True) for cl, cr in zip(children_left_list, children_right_list)]
-    # Store the branches paths
-    paths = []
-    for i in range(number_nodes):
-        if is_leaves_list[i]:
-            # Search leaf node in previous paths
-            end_node = [path[-1] for path in paths]
-            # If it is a leave node yield the path
-            if i in end_node:
-                output = paths.pop(np.argwhere(i == np.array(end_node))[0][0])
-                yield output
-        else:
-            # Origin and end nodes
-            origin, end_l, end_r = i, children_left_list[i], children_right_list[i]
-            # Iterate over previous paths to add nodes
-            for index, path in enumerate(paths):
-                if origin == path[-1]:
-                    paths[index] = path + [end_l]
-                    paths.append(path + [end_r])
-            # Initialize path in first iteration
-            if i == 0:
-                paths.append([i, children_left_list[i]])
-                paths.append([i, children_right_list[i]])
-
-## get classes and certainties
-def get_classes(clf):
-    leaves = []
-    classes = []
-    certainties = []
-    for branch in list(retrieve_branches(clf)):
-        leaves.append(branch[-1])
-    for leaf in leaves:
-        if clf.tree_.n_outputs == 1:
-            value = clf.tree_.value[leaf][0]
-        else:
-            value = clf.tree_.value[leaf].T[0]
-        class_name = np.argmax(value)
-        certainty = int(round(max(value)/sum(value),2)*100)
-        classes.append(class_name)
-        certainties.append(certainty)
-    return classes, certainties
-
-## get the codes corresponging to the branches followed
-def get_leaf_paths(clf):
-    depth = clf.max_depth
-    branch_codes = []
-    for branch in list(retrieve_branches(clf)):
-        code = [0]*len(branch)
-        for i in range(1, len(branch)):
-            if (branch[i]==clf.tree_.children_left[branch[i-1]]):
-                code[i] = 0
-            elif (branch[i]==clf.tree_.children_right[branch[i-1]]):
-                code[i] = 1
-        branch_codes.append(list(code[1:]))
-    return branch_codes
-
-## get the order of the splits to enable code generation
-def get_order_of_splits(data, feature_names):
-    splits_order = []
-    for feature_name in feature_names:
-        feature_data = data[data.iloc[:,4]==feature_name]
-        feature_data = feature_data.sort_values(by="Threshold")
-        for node in list(feature_data.iloc[:,0]):
-            splits_order.append(node)
-    return splits_order
-
-def get_splits_per_tree(clf, feature_names):
-    data = []
-    n_nodes = clf.tree_.node_count
-    #set feature names
-    features  = [feature_names[i] for i in clf.tree_.feature]
-    #generate dataframe with all thresholds and features
-    for i in range(0,n_nodes):
-        node_id = i
-        left_child_id = clf.tree_.children_left[i]
-        right_child_id = clf.tree_.children_right[i]
-        threshold = clf.tree_.threshold[i]
-        feature = features[i]
-        if threshold != -2.0:
-            data.append([node_id, left_child_id,
-                         right_child_id, threshold, feature])
-    data = pd.DataFrame(data)
-    data.columns = ["NodeID","LeftID","RightID","Threshold","Feature"]
-    return data
-
-## Get codes and masks
-def get_codes_and_masks(clf, feature_names):
-    splits = get_order_of_splits(get_splits_per_tree(clf, feature_names), feature_names)
-    depth = clf.max_depth
-    codes = []
-    masks = []
-    for branch, coded in zip(list(retrieve_branches(clf)), get_leaf_paths(clf)):
-        code = [0]*len(splits)
-        mask = [0]*len(splits)
-        for index, split in enumerate(splits):
-            if split in branch:
-                mask[index] = 1
-        masks.append(mask)
-        codes.append(code)
-    masks = pd.DataFrame(masks)
-    masks['Mask'] = masks[masks.columns[0:]].apply(lambda x: ''.join(x.dropna().astype(str)),axis=1)
-    masks = ["0b" + x for x in masks['Mask']]
-    indices = range(0,len(splits))
-    temp = pd.DataFrame(columns=["split", "index"],dtype=object)
-    temp["split"] = splits
-    temp["index"] = indices
-    final_codes = []
-    for branch, code, coded in zip(list(retrieve_branches(clf)), codes, get_leaf_paths(clf)):
-        indices_to_use = temp[temp["split"].isin(branch)].sort_values(by="split")["index"]
-        for i, j in zip(range(0,len(coded)), list(indices_to_use)):
-            code[j] = coded[i]
-        final_codes.append(code)
-    final_codes = pd.DataFrame(final_codes)
-    final_codes["Code"] = final_codes[final_codes.columns[0:]].apply(lambda x: ''.join(x.dropna().astype(str)),axis=1)
-    final_codes = ["0b" + x for x in final_codes["Code"]]
-    return final_codes, masks
-## End of model manipulation ##
-
-def extractKBits(num):
-    # convert number into binary first
-    binary = bin(int(num))
-    # remove first two characters
-    binary = binary[2:].zfill(30)
-    #extract required bits
-    num_bin = str("0b") + binary[0:20]
-    num_dec = int(num_bin,2)
-    return num_dec
+num_of_trees = len(clf.estimators_)
+num_of_classes = len(clf.classes_)
+
+## P4 program the entries are generated for (used to check the table sizes)
+P4_FILE = '../../P4/Full_version/unibs_flowrest.p4'
+## feature tables compiled to minimized ternary entries instead of ranges
+## (the feature table keys of the P4 program must then be ternary)
+FEATURE_TABLE_TERNARY = False
+## ternary voting table (False: one exact entry per combination of classes); the
+## match type of the voting table keys is written to the P4 includes (VOTING_MATCH)
+VOTING_TABLE_TERNARY = True
+## compact entries artifact for install_table_entries.py (None: only the bfrt_python script)
+BINARY_ENTRIES_FILE = "NAME_OF_TABLE_ENTRIES_FILE.npz"
+## directory of the P4 includes with the codeword widths and the SetCode actions
+## generated for the model (None: keep the includes of the P4 program)
+P4_INCLUDE_DIR = '../../P4/Full_version/include'
+## rows classified by the software emulation of the entries before the export (0: no check),
+## from a csv file with one column per feature or sampled over the ranges of the feature tables;
+## about 4 s per 1M rows on 3 trees of depth 14, the time grows with the trees and their leaves
+EMULATION_ROWS = 1000000
+EMULATION_FEATURES_FILE = None
+## rows that may differ from clf.predict (None: only the trees and their vote must match)
+MAX_PREDICT_DISAGREEMENT = None
+## cache of the compiled trees and feature tables, only the parts of the model
+## that changed since the last run are compiled (None: compile everything)
+COMPILE_CACHE_DIR = '.compile_cache'
+## bit-width quantization of the features chosen by feature_quantization.py,
+## saved with save_quantization (None: the thresholds of the model as they are)
+QUANTIZATION_FILE = None
+## merge the leaves and ranges that lead to the same class, drop the unreachable
+## ones and narrow the codewords to the splits still needed (lossless)
+MINIMIZE_ENTRIES = True
+## flow ids of the flows sent to the inference (flow_action_table)
+FLOW_IDS_FILE = "./unibs2009_test_pkt_counts.csv"
+## flow_action_table entries also written in the bfrt_python script (False: only
+## in the entries artifact, for traces of millions of flows)
+FLOW_ENTRIES_IN_SCRIPT = True
+## early-exit phases chosen with early_exit.py and saved with save_early_exit:
+## the model and certainty threshold of the flows classified at packet 1 or 2
+## (None: every flow is classified at the 3rd packet)
+EARLY_EXIT_FILE = None
+table_entry_counts = {}
+artifact_tables = []
+
+compile_cache = open_compile_cache(COMPILE_CACHE_DIR) if COMPILE_CACHE_DIR else None
+table_sizes = get_p4_table_sizes(P4_FILE) if os.path.exists(P4_FILE) else {}
+table_keys = get_p4_table_keys(P4_FILE) if os.path.exists(P4_FILE) else {}
+## width of the field matched by each feature table (16 bits if unknown)
+feature_widths = [table_keys.get("table_feature"+str(fea), [(None, None, 16)])[0][2] for fea in range(len(feature_names))]
+
+## thresholds of the quantized features moved on the blocks of their field
+## (the model of search_quantization already has them there)
+quantization = load_quantization(QUANTIZATION_FILE) if QUANTIZATION_FILE else None
+if quantization:
+    clf = quantize_forest(clf, feature_names, quantization)
 
 # Get table entries and generate file with table entries
 with open("NAME_OF_TABLE_ENTRIES_FILE.py", "w") as entries_file:
@@ -268,80 +136,165 @@ for qsfp_cage in [1, 5, 9]:
             print("table_feature"+str(num_feat)+" = p4.Ingress.table_feature"+str(num_feat), file=entries_file)
     print('', file=entries_file)
 
-    for num_tree in range(len(clf.estimators_)):
+    for num_tree in range(num_of_trees):
         print("code_table"+str(num_tree)+" = p4.Ingress.code_table"+str(num_tree), file=entries_file)
     print('', file=entries_file)
 
     # Get entries for feature tables
-    tree_code0 = []
-    tree_code1 = []
-    tree_code2 = []
+    tree_code_sizes = [[] for tree_id in range(num_of_trees)]
 
+    # walk the forest once for all the feature tables
+    feature_tables = compile_feature_tables_cached(compile_cache, clf, feature_names)
+    # the trees are compiled in parallel and merged in tree order
+    forest_leaves = compile_trees_cached(compile_cache, clf, feature_names)
+    compiled_feature_tables = feature_tables
+    if MINIMIZE_ENTRIES:
+        feature_tables, forest_leaves, minimization = minimize_entries(feature_tables, forest_leaves, feature_widths)
+    # slices of the codewords written by every feature table
+    layout = get_codeword_layout(feature_tables, num_of_trees)
+    tcam_footprints = {}
     for fea in range(0,len(feature_names)):
-        Ranges, Codes = get_feature_codes_with_ranges(get_feature_table(get_splits(clf, feature_names), feature_names[fea]), len(clf.estimators_))
-        for ran, cods0, cods1, cods2 in zip(Ranges, Codes.iloc[:,0], Codes.iloc[:,1], Codes.iloc[:,2]):
+        tcam_footprints["table_feature"+str(fea)] = get_tcam_footprint_cached(compile_cache, feature_tables[fea],
+                                                                              num_of_trees, feature_widths[fea])
+        code_trees = get_feature_code_trees(layout, fea)
+        if FEATURE_TABLE_TERNARY:
+            ternary_entries = get_feature_ternary_entries_cached(compile_cache, feature_tables[fea], num_of_trees,
+                                                                 feature_widths[fea])
+            code_widths = layout["code_widths"][fea]
+            for value, mask, priority, cods in ternary_entries:
+                codes = "".join(", code"+str(tree_id)+"="+format_bits(cods[tree_id], code_widths[tree_id]) for tree_id in code_trees)
+                print("table_feature"+str(fea)+".add_with_SetCode"+str(fea)+"(feature"+str(fea)+"="+str(value)+ \
+                ", feature"+str(fea)+"_mask="+str(mask)+", model_version=0, model_version_mask=0, MATCH_PRIORITY="+str(priority)+ \
+                codes+")", file = entries_file)
+            for tree_id in range(num_of_trees):
+                tree_code_sizes[tree_id].append(code_widths[tree_id])
+            table_entry_counts["table_feature"+str(fea)] = len(ternary_entries)
+            artifact_tables.append(get_feature_table_ternary_entries(fea, ternary_entries, num_of_trees, code_trees))
+            print('', file=entries_file)
+            continue
+
+        Ranges, Codes = get_feature_codes_with_ranges(feature_tables[fea], num_of_trees)
+        for ran, cods in zip(Ranges, Codes.values.tolist()):
+            codes = "".join(", code"+str(tree_id)+"="+str(cods[tree_id]) for tree_id in code_trees)
             if(ran == Ranges[len(Ranges)-1]):
                 print("table_feature"+str(fea)+".add_with_SetCode"+str(fea)+"(feature"+str(fea)+"_start="+str(ran.split(",")[0])+ \
-                ", feature"+str(fea)+"_end="+str(65535)+", code0="+str(cods0) + ", code1=" + str(cods1) +\
-                ", code2="+str(cods2) + ")", file = entries_file)
+                ", feature"+str(fea)+"_end="+str(65535)+", model_version=0, model_version_mask=0"+codes+")", file = entries_file)
             else:
                 print("table_feature"+str(fea)+".add_with_SetCode"+str(fea)+"(feature"+str(fea)+"_start="+str(ran.split(",")[0])+ \
-                ", feature"+str(fea)+"_end="+str(ran.split(",")[1])+", code0="+str(cods0)+", code1="+str(cods1) +", code2="+str(cods2)+
-                ")", file = entries_file)
+                ", feature"+str(fea)+"_end="+str(ran.split(",")[1])+", model_version=0, model_version_mask=0"+codes+")", file = entries_file)
 
-        tree_code0.append(len(cods0)-2)
-        tree_code1.append(len(cods1)-2)
-        tree_code2.append(len(cods2)-2)
+        for tree_id in range(num_of_trees):
+            tree_code_sizes[tree_id].append(feature_tables[fea]["Bits"][tree_id].shape[1])
+        table_entry_counts["table_feature"+str(fea)] = len(Ranges)
+        artifact_tables.append(get_feature_table_entries(fea, feature_tables[fea], num_of_trees))
         print('', file=entries_file)
-    tree_code_sizes = [tree_code0, tree_code1, tree_code2]
     print(tree_code_sizes)
 
     print('print("******************* ENTERED FEATURE TABLE RULES *****************")\n',  file=entries_file)
 
-    for tree_id in range(0, len(clf.estimators_)):
-        Final_Codes, Final_Masks = get_codes_and_masks(clf.estimators_[tree_id], feature_names)
-        Classe, Certain = get_classes(clf.estimators_[tree_id])
-        for cod, mas, cla, cer in zip(Final_Codes, Final_Masks, Classe, Certain):
-            print("code_table"+str(tree_id)+".add_with_SetClass"+str(tree_id)+"(codeword"+str(tree_id)+"=", cod, ", codeword"+\
-            str(tree_id)+"_mask=", mas, ", classe=",cla+1, ", cert=", cer, ")", file=entries_file)
+    for tree_id, leaves in enumerate(forest_leaves):
+        width = layout["codeword_widths"][tree_id]
+        table_entry_counts["code_table"+str(tree_id)] = len(leaves)
+        artifact_tables.append(get_code_table_entries(tree_id, leaves))
+        for cod, mas, cla, cer in zip(leaves["Code"], leaves["Mask"], leaves["Class"], leaves["Certainty"]):
+            print("code_table"+str(tree_id)+".add_with_SetClass"+str(tree_id)+"(codeword"+str(tree_id)+"=", format_bits(cod, width), ", codeword"+\
+            str(tree_id)+"_mask=", format_bits(mas, width), ", model_version=0, model_version_mask=0, classe=",cla+1, ", cert=", cer, ")", file=entries_file)
         print('', file=entries_file)
 
   # Get voting table entries
-    for i in range(1,9):
-        for j in range(1,9):
-            for k in range(1,9):
-                if ((i!=j) & (j!=k) & (i!=k)):
-                    print("voting_table.add_with_set_final_class("+"class0="+str(i)+ \
-                          ", class1="+str(j)+", class2="+str(k)+", class_result="+str(np.random.choice([i, j, k]))+")", file=entries_file)
-                    # pass
-                else:
-                    print("voting_table.add_with_set_final_class("+"class0="+str(i)+", class1="+str(j)+\
-                          ", class2="+str(k)+", class_result="+str(mode([i, j, k]))+")", file=entries_file)
+    voting_entries = get_voting_entries(num_of_trees, num_of_classes, ternary=VOTING_TABLE_TERNARY)
+    if not VOTING_TABLE_TERNARY:
+        # exact entries break the ties at random, generate them once for both outputs
+        voting_entries = list(voting_entries)
+    table_entry_counts["voting_table"] = write_voting_entries(entries_file, voting_entries, ternary=VOTING_TABLE_TERNARY)
+    if VOTING_TABLE_TERNARY:
+        voting_entries = get_voting_entries(num_of_trees, num_of_classes, ternary=True)
+    artifact_tables.append(get_voting_table_entries(voting_entries, num_of_trees, ternary=VOTING_TABLE_TERNARY))
     print(" ", file=entries_file)
+
+    # Entries of the early-exit phases: their own feature, code and voting tables,
+    # with only the confident leaves and the votes of a majority of the trees
+    early_phases = []
+    if EARLY_EXIT_FILE:
+        early_phases = get_early_exit_phases(compile_cache, EARLY_EXIT_FILE, clf, feature_widths, MINIMIZE_ENTRIES,
+                                             FEATURE_TABLE_TERNARY, quantization)
+    for phase in early_phases:
+        for table in phase["tables"]:
+            entries_file.write(get_table_script_lines(table))
+            table_entry_counts[table["table"].split(".")[-1]] = get_num_of_entries(table)
+            artifact_tables.append(table)
+        print('', file=entries_file)
     
     
     # Get 'Inference Forwarding block' table entries
     # Read csv file to get flow 5 tuple ids (src_addr, hdr.ipv4.dst_addr, meta.hdr_srcport, meta.hdr_dstport, hdr.ipv4.protocol, action)
     # Forwarding: 0 Inference: 1
-    flow_id_info = pd.read_csv("./unibs2009_test_pkt_counts.csv")
-    flow_id_info = flow_id_info.drop_duplicates()
-    for index, flow in flow_id_info.iterrows():
-        flow_id = flow['flow.id']
-        id_values = flow_id.split(" ")
-        # With all tuple elements
-        try:
-            print("flow_action_table.add_with_set_flow_action("+"src_addr="+str(int(ipaddress.ip_address(id_values[0])))+ \
-                        ", dst_addr="+str(int(ipaddress.ip_address(id_values[1])))+ \
-                        ", hdr_srcport="+str(id_values[2])+ \
-                        ", hdr_dstport="+str(id_values[3])+ \
-                        ", protocol="+str(id_values[4])+ \
-                        ", f_action="+str(1)+")", file=entries_file)
-        except:
-            continue
+    # (read in chunks, the flows written as they come and the rejected rows reported)
+    flow_keys, flow_stats = write_flow_action_entries(FLOW_IDS_FILE, entries_file if FLOW_ENTRIES_IN_SCRIPT else None,
+                                                      keep_keys=bool(BINARY_ENTRIES_FILE))
+    table_entry_counts["flow_action_table"] = flow_stats["flows"]
+    if BINARY_ENTRIES_FILE:
+        artifact_tables.append(get_flow_action_artifact_table(flow_keys))
 
     print("bfrt.complete_operations()", file=entries_file)
 
     # Final programming
     print('\nprint("******************* SAMPLE PROGAMMING RESULTS *****************")', file=entries_file)
 
+close_compile_cache(compile_cache)
+
+# Classify with the emulated pipeline and stop the export if the entries do not reproduce the model
+if EMULATION_ROWS:
+    if EMULATION_FEATURES_FILE:
+        emulation_features = pd.read_csv(EMULATION_FEATURES_FILE)[list(feature_names)].values[:EMULATION_ROWS]
+    else:
+        # sampled over the ranges of the model, also the ones merged by the minimization
+        emulation_features = get_emulation_samples(compiled_feature_tables, feature_widths, EMULATION_ROWS)
+    emulation_report = check_entries(clf, artifact_tables, feature_tables, feature_widths, emulation_features)
+    exact = is_exact(emulation_report, MAX_PREDICT_DISAGREEMENT)
+    for phase in early_phases:
+        # the phases are sampled over their own ranges
+        if not EMULATION_FEATURES_FILE:
+            emulation_features = get_emulation_samples(phase["compiled_feature_tables"], feature_widths, EMULATION_ROWS)
+        exact = check_phase(phase, feature_widths, emulation_features) == 0 and exact
+    if not exact:
+        os.remove("NAME_OF_TABLE_ENTRIES_FILE.py")
+        sys.exit("** THE TABLE ENTRIES DO NOT REPRODUCE THE MODEL, NOTHING EXPORTED **")
+
+if BINARY_ENTRIES_FILE:
+    save_entries(BINARY_ENTRIES_FILE, artifact_tables)
+
+# the P4 program must be compiled with the includes generated with the entries
+# (the codewords are shared with the early-exit phases, which are always written
+# so that the tables of a previous model do not stay in the program)
+shared_layout = get_shared_layout(layout, early_phases)
+if P4_INCLUDE_DIR and os.path.isdir(P4_INCLUDE_DIR):
+    write_p4_includes(shared_layout, P4_INCLUDE_DIR, VOTING_TABLE_TERNARY)
+    table_sizes.update(write_early_exit_includes(early_phases, shared_layout, P4_INCLUDE_DIR, table_keys, table_sizes))
+    print("** P4 CODEWORD LAYOUT STORED IN "+P4_INCLUDE_DIR+" **")
+elif os.path.exists(P4_FILE) and get_p4_macro("VOTING_MATCH", get_p4_source(P4_FILE)) != \
+        ("ternary" if VOTING_TABLE_TERNARY else "exact"):
+    print("** THE VOTING TABLE KEYS OF "+P4_FILE+" DO NOT MATCH VOTING_TABLE_TERNARY **")
+
 print("** TABLE ENTRIES GENERATED AND STORED IN DESIGNATED FILE **")
+
+# Compare the number of entries with the sizes of the tables in the P4 program
+for table_name, num_of_entries in table_entry_counts.items():
+    report_table_usage(table_name, num_of_entries, table_sizes)
+
+
+# Flows of flow_action_table and rows of the flow ids that are not a 5-tuple
+report_flow_action_entries(flow_stats)
+
+# Entries removed by the minimization
+if MINIMIZE_ENTRIES:
+    report_minimization(minimization)
+
+# TCAM entries used by the feature tables with range and ternary match
+report_tcam_footprint(tcam_footprints, table_sizes)
+
+# Codeword widths, PHV and action data used by the model
+report_resources(shared_layout, table_entry_counts, table_sizes)
+
+# Thresholds and entries of the early-exit phases
+report_early_exit(early_phases)
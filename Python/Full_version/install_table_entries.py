@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+## Install the table entries of a compiled artifact (.npz, see entries_artifact.py)
+## on the switch with batched bfrt_grpc entry_add calls.
+## usage: python3 install_table_entries.py ENTRIES_FILE.npz [GRPC_ADDR] [BATCH_SIZE] [--pipes 0,1,2,3]
+##        the tables are symmetric (written in all the pipes at once); with
+##        --pipes, right after loading the program, flow_action_table and the
+##        registers are made asymmetric (see bfrt_session.set_single_pipe_scope)
+##        and the flows are installed in every pipe given, for the sharded
+##        control plane writing the pipes one by one (control_plane_sharded.py)
+## The installer runs without a switch against the fake BF Runtime client of
+## fake_switch.py, which rejects duplicate adds as the switch does
+## (python3 -m pytest test_install_table_entries.py).
+import sys
+import time
+from entries_artifact import load_entries, from_column, get_key_columns, get_num_of_entries
+from bfrt_session import connect, set_single_pipe_scope, get_table_targets, pop_pipes_option
+
+GRPC_ADDR = '_CONTROL_SERVER_IP:PORT'
+## entries sent in each entry_add call
+BATCH_SIZE = 4096
+
+## build the keys of every entry of a table of the artifact
+def make_keys(bfrt_client, tbl, table):
+    columns = {name: from_column(table["columns"][name]) for field, match_type in table["keys"]
+               for name in get_key_columns(field, match_type)}
+    keys = []
+    for index in range(get_num_of_entries(table)):
+        key_tuples = []
+        for field, match_type in table["keys"]:
+            if match_type == "range":
+                key_tuples.append(bfrt_client.KeyTuple(field, low=columns[field+"_start"][index],
+                                                       high=columns[field+"_end"][index]))
+            elif match_type == "ternary":
+                key_tuples.append(bfrt_client.KeyTuple(field, columns[field][index], columns[field+"_mask"][index]))
+            else:
+                key_tuples.append(bfrt_client.KeyTuple(field, columns[field][index]))
+        keys.append(tbl.make_key(key_tuples))
+    return keys
+
+## build the action data of every entry of a table of the artifact
+def make_datas(bfrt_client, tbl, table):
+    columns = {name: from_column(table["columns"][name]) for name in table["data"]}
+    return [tbl.make_data([bfrt_client.DataTuple(name, columns[name][index]) for name in table["data"]],
+                          table["action"]) for index in range(get_num_of_entries(table))]
+
+## push the entries of one table in batches, in every pipe of the table (see
+## bfrt_session.get_table_targets), returns the number of entries installed
+def install_table(bfrt_client, bfrt_info, target, table, batch_size=BATCH_SIZE, clear=True, pipes=None):
+    tbl = bfrt_info.table_get(table["table"])
+    keys = make_keys(bfrt_client, tbl, table)
+    datas = make_datas(bfrt_client, tbl, table)
+    for table_target in get_table_targets(bfrt_client, table["table"], pipes, target.device_id) if pipes else [target]:
+        if clear:
+            # without keys all the entries of the table are deleted
+            tbl.entry_del(table_target)
+        for start in range(0, len(keys), batch_size):
+            tbl.entry_add(table_target, keys[start:start+batch_size], datas[start:start+batch_size],
+                          p4_name=bfrt_info.p4_name_get())
+    return len(keys)
+
+## install all the tables of the artifact and report the entries per second
+def install_entries(bfrt_client, bfrt_info, target, tables, batch_size=BATCH_SIZE, clear=True, pipes=None):
+    total_entries = 0
+    total_start = time.time()
+    for table in tables:
+        start = time.time()
+        num_of_entries = install_table(bfrt_client, bfrt_info, target, table, batch_size, clear, pipes)
+        elapsed = max(time.time() - start, 1e-9)
+        total_entries += num_of_entries
+        print("{:<32} {:>8} entries in {:>8.3f} s ({:>10.0f} entries/s)".format(
+            table["table"], num_of_entries, elapsed, num_of_entries/elapsed))
+    elapsed = max(time.time() - total_start, 1e-9)
+    print("{:<32} {:>8} entries in {:>8.3f} s ({:>10.0f} entries/s)".format(
+        "TOTAL", total_entries, elapsed, total_entries/elapsed))
+    return total_entries, elapsed
+
+if __name__ == "__main__":
+    args, pipes = pop_pipes_option(sys.argv[1:])
+    entries_path = args[0]
+    grpc_addr = args[1] if len(args) > 1 else GRPC_ADDR
+    batch_size = int(args[2]) if len(args) > 2 else BATCH_SIZE
+
+    bfrt_client, interface, bfrt_info = connect(grpc_addr)
+    print('The target runs the program ', bfrt_info.p4_name_get())
+    if pipes:
+        set_single_pipe_scope(bfrt_client, bfrt_info)
+    # Target pipe_id=0xffff, the asymmetric tables are written pipe by pipe
+    target = bfrt_client.Target(device_id=0, pipe_id=0xffff)
+    install_entries(bfrt_client, bfrt_info, target, load_entries(entries_path), batch_size, pipes=pipes)
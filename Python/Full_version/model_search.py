@@ -0,0 +1,168 @@
+## Search of the RF models that fit in the tables of the P4 program.
+## analyze_models in Unibs_flowrest_analysis.ipynb fits every combination of
+## depth, trees and features one after another, and only then the entries of a
+## model can be checked against the switch. Here the table entry compiler is the
+## cost model of the search:
+##  - configurations that cannot fit are discarded before any training: more
+##    features than feature tables, more trees than code tables, or more voting
+##    entries (known from the trees and classes alone) than the voting table,
+##  - every other configuration is fitted in a worker process, compiled to its
+##    table entries (minimized as the generator installs them) and scored only
+##    if the entries fit the table sizes,
+##  - the configurations are run from the smallest to the largest; when one does
+##    not fit, the ones that are at least as large in every dimension (depth,
+##    trees, max leaves, features with the same most important ones) would not
+##    fit either and are dropped without being fitted.
+## The search stops when no candidate left can fit.
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import product
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import classification_report
+from voting_compiler import count_voting_entries
+from table_usage import get_table_usage
+from feature_quantization import get_feature_widths
+from p4_tables import get_p4_table_sizes
+
+P4_FILE = '../../P4/Full_version/unibs_flowrest.p4'
+## candidates submitted ahead of the results, per worker, so that the ones
+## dropped by a result that does not fit are never fitted
+CANDIDATES_PER_WORKER = 2
+
+## configurations of the search: every depth, number of trees, maximum leaves
+## and feature set (lists of feature names, most important first)
+def get_candidates(depths, n_trees, max_leaves, feature_sets):
+    candidates = [{"depth": depth, "n_tree": n_tree, "max_leaf": max_leaf, "feats": list(feats)}
+                  for depth, n_tree, max_leaf, feats in product(depths, n_trees, max_leaves, feature_sets)]
+    # smallest models first, so that the failures prune the larger ones
+    return sorted(candidates, key=lambda candidate: (candidate["depth"], candidate["n_tree"],
+                                                     candidate["max_leaf"] or float("inf"), len(candidate["feats"])))
+
+## tables of the P4 program that a configuration cannot fit before training
+def get_static_overflows(candidate, num_of_classes, table_sizes, ternary_voting=True):
+    overflows = []
+    if "table_feature"+str(len(candidate["feats"])-1) not in table_sizes:
+        overflows.append("table_feature"+str(len(candidate["feats"])-1))
+    if "code_table"+str(candidate["n_tree"]-1) not in table_sizes:
+        overflows.append("code_table"+str(candidate["n_tree"]-1))
+    if count_voting_entries(candidate["n_tree"], num_of_classes, ternary_voting) > table_sizes.get("voting_table", float("inf")):
+        overflows.append("voting_table")
+    return overflows
+
+## tables whose entries exceed their size (or that the P4 program does not declare)
+def get_overflows(usage, table_sizes):
+    return [table_name for table_name, entries in usage.items() if entries > table_sizes.get(table_name, -1)]
+
+## True when a configuration is at least as large as another one in every dimension
+def is_larger(candidate, other):
+    return candidate["depth"] >= other["depth"] and candidate["n_tree"] >= other["n_tree"] and \
+        (candidate["max_leaf"] or float("inf")) >= (other["max_leaf"] or float("inf")) and \
+        candidate["feats"][:len(other["feats"])] == other["feats"]
+
+## the training and test data and the options are shared with the forked workers
+## instead of being sent with every candidate
+SEARCH_DATA = None
+
+## fit, compile and score one configuration
+def evaluate_candidate(candidate):
+    data = SEARCH_DATA
+    start = time.time()
+    model = RandomForestClassifier(max_depth=candidate["depth"], n_estimators=candidate["n_tree"],
+                                   max_leaf_nodes=candidate["max_leaf"], random_state=42, bootstrap=False)
+    model.fit(data["X_train"][candidate["feats"]], data["y_train"])
+    usage = get_table_usage(model, candidate["feats"], data["feature_widths"][:len(candidate["feats"])],
+                            data["minimize"], data["ternary_features"], data["ternary_voting"])
+    result = dict(candidate, usage=usage, overflows=get_overflows(usage, data["table_sizes"]), macro=None,
+                  weighted=None, model=None)
+    if not result["overflows"]:
+        y_pred = model.predict(data["X_test"][candidate["feats"]])
+        class_report = classification_report(data["y_test"], y_pred, target_names=data["classes"], output_dict=True)
+        result["macro"] = class_report['macro avg']['f1-score']
+        result["weighted"] = class_report['weighted avg']['f1-score']
+        result["model"] = model if data["keep_models"] else None
+    result["seconds"] = time.time() - start
+    return result
+
+## search the configurations that fit in the P4 tables, in parallel; returns
+## the results sorted by score, with the ones that do not fit at the end
+def search_models(classes, depths, n_trees, max_leaves, feature_sets, X_train, y_train, X_test, y_test,
+                  p4_file=P4_FILE, ternary_features=False, ternary_voting=True, minimize=True, max_workers=None,
+                  keep_models=False, outfile=None):
+    global SEARCH_DATA
+    table_sizes = get_p4_table_sizes(p4_file)
+    # the features of a candidate are matched by the first feature tables
+    feature_widths = get_feature_widths(max(len(feats) for feats in feature_sets), p4_file)
+    SEARCH_DATA = {"X_train": X_train, "y_train": y_train, "X_test": X_test, "y_test": y_test, "classes": classes,
+                   "table_sizes": table_sizes, "feature_widths": feature_widths, "ternary_features": ternary_features,
+                   "ternary_voting": ternary_voting, "minimize": minimize, "keep_models": keep_models}
+    start = time.time()
+    results = []
+    failed = []
+    pending = []
+    for candidate in get_candidates(depths, n_trees, max_leaves, feature_sets):
+        overflows = get_static_overflows(candidate, len(classes), table_sizes, ternary_voting)
+        if overflows:
+            results.append(dict(candidate, overflows=overflows, pruned="static"))
+        else:
+            pending.append(candidate)
+    num_of_candidates = len(pending) + len(results)
+
+    # a candidate larger than one that does not fit is dropped
+    def next_candidate():
+        while pending:
+            candidate = pending.pop(0)
+            blocker = next((other for other in failed if is_larger(candidate, other)), None)
+            if blocker is None:
+                return candidate
+            results.append(dict(candidate, overflows=blocker["overflows"], pruned="dominated"))
+        return None
+
+    def add_result(result):
+        results.append(result)
+        if result["overflows"]:
+            failed.append(result)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        candidate = next_candidate()
+        while candidate is not None:
+            add_result(evaluate_candidate(candidate))
+            candidate = next_candidate()
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+            running = set()
+            while True:
+                while len(running) < max_workers * CANDIDATES_PER_WORKER:
+                    candidate = next_candidate()
+                    if candidate is None:
+                        break
+                    running.add(executor.submit(evaluate_candidate, candidate))
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    add_result(future.result())
+    SEARCH_DATA = None
+    table = get_search_table(results)
+    print("{} configurations in {:.1f} s: {} fitted, {} fit the tables, {} pruned before training".format(
+        num_of_candidates, time.time() - start, int(table["fitted"].sum()), int(table["fits"].sum()),
+        int((~table["fitted"]).sum())))
+    if outfile:
+        table.drop(columns=["model"]).to_csv(outfile, sep=";", index=False)
+    return table
+
+## results of the search as a table sorted by score, like the output of analyze_models
+def get_search_table(results):
+    rows = []
+    for result in results:
+        rows.append({"depth": result["depth"], "tree": result["n_tree"], "max_leaf": result["max_leaf"],
+                     "n_feat": len(result["feats"]), "macro": result.get("macro"), "weighted": result.get("weighted"),
+                     "feats": result["feats"], "fits": not result["overflows"], "overflows": result["overflows"],
+                     "fitted": "usage" in result, "usage": result.get("usage"), "seconds": result.get("seconds"),
+                     "model": result.get("model")})
+    table = pd.DataFrame(rows)
+    return table.sort_values(by=["fits", "macro", "weighted"], ascending=False, na_position="last").reset_index(drop=True)
@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+## Differential model update: compare the artifact installed on the switch with
+## the artifact of a retrained model and push only the entries that changed,
+## instead of clearing and reinstalling every table.
+## usage: python3 model_update.py INSTALLED.npz NEW.npz [GRPC_ADDR] [--dry-run] [--pipes 0,1,2,3]
+##        --pipes as given to install_table_entries.py: the asymmetric tables
+##        are updated in every pipe; once the update is applied, INSTALLED.npz
+##        is replaced by the entries left on the switch, for the next update
+##
+## The feature and code tables also match the generation of the model that the
+## packet reads from reg_model_version (meta.model_version, ternary). An entry
+## matches every generation (mask 0, as installed by install_table_entries.py)
+## or only one. The new model is installed under the generation that no packet
+## reads, then the packets switch to it at once, so no packet sees codewords
+## mixing old and new slices or a code table without the entries of its tree:
+##  1. the installed entries that the new model drops or changes are restricted
+##     to the live generation: a copy matching only that generation is added,
+##     then the entry matching every generation is deleted,
+##  2. the new and changed entries are added under the next generation; the
+##     entries kept by the new model go on matching every generation,
+##  3. reg_model_version is flipped to the next generation,
+##  4. the entries of the previous generation are deleted,
+##  5. the voting and flow action tables are updated last.
+## Under one generation the entries never overlap, except an entry and its copy
+## of step 1 which have the same action data, so the new ranges need no
+## $MATCH_PRIORITY to win over the old ones. The tables need room for both
+## generations of the entries that change.
+import sys
+import time
+from entries_artifact import load_entries, save_entries, make_table, to_column, from_column, get_key_columns, \
+    get_num_of_entries, select_entries, MODEL_VERSION_FIELD
+from install_table_entries import make_keys, make_datas, GRPC_ADDR, BATCH_SIZE
+from bfrt_session import get_table_targets, pop_pipes_option
+
+## register holding the generation of the model matched by the packets
+MODEL_VERSION_REGISTER = 'Ingress.reg_model_version'
+
+## key and data of every entry of a table as tuples of integers, without the
+## generation of the entries
+def get_entry_tuples(table):
+    key_columns = [from_column(table["columns"][name]) for field, match_type in table["keys"]
+                   if field != MODEL_VERSION_FIELD for name in get_key_columns(field, match_type)]
+    data_columns = [from_column(table["columns"][name]) for name in table["data"]]
+    return list(zip(*key_columns)), list(zip(*data_columns))
+
+## entries to add, modify and delete to go from the old to the new table
+def diff_table(old_table, new_table):
+    if old_table is None:
+        return {"add": new_table, "modify": select_entries(new_table, []), "delete": select_entries(new_table, [])}
+    if new_table is None:
+        return {"add": select_entries(old_table, []), "modify": select_entries(old_table, []), "delete": old_table}
+    old_keys, old_datas = get_entry_tuples(old_table)
+    new_keys, new_datas = get_entry_tuples(new_table)
+    old_index = dict(zip(old_keys, old_datas))
+    new_index = set(new_keys)
+    to_add = [index for index, key in enumerate(new_keys) if key not in old_index]
+    to_modify = [index for index, (key, data) in enumerate(zip(new_keys, new_datas))
+                 if key in old_index and old_index[key] != data]
+    to_delete = [index for index, key in enumerate(old_keys) if key not in new_index]
+    return {"add": select_entries(new_table, to_add), "modify": select_entries(new_table, to_modify),
+            "delete": select_entries(old_table, to_delete)}
+
+## stage of a table in the update order
+def get_table_stage(table_name):
+    for stage, prefix in enumerate(["Ingress.table_feature", "Ingress.code_table", "Ingress.voting_table"]):
+        if table_name.startswith(prefix):
+            return stage
+    return 3
+
+## the tables whose entries match a generation of the model (feature and code tables)
+def is_versioned(table):
+    return MODEL_VERSION_FIELD in dict(table["keys"])
+
+## (value, mask) of the generation of every entry of a versioned table
+def get_entry_versions(table):
+    return list(zip(from_column(table["columns"][MODEL_VERSION_FIELD]),
+                    from_column(table["columns"][MODEL_VERSION_FIELD+"_mask"])))
+
+## the entries of a table at the given indices, matching only the given generation
+def select_version_entries(table, indices, version):
+    table = select_entries(table, indices)
+    num_of_entries = get_num_of_entries(table)
+    columns = dict(table["columns"])
+    columns[MODEL_VERSION_FIELD] = to_column([version] * num_of_entries)
+    columns[MODEL_VERSION_FIELD+"_mask"] = to_column([1] * num_of_entries)
+    return dict(table, columns=columns)
+
+## the entries of two tables with the same fields in one table
+def concat_entries(table, other):
+    columns = {name: from_column(column) + from_column(other["columns"][name]) for name, column in table["columns"].items()}
+    return make_table(table["table"], table["action"], table["keys"], table["data"], columns)
+
+## generation matched by the installed entries: the one of the entries restricted
+## to a generation, 0 (the register after loading the program) when every entry
+## matches every generation
+def get_installed_version(tables):
+    for table in tables:
+        if is_versioned(table):
+            for value, mask in get_entry_versions(table):
+                if mask:
+                    return value
+    return 0
+
+## the entry of reg_model_version selecting a generation
+def get_model_version_table(version):
+    return make_table(MODEL_VERSION_REGISTER, None, [("$REGISTER_INDEX", "exact")], [MODEL_VERSION_REGISTER+".f1"],
+                      {"$REGISTER_INDEX": [0], MODEL_VERSION_REGISTER+".f1": [version]})
+
+## entries of a versioned table to go from the old model, installed under the
+## live generation, to the new model under the next one: "restrict" (copies of
+## the old entries matching every generation that the new model drops or
+## changes), "unshare" (these old entries), "add", "retire" (the entries of the
+## live generation only) and "installed" (the entries left after the update)
+def diff_versioned_table(old_table, new_table, version):
+    if old_table is None:
+        old_table = select_entries(new_table, [])
+    if new_table is None:
+        new_table = select_entries(old_table, [])
+    if any(old_table[name] != new_table[name] for name in ("action", "keys", "data")):
+        raise ValueError(new_table["table"]+": the fields of the entries change, the new model needs a new P4 program")
+    old_versions = get_entry_versions(old_table)
+    old_entries = list(zip(*get_entry_tuples(old_table)))
+    new_entries = list(zip(*get_entry_tuples(new_table)))
+    if sorted(old_entries) == sorted(new_entries):
+        # the live generation already holds the new entries
+        empty = select_entries(old_table, [])
+        return {"restrict": empty, "unshare": empty, "add": empty, "retire": empty, "installed": old_table}
+    shared = {entry: index for index, (entry, (value, mask)) in enumerate(zip(old_entries, old_versions)) if not mask}
+    kept = [shared[entry] for entry in new_entries if entry in shared]
+    to_add = [index for index, entry in enumerate(new_entries) if entry not in shared]
+    to_restrict = sorted(set(shared.values()) - set(kept))
+    live_only = [index for index, (value, mask) in enumerate(old_versions) if mask]
+    restrict = select_version_entries(old_table, to_restrict, version)
+    add = select_version_entries(new_table, to_add, 1 - version)
+    return {"restrict": restrict, "unshare": select_entries(old_table, to_restrict), "add": add,
+            "retire": concat_entries(select_entries(old_table, live_only), restrict),
+            "installed": concat_entries(select_entries(old_table, kept), add)}
+
+## list of (operation, table) to apply, in the update order, and the tables
+## installed once they are applied
+def diff_entries(old_tables, new_tables):
+    old_by_name = {table["table"]: table for table in old_tables}
+    new_by_name = {table["table"]: table for table in new_tables}
+    names = list(new_by_name) + [name for name in old_by_name if name not in new_by_name]
+    versioned = [name for name in names if is_versioned(new_by_name.get(name) or old_by_name[name])]
+    other_tables = sorted([name for name in names if name not in versioned], key=get_table_stage)
+    version = get_installed_version(old_tables)
+    diffs = {name: diff_versioned_table(old_by_name.get(name), new_by_name.get(name), version) for name in versioned}
+    operations = []
+    for name in versioned:
+        operations += [("add", diffs[name]["restrict"]), ("delete", diffs[name]["unshare"])]
+    operations += [("add", diffs[name]["add"]) for name in versioned]
+    # the packets switch to the next generation only when it is complete
+    if any(get_num_of_entries(table) for name in versioned for table in diffs[name].values()
+           if table is not diffs[name]["installed"]):
+        operations.append(("modify", get_model_version_table(1 - version)))
+    operations += [("delete", diffs[name]["retire"]) for name in versioned]
+    installed = [diffs[name]["installed"] for name in versioned if name in new_by_name]
+    for name in other_tables:
+        diff = diff_table(old_by_name.get(name), new_by_name.get(name))
+        operations += [(operation, diff[operation]) for operation in ("delete", "modify", "add")]
+        installed += [new_by_name[name]] if name in new_by_name else []
+    return [(operation, table) for operation, table in operations if get_num_of_entries(table) > 0], installed
+
+## print the number of entries of every operation
+def print_operations(operations):
+    for operation, table in operations:
+        print("{:<8} {:<32} {:>8} entries".format(operation, table["table"], get_num_of_entries(table)))
+
+## apply the operations in batches, in every pipe of the asymmetric tables with
+## pipes (see bfrt_session.get_table_targets), returns the number of entries written
+def apply_operations(bfrt_client, bfrt_info, target, operations, batch_size=BATCH_SIZE, pipes=None):
+    total_entries = 0
+    start = time.time()
+    p4_name = bfrt_info.p4_name_get()
+    for operation, table in operations:
+        tbl = bfrt_info.table_get(table["table"])
+        keys = make_keys(bfrt_client, tbl, table)
+        datas = make_datas(bfrt_client, tbl, table) if operation != "delete" else None
+        for table_target in get_table_targets(bfrt_client, table["table"], pipes, target.device_id) if pipes else [target]:
+            for first in range(0, len(keys), batch_size):
+                batch_keys = keys[first:first+batch_size]
+                if operation == "delete":
+                    tbl.entry_del(table_target, batch_keys, p4_name=p4_name)
+                elif operation == "modify":
+                    tbl.entry_mod(table_target, batch_keys, datas[first:first+batch_size], p4_name=p4_name)
+                else:
+                    tbl.entry_add(table_target, batch_keys, datas[first:first+batch_size], p4_name=p4_name)
+        total_entries += len(keys)
+    elapsed = max(time.time() - start, 1e-9)
+    print("{} entries updated in {:.3f} s ({:.0f} entries/s)".format(total_entries, elapsed, total_entries/elapsed))
+    return total_entries
+
+if __name__ == "__main__":
+    args, pipes = pop_pipes_option([arg for arg in sys.argv[1:] if arg != "--dry-run"])
+    dry_run = "--dry-run" in sys.argv[1:]
+    operations, installed = diff_entries(load_entries(args[0]), load_entries(args[1]))
+    print_operations(operations)
+
+    if not dry_run:
+        from bfrt_session import connect
+        bfrt_client, interface, bfrt_info = connect(args[2] if len(args) > 2 else GRPC_ADDR)
+        print('The target runs the program ', bfrt_info.p4_name_get())
+        # Target pipe_id=0xffff, the asymmetric tables are written pipe by pipe
+        target = bfrt_client.Target(device_id=0, pipe_id=0xffff)
+        apply_operations(bfrt_client, bfrt_info, target, operations, pipes=pipes)
+        save_entries(args[0], installed)
@@ -0,0 +1,92 @@
+## Information on the tables declared in the Flowrest P4 program
+import os
+import re
+
+## gets the declared size of every table of a P4 program
+def get_p4_table_sizes(p4_file):
+    with open(p4_file) as source_file:
+        source = source_file.read()
+    # the size is searched only up to the declaration of the next table
+    pattern = r"\btable\s+(\w+)\s*\{((?:(?!\btable\s+\w+\s*\{).)*?)\bsize\s*=\s*(\d+)\s*;"
+    return {name: int(size) for name, body, size in re.findall(pattern, source, re.S)}
+
+## print the entries used by a table against its declared size
+## returns True when the entries fit in the table
+def report_table_usage(table_name, num_of_entries, table_sizes):
+    size = table_sizes.get(table_name)
+    if size is None:
+        print("{:<20} {:>8} entries (not declared in the P4 program)".format(table_name, num_of_entries))
+        return True
+    fits = num_of_entries <= size
+    print("{:<20} {:>8} entries / size {:>6} {}".format(table_name, num_of_entries, size,
+                                                      "" if fits else "** DOES NOT FIT **"))
+    return fits
+
+## gets the source of a P4 program with its local includes
+def get_p4_source(p4_file):
+    with open(p4_file) as source_file:
+        source = source_file.read()
+    for include in re.findall(r'#include\s+"([^"]+)"', source):
+        source += "\n" + get_p4_source(os.path.join(os.path.dirname(p4_file), include))
+    return source
+
+## gets the value of a numeric #define of a P4 program (None if not defined)
+def get_p4_define(name, source):
+    define = re.search(r"#define\s+"+name+r"\s+(\d+)", source)
+    return int(define.group(1)) if define else None
+
+## gets the value of a #define of a P4 program as a string (None if not defined)
+def get_p4_macro(name, source):
+    define = re.search(r"#define\s+"+name+r"\s+(\S+)", source)
+    return define.group(1) if define else None
+
+## gets the #define macros of a P4 program with a value of one word {name: value}
+def get_p4_macros(source):
+    return dict(re.findall(r"#define\s+(\w+)[ \t]+(\S+)[ \t]*$", source, re.M))
+
+## gets the width in bits of a type name (bit<N>, bit<(MACRO)> or a typedef)
+def get_type_width(type_name, source):
+    match = re.match(r"(?:bit|int)<\(?(\w+)\)?>", type_name)
+    if match:
+        size = match.group(1)
+        if size.isdigit():
+            return int(size)
+        return get_p4_define(size, source)
+    typedef = re.search(r"typedef\s+(\S+)\s+"+type_name+r"\s*;", source)
+    return get_type_width(typedef.group(1), source)
+
+## gets the members of every struct and header of a P4 program as {member: type}
+def get_p4_types(source):
+    types = {}
+    for name, body in re.findall(r"\b(?:struct|header)\s+(\w+)\s*\{(.*?)\}", source, re.S):
+        body = re.sub(r"//[^\n]*", "", body)
+        types[name] = dict((member, type_name) for type_name, member in
+                           re.findall(r"((?:bit|int)<[^>]+>|\w+)\s+(\w+)\s*;", body))
+    return types
+
+## gets the width in bits of a field such as meta.pkt_len_max or hdr.ipv4.total_len
+def get_field_width(field, source, types):
+    names = field.split(".")
+    # the first name is a parameter of the control applying the table
+    type_name = re.search(r"(\w+)\s+"+names[0]+r"\s*[,)]", source).group(1)
+    for member in names[1:]:
+        type_name = types[type_name][member]
+    return get_type_width(type_name, source)
+
+## gets the key fields of every table of a P4 program as (field, match type, width)
+def get_p4_table_keys(p4_file):
+    source = get_p4_source(p4_file)
+    types = get_p4_types(source)
+    macros = get_p4_macros(source)
+    table_keys = {}
+    for name, keys in re.findall(r"\btable\s+(\w+)\s*\{\s*key\s*=\s*\{(.*?)\}", source, re.S):
+        # the keys may be macros of the generated includes, e.g. meta.CODEWORD0
+        keys = re.sub(r"\w+", lambda word: macros.get(word.group(), word.group()), keys)
+        table_keys[name] = []
+        for field, high, low, match_type in re.findall(r"([\w\.]+)(?:\[(\d+):(\d+)\])?\s*:\s*(\w+)", keys):
+            if high:
+                width = int(high) - int(low) + 1
+            else:
+                width = get_field_width(field, source, types)
+            table_keys[name].append((field, match_type, width))
+    return table_keys
@@ -0,0 +1,95 @@
+## Reader of the IPv4 packets of pcap files (Ethernet with up to two VLAN tags,
+## or raw IPv4), shared by the feature extraction (flow_features.py) and the
+## register simulation (flow_register_simulator.py).
+## The file is read in chunks of CHUNK_BYTES: the records complete in a chunk
+## are parsed at once with numpy, the incomplete last one is kept for the next
+## chunk, so that only one chunk of the trace is in memory at a time. Every
+## chunk gives a dict of columns: timestamp (ns), src_addr, dst_addr, src_port,
+## dst_port (0 for other protocols than TCP and UDP), protocol, total_len and
+## ack_flag.
+import struct
+import numpy as np
+
+## bytes of the pcap read at once
+CHUNK_BYTES = 64 << 20
+## link types of the pcap files read: Ethernet, raw IPv4 (others are read as raw IPv4)
+LINKTYPE_ETHERNET = 1
+
+## unsigned integers of size bytes at the given positions of a byte array
+def get_uints(data, positions, size, big_endian=True):
+    values = np.zeros(len(positions), dtype=np.int64)
+    for byte in range(size):
+        shift = 8 * (size - 1 - byte) if big_endian else 8 * byte
+        values |= data[positions + byte].astype(np.int64) << shift
+    return values
+
+## header of a pcap file: byte order, timestamp unit (ns) and link type
+def read_pcap_header(pcap):
+    header = pcap.read(24)
+    magic = header[:4]
+    endian = "<" if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1") else ">"
+    # nanosecond pcap files have a different magic number
+    scale = 1 if magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d") else 1000
+    return endian, scale, struct.unpack(endian+"I", header[20:24])[0]
+
+## offsets of the complete records of a buffer and the offset of the first
+## incomplete one
+def get_record_offsets(buffer, endian):
+    offsets = []
+    position = 0
+    captured_length = struct.Struct(endian+"I")
+    while position + 16 <= len(buffer):
+        end = position + 16 + captured_length.unpack_from(buffer, position + 8)[0]
+        if end > len(buffer):
+            break
+        offsets.append(position)
+        position = end
+    return np.array(offsets, dtype=np.int64), position
+
+## packet fields of the IPv4 records of a buffer, parsed with numpy
+def parse_records(buffer, offsets, endian, scale, link_type):
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    # padding so that the positions past the end of a truncated record stay in the array
+    data = np.append(data, np.zeros(64, dtype=np.uint8))
+    little = endian == "<"
+    captured = get_uints(data, offsets + 8, 4, not little)
+    packet = offsets + 16
+    end = packet + captured
+    ip = packet.copy()
+    valid = np.ones(len(offsets), dtype=bool)
+    if link_type == LINKTYPE_ETHERNET:
+        ether_type = get_uints(data, packet + 12, 2)
+        ip = packet + 14
+        # up to two VLAN tags
+        for tag in range(2):
+            tagged = ((ether_type == 0x8100) | (ether_type == 0x88a8)) & (ip + 4 <= end)
+            ether_type = np.where(tagged, get_uints(data, ip + 2, 2), ether_type)
+            ip = np.where(tagged, ip + 4, ip)
+        valid &= ether_type == 0x0800
+    valid &= (ip + 20 <= end) & ((data[np.minimum(ip, len(data) - 1)] >> 4) == 4)
+    offsets, captured, end, ip = offsets[valid], captured[valid], end[valid], ip[valid]
+    transport = ip + (data[ip] & 0x0f).astype(np.int64) * 4
+    protocol = data[ip + 9].astype(np.int64)
+    has_ports = ((protocol == 6) | (protocol == 17)) & (transport + 4 <= end)
+    has_ack = (protocol == 6) & (transport + 14 <= end)
+    return {"timestamp": get_uints(data, offsets, 4, not little) * 10**9 + get_uints(data, offsets + 4, 4, not little) * scale,
+            "src_addr": get_uints(data, ip + 12, 4), "dst_addr": get_uints(data, ip + 16, 4),
+            "src_port": np.where(has_ports, get_uints(data, transport, 2), 0),
+            "dst_port": np.where(has_ports, get_uints(data, transport + 2, 2), 0),
+            "protocol": protocol, "total_len": get_uints(data, ip + 2, 2),
+            "ack_flag": np.where(has_ack, (data[np.minimum(transport + 13, len(data) - 1)] >> 4) & 1, 0).astype(np.int64)}
+
+## packets of a pcap file, one dict of columns per chunk of chunk_bytes
+def read_pcap_chunks(path, chunk_bytes=CHUNK_BYTES):
+    with open(path, "rb") as pcap:
+        endian, scale, link_type = read_pcap_header(pcap)
+        buffer = b""
+        while True:
+            data = pcap.read(chunk_bytes)
+            if not data:
+                break
+            buffer += data
+            offsets, position = get_record_offsets(buffer, endian)
+            if len(offsets):
+                yield parse_records(buffer, offsets, endian, scale, link_type)
+            buffer = buffer[position:]
@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+## Software emulation of the inference pipeline of unibs_flowrest.p4 on the
+## compiled entries: feature tables (range or ternary) -> codewords -> code
+## tables (ternary) -> voting table. It classifies batches of feature rows with
+## numpy, so that the entries can be checked against the model before export.
+## usage: python3 pipeline_emulator.py ENTRIES.npz MODEL.pkl [FEATURES.csv] [NUM_OF_ROWS] [--minimized]
+##
+## The lookups follow the P4 program: a feature table miss leaves the slices of
+## the codewords at 0, a code table miss leaves the class of the tree at 0 and a
+## voting table miss leaves the final class at 0. Feature values wrap at the width
+## of the field they are stored in. The rows are grouped by the codes they get
+## from the feature tables, so the code tables are only matched once per distinct
+## codeword and the voting table once per distinct vote.
+## The codewords are never built: the value and mask of every code table entry
+## are split by feature slice and matched once against the distinct codes of the
+## feature, so every code gives the bitset of the entries it agrees with and a
+## codeword hits the entries set in the bitsets of all its codes (the first one
+## wins). A forest of 3 trees of depth 14 is emulated at about 300k rows/s.
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from entries_artifact import from_column, get_num_of_entries
+from rf_compiler import compile_feature_tables
+from codeword_layout import get_codeword_layout
+
+## words of entry bitsets matched at once by match_code_table (8 bytes each)
+CODE_TABLE_CHUNK_WORDS = 1 << 22
+
+## bit matrix (most significant bit first) of a list of integers of the given width
+def ints_to_bits(values, width):
+    num_bytes = (width + 7) // 8
+    rows = b"".join(int(value).to_bytes(num_bytes, "big") for value in values)
+    bits = np.unpackbits(np.frombuffer(rows, dtype=np.uint8).reshape(len(values), num_bytes), axis=1)
+    return bits[:, bits.shape[1]-width:]
+
+## bitsets of rows (64 rows per word, first row in the most significant bit)
+## of every column of a bit matrix given by columns
+def get_column_bitsets(columns):
+    padded = np.zeros((len(columns), columns.shape[1] + (-columns.shape[1]) % 64), dtype=np.uint8)
+    padded[:, :columns.shape[1]] = columns
+    return np.packbits(padded, axis=1).view(">u8").astype(np.uint64)
+
+## index of the first bit set (most significant first) in every row of bitsets,
+## -1 on the rows without bits set
+def get_first_bits(bitsets):
+    words = (bitsets != 0).argmax(axis=1)
+    word = bitsets[np.arange(len(bitsets)), words]
+    leading_zeros = np.zeros(len(bitsets), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high_zeros = word < np.uint64(1 << (64 - shift))
+        leading_zeros += shift * high_zeros
+        word = np.where(high_zeros, word << np.uint64(shift), word)
+    return np.where(bitsets.any(axis=1), words * 64 + leading_zeros, -1)
+
+## tables of the artifact by name
+def get_tables_by_name(tables):
+    return {table["table"]: table for table in tables}
+
+## lookup of a feature table: index of the entry hit by every value, -1 on a miss
+def get_feature_lookup(table, fea, width):
+    field = "feature"+str(fea)
+    match_type = dict(table["keys"])[field]
+    if match_type == "range":
+        starts = np.asarray(from_column(table["columns"][field+"_start"]), dtype=np.int64)
+        ends = np.asarray(from_column(table["columns"][field+"_end"]), dtype=np.int64)
+        order = np.argsort(starts, kind="stable")
+        def lookup(values):
+            positions = np.searchsorted(starts[order], values, side="right") - 1
+            entries = order[np.maximum(positions, 0)]
+            return np.where((positions >= 0) & (values <= ends[entries]), entries, -1)
+        return lookup
+    # ternary: resolve the entry of every value of the field once, lowest priority value first
+    values = np.asarray(from_column(table["columns"][field]), dtype=np.int64)
+    masks = np.asarray(from_column(table["columns"][field+"_mask"]), dtype=np.int64)
+    priorities = np.asarray(from_column(table["columns"]["$MATCH_PRIORITY"]), dtype=np.int64)
+    field_values = np.arange(1 << width, dtype=np.int64)
+    entry_of_value = np.full(1 << width, -1, dtype=np.int64)
+    for entry in np.argsort(priorities, kind="stable")[::-1]:
+        entry_of_value[(field_values & masks[entry]) == values[entry]] = entry
+    return lambda values: entry_of_value[values]
+
+## prepare the tables of the artifact for emulate_pipeline
+def get_emulator(tables, layout, feature_widths):
+    tables = get_tables_by_name(tables)
+    num_of_trees = len(layout["codeword_widths"])
+    emulator = {"layout": layout, "feature_widths": feature_widths, "features": [], "trees": []}
+    for fea, width in enumerate(feature_widths):
+        table = tables["Ingress.table_feature"+str(fea)]
+        # distinct code bits of every tree and the code of every entry, with an
+        # all-zero code for the misses (entry -1)
+        code_bits, code_ids = [], []
+        for tree_id in range(num_of_trees):
+            code_width = layout["code_widths"][fea][tree_id]
+            bits = np.zeros((get_num_of_entries(table) + 1, code_width), dtype=np.uint8)
+            if code_width:
+                bits[:-1] = ints_to_bits(from_column(table["columns"]["code"+str(tree_id)]), code_width)
+            distinct_bits, ids = np.unique(bits, axis=0, return_inverse=True)
+            code_bits.append(distinct_bits)
+            code_ids.append(ids.reshape(-1))
+        emulator["features"].append({"lookup": get_feature_lookup(table, fea, width),
+                                     "code_bits": code_bits, "code_ids": code_ids})
+    for tree_id, width in enumerate(layout["codeword_widths"]):
+        table = tables["Ingress.code_table"+str(tree_id)]
+        field = "meta.codeword"+str(tree_id)
+        codes = ints_to_bits(from_column(table["columns"][field]), width)
+        masks = ints_to_bits(from_column(table["columns"][field+"_mask"]), width)
+        # bitsets of the entries agreeing with every distinct code of a feature on
+        # its slice: an entry disagrees with a code on the bits of its mask where
+        # it differs from the code, counted by a product of bit matrices
+        entry_bitsets = []
+        for fea, feature in enumerate(emulator["features"]):
+            code_slice = layout["slices"][fea][tree_id]
+            if code_slice is None:
+                continue
+            high, low = code_slice
+            ones = (masks[:, width-1-high:width-low] & codes[:, width-1-high:width-low]).astype(np.float32)
+            zeros = (masks[:, width-1-high:width-low] & (1 - codes[:, width-1-high:width-low])).astype(np.float32)
+            bits = feature["code_bits"][tree_id].astype(np.float32)
+            differences = bits @ zeros.T + (1 - bits) @ ones.T
+            entry_bitsets.append((fea, get_column_bitsets((differences == 0).astype(np.uint8))))
+        emulator["trees"].append({"entry_bitsets": entry_bitsets,
+                                  "all_entries": get_column_bitsets(np.ones((1, len(codes)), dtype=np.uint8))[0],
+                                  "classes": np.asarray(from_column(table["columns"]["classe"]), dtype=np.int64)})
+    voting_table = tables["Ingress.voting_table"]
+    fields = ["meta.class"+str(tree_id) for tree_id in range(num_of_trees)]
+    emulator["voting_ternary"] = dict(voting_table["keys"])[fields[0]] == "ternary"
+    emulator["voting_keys"] = np.array([from_column(voting_table["columns"][field]) for field in fields],
+                                       dtype=np.int64).reshape(num_of_trees, -1).T
+    emulator["voting_results"] = np.asarray(from_column(voting_table["columns"]["class_result"]), dtype=np.int64)
+    if emulator["voting_ternary"]:
+        emulator["voting_masks"] = np.array([from_column(voting_table["columns"][field+"_mask"]) for field in fields],
+                                            dtype=np.int64).reshape(num_of_trees, -1).T
+        order = np.argsort(from_column(voting_table["columns"]["$MATCH_PRIORITY"]), kind="stable")
+        for name in ("voting_keys", "voting_masks", "voting_results"):
+            emulator[name] = emulator[name][order]
+    return emulator
+
+## distinct rows of a matrix of integers in [0, radix) per column, with the index
+## of the distinct row of every row; the rows are packed in a single integer when
+## they fit in 63 bits, which is much faster to sort than rows
+def get_distinct_rows(matrix, radices):
+    if np.prod([float(radix) for radix in radices]) >= 2**63:
+        distinct, inverse = np.unique(matrix, axis=0, return_inverse=True)
+        return distinct, inverse.reshape(-1)
+    keys = np.zeros(len(matrix), dtype=np.int64)
+    for column, radix in enumerate(radices):
+        keys = keys * radix + matrix[:, column]
+    distinct_keys, inverse = np.unique(keys, return_inverse=True)
+    distinct = np.empty((len(distinct_keys), len(radices)), dtype=np.int64)
+    for column in range(len(radices)-1, -1, -1):
+        distinct_keys, distinct[:, column] = np.divmod(distinct_keys, radices[column])
+    return distinct, inverse.reshape(-1)
+
+## class of a code table for every combination of codes of the feature tables
+## (0 on a miss): the entries hit by a combination are the AND of the bitsets of
+## its codes and the first of them wins; the combinations are matched by chunks
+## of CODE_TABLE_CHUNK_WORDS words of bitsets
+def match_code_table(tree, code_combinations):
+    classes = np.zeros(len(code_combinations), dtype=np.int64)
+    if not len(tree["classes"]):
+        return classes
+    chunk_rows = max(CODE_TABLE_CHUNK_WORDS // len(tree["all_entries"]), 1)
+    for start in range(0, len(code_combinations), chunk_rows):
+        combinations = code_combinations[start:start+chunk_rows]
+        hits = np.broadcast_to(tree["all_entries"], (len(combinations), len(tree["all_entries"])))
+        for fea, bitsets in tree["entry_bitsets"]:
+            hits = hits & bitsets[combinations[:, fea]]
+        entries = get_first_bits(hits)
+        classes[start:start+len(combinations)] = np.where(entries >= 0, tree["classes"][entries], 0)
+    return classes
+
+## final class of every vector of tree classes (0 on a miss)
+def match_voting_table(emulator, tree_classes):
+    radix = int(max(tree_classes.max(initial=0), emulator["voting_results"].max(initial=0))) + 1
+    votes, inverse = get_distinct_rows(tree_classes, [radix]*tree_classes.shape[1])
+    keys = emulator["voting_keys"]
+    if emulator["voting_ternary"]:
+        hits = ((votes[:, None, :] & emulator["voting_masks"][None]) == keys[None]).all(axis=2)
+    else:
+        hits = (votes[:, None, :] == keys[None]).all(axis=2)
+    results = np.where(hits.any(axis=1), emulator["voting_results"][hits.argmax(axis=1)], 0)
+    return results[inverse]
+
+## classify the feature rows (integers, one column per feature table);
+## returns the final class and the class of every tree, numbered from 1 as in the P4 program
+def emulate_pipeline(emulator, features):
+    features = np.asarray(features, dtype=np.int64)
+    entries = np.empty(features.shape, dtype=np.int64)
+    for fea, (feature, width) in enumerate(zip(emulator["features"], emulator["feature_widths"])):
+        entries[:, fea] = feature["lookup"](features[:, fea] & ((1 << width) - 1))
+    tree_classes = np.empty((len(features), len(emulator["trees"])), dtype=np.int64)
+    for tree_id, tree in enumerate(emulator["trees"]):
+        # one code table lookup per distinct codeword of the tree
+        code_ids = np.stack([feature["code_ids"][tree_id][entries[:, fea]]
+                             for fea, feature in enumerate(emulator["features"])], axis=1)
+        code_combinations, inverse = get_distinct_rows(code_ids, [len(feature["code_bits"][tree_id])
+                                                                  for feature in emulator["features"]])
+        tree_classes[:, tree_id] = match_code_table(tree, code_combinations)[inverse]
+    return match_voting_table(emulator, tree_classes), tree_classes
+
+## feature rows covering every range of the feature tables: the bounds of the
+## ranges, their neighbours and uniform values of the field
+def get_emulation_samples(feature_tables, feature_widths, num_of_rows, seed=42):
+    rng = np.random.default_rng(seed)
+    columns = []
+    for feature_table, width in zip(feature_tables, feature_widths):
+        thresholds = feature_table["Threshold"].astype(np.int64)
+        bounds = np.unique(np.concatenate([[0, (1 << width) - 1], thresholds, thresholds + 1, thresholds - 1]))
+        bounds = bounds[(bounds >= 0) & (bounds < 1 << width)]
+        uniform = rng.integers(0, 1 << width, num_of_rows)
+        columns.append(np.where(rng.random(num_of_rows) < 0.5, rng.choice(bounds, num_of_rows), uniform))
+    return np.stack(columns, axis=1)
+
+## compare the emulated classes with the trees and the forest of the model: the
+## class of every tree and the class voted by a majority of the trees must be
+## reproduced exactly, clf.predict averages the probabilities of the trees and
+## can differ from the vote of the switch
+def compare_with_model(clf, features, feature_widths, final_classes, tree_classes):
+    features = np.asarray(features, dtype=np.int64)
+    # the trees see the feature values stored in the fields of the switch
+    wrapped = features & np.array([(1 << width) - 1 for width in feature_widths], dtype=np.int64)
+    report = {"rows": len(features), "tree_mismatches": []}
+    expected_trees = np.stack([estimator.predict(wrapped).astype(np.int64) + 1 for estimator in clf.estimators_], axis=1)
+    for tree_id in range(len(clf.estimators_)):
+        report["tree_mismatches"].append(int((tree_classes[:, tree_id] != expected_trees[:, tree_id]).sum()))
+    votes = (expected_trees[:, :, None] == expected_trees[:, None, :]).sum(axis=2)
+    majority = votes.max(axis=1) * 2 > len(clf.estimators_)
+    majority_classes = expected_trees[np.arange(len(features)), votes.argmax(axis=1)]
+    report["vote_mismatches"] = int((majority & (final_classes != majority_classes)).sum())
+    expected = np.searchsorted(clf.classes_, clf.predict(pd.DataFrame(features, columns=clf.feature_names_in_))) + 1
+    report["disagreements"] = int((final_classes != expected).sum())
+    report["disagreement_rate"] = report["disagreements"] / max(len(features), 1)
+    report["voting_misses"] = int((final_classes == 0).sum())
+    return report
+
+## print the comparison with the model
+def report_emulation(report, elapsed):
+    print("emulated {} rows in {:.3f} s ({:.0f} rows/s)".format(report["rows"], elapsed, report["rows"]/max(elapsed, 1e-9)))
+    for tree_id, mismatches in enumerate(report["tree_mismatches"]):
+        print("{:<16} {:>9} rows differ from the tree".format("code_table"+str(tree_id), mismatches))
+    print("{:<16} {:>9} rows differ from the majority of the trees".format("voting_table", report["vote_mismatches"]))
+    print("{:<16} {:>9} rows differ from clf.predict ({:.4%}), {} voting misses".format(
+        "forest", report["disagreements"], report["disagreement_rate"], report["voting_misses"]))
+
+## the entries reproduce the trees and their vote, and the forest within max_disagreement
+def is_exact(report, max_disagreement=None):
+    if sum(report["tree_mismatches"]) or report["vote_mismatches"]:
+        return False
+    return max_disagreement is None or report["disagreement_rate"] <= max_disagreement
+
+## emulate the entries on the feature rows and compare them with the model
+def check_entries(clf, tables, feature_tables, feature_widths, features):
+    layout = get_codeword_layout(feature_tables, len(clf.estimators_))
+    start = time.time()
+    emulator = get_emulator(tables, layout, feature_widths)
+    final_classes, tree_classes = emulate_pipeline(emulator, features)
+    elapsed = time.time() - start
+    report = compare_with_model(clf, features, feature_widths, final_classes, tree_classes)
+    report_emulation(report, elapsed)
+    return report
+
+if __name__ == "__main__":
+    from entries_artifact import load_entries
+    from p4_tables import get_p4_table_keys
+    # entries generated with MINIMIZE_ENTRIES: the layout is the one of the minimized tables
+    minimized = "--minimized" in sys.argv
+    args = [arg for arg in sys.argv if arg != "--minimized"]
+    clf = pd.read_pickle(args[2])
+    feature_names = clf.feature_names_in_
+    feature_tables = compile_feature_tables(clf, feature_names)
+    p4_file = '../../P4/Full_version/unibs_flowrest.p4'
+    table_keys = get_p4_table_keys(p4_file) if os.path.exists(p4_file) else {}
+    feature_widths = [table_keys.get("table_feature"+str(fea), [(None, None, 16)])[0][2] for fea in range(len(feature_names))]
+    if len(args) > 3 and not args[3].isdigit():
+        features = pd.read_csv(args[3])[list(feature_names)].values
+    else:
+        num_of_rows = int(args[-1]) if args[-1].isdigit() else 1000000
+        features = get_emulation_samples(feature_tables, feature_widths, num_of_rows)
+    if minimized:
+        from rf_compiler import compile_trees
+        from entries_minimizer import minimize_entries
+        feature_tables = minimize_entries(feature_tables, compile_trees(clf, feature_names), feature_widths)[0]
+    check_entries(clf, load_entries(args[1]), feature_tables, feature_widths, features)
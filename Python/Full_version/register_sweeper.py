@@ -0,0 +1,133 @@
+## Background sweeper of the flow register slots of unibs_flowrest.p4.
+## A slot is otherwise freed only by the digest of its classified flow: a flow
+## that stops before its 3rd packet keeps the slot, and the next flow hashed to
+## it is a collision (class 255) or, once the slot is older than
+## timeout_threshold, a recirculation through port 68 (class 127).
+## The sweeper reads reg_status and reg_time_occ from the hardware in chunks of
+## chunk_size indices (one entry_get per register and chunk), finds the slots in
+## use and idle for more than timeout + margin with vectorized comparisons, and
+## resets them in all the registers with one entry_mod per register, right after
+## reading the chunk. A chunk whose read took longer than the margin is not
+## reset: a slot seen stale at the start of the read may have been taken since.
+## The switch time is global_tstamp[47:20] (units of 2^20 ns): it is estimated
+## as the most recent reg_time_occ read, advanced with the local clock.
+import time
+import numpy as np
+
+## slots of the registers (MAX_REGISTER_ENTRIES)
+NUM_OF_SLOTS = 1 << 16
+## idle time after which a slot is stale, in units of 2^20 ns (timeout_threshold)
+SLOT_TIMEOUT = 512
+## extra idle time before a reset, in units of 2^20 ns, so that a slot refreshed
+## between the read and the write is not taken from a live flow
+SLOT_MARGIN = 512
+## register indices per entry_get and entry_mod
+SWEEP_CHUNK = 4096
+## seconds between two sweeps
+SWEEP_INTERVAL = 5.0
+## registers read to find the stale slots
+STATUS_REGISTER = 'Ingress.reg_status'
+TIME_REGISTER = 'Ingress.reg_time_occ'
+## units of the switch time per second
+TIME_UNITS_PER_SECOND = 1e9 / (1 << 20)
+## the switch time is 28 bits wide
+TIME_WRAP = 1 << 28
+
+## state and counters of the sweeper
+def open_register_sweeper(num_of_slots=NUM_OF_SLOTS, timeout=SLOT_TIMEOUT, margin=SLOT_MARGIN,
+                          chunk_size=SWEEP_CHUNK, interval=SWEEP_INTERVAL):
+    return {"num_of_slots": num_of_slots, "timeout": timeout, "margin": margin, "chunk_size": chunk_size,
+            "interval": interval, "switch_time": None, "local_time": None,
+            "sweeps": 0, "slots_read": 0, "slots_reset": 0, "read_seconds": 0.0,
+            "write_seconds": 0.0, "chunks_skipped": 0, "errors": 0}
+
+## values of a register for a chunk of indices, read from the hardware; the
+## value of a slot is the maximum over the pipes
+def read_register_chunk(bfrt_client, table, name, target, indices, p4_name=None):
+    keys = [table.make_key([bfrt_client.KeyTuple('$REGISTER_INDEX', int(index))]) for index in indices]
+    values = np.zeros(len(indices), dtype=np.int64)
+    positions = {int(index): position for position, index in enumerate(indices)}
+    for data, key in table.entry_get(target, keys, flags={"from_hw": True}, p4_name=p4_name):
+        index = key.to_dict()['$REGISTER_INDEX']['value']
+        values[positions[index]] = max(data.to_dict()[name+'.f1'])
+    return values
+
+## estimate of the switch time: the most recent timestamp of the registers, or
+## the previous estimate advanced with the local clock if it is more recent
+def update_switch_time(sweeper, latest_timestamp, now=None):
+    now = time.time() if now is None else now
+    if sweeper["switch_time"] is not None:
+        advanced = sweeper["switch_time"] + int((now - sweeper["local_time"]) * TIME_UNITS_PER_SECOND)
+        # global_tstamp[47:20] wraps at 2^28
+        if advanced < TIME_WRAP:
+            latest_timestamp = max(latest_timestamp, advanced)
+    sweeper["switch_time"] = latest_timestamp
+    sweeper["local_time"] = now
+    return latest_timestamp
+
+## indices of the slots in use and idle for more than timeout + margin, with the
+## age computed as in the P4 program (32-bit wrapping subtraction)
+def get_stale_slots(indices, status, timestamps, switch_time, timeout, margin):
+    ages = (switch_time - timestamps) & 0xffffffff
+    return indices[(status != 0) & (ages >= timeout + margin)]
+
+## reset the slots in all the registers, one entry_mod per register
+def reset_slots(bfrt_client, handles, target, indices):
+    for name, table in handles["registers"].items():
+        keys = [table.make_key([bfrt_client.KeyTuple('$REGISTER_INDEX', int(index))]) for index in indices]
+        table.entry_mod(target, key_list=keys, data_list=[handles["register_datas"][name]] * len(keys),
+                        flags={"from_hw": True}, p4_name=handles["p4_name"])
+
+## read a chunk of slots and reset its stale slots, returns their indices
+def sweep_chunk(bfrt_client, handles, target, sweeper, indices):
+    start = time.time()
+    status = read_register_chunk(bfrt_client, handles["registers"][STATUS_REGISTER], STATUS_REGISTER,
+                                 target, indices, handles["p4_name"])
+    timestamps = read_register_chunk(bfrt_client, handles["registers"][TIME_REGISTER], TIME_REGISTER,
+                                     target, indices, handles["p4_name"])
+    read_seconds = time.time() - start
+    sweeper["read_seconds"] += read_seconds
+    sweeper["slots_read"] += len(indices)
+    used = timestamps[status != 0]
+    if len(used) == 0:
+        return np.zeros(0, dtype=np.int64)
+    switch_time = update_switch_time(sweeper, int(used.max()))
+    if read_seconds * TIME_UNITS_PER_SECOND >= sweeper["margin"]:
+        sweeper["chunks_skipped"] += 1
+        return np.zeros(0, dtype=np.int64)
+    stale = get_stale_slots(indices, status, timestamps, switch_time, sweeper["timeout"], sweeper["margin"])
+    if len(stale):
+        start = time.time()
+        reset_slots(bfrt_client, handles, target, stale)
+        sweeper["write_seconds"] += time.time() - start
+        sweeper["slots_reset"] += len(stale)
+    return stale
+
+## one pass over all the slots, chunk by chunk
+def sweep_registers(bfrt_client, handles, target, sweeper):
+    stale = []
+    for low in range(0, sweeper["num_of_slots"], sweeper["chunk_size"]):
+        indices = np.arange(low, min(low + sweeper["chunk_size"], sweeper["num_of_slots"]))
+        stale.append(sweep_chunk(bfrt_client, handles, target, sweeper, indices))
+    sweeper["sweeps"] += 1
+    return np.concatenate(stale)
+
+## sweeper thread: a sweep every interval seconds until stopped
+def run_sweeper(bfrt_client, handles, target, sweeper, stop):
+    while not stop.wait(sweeper["interval"]):
+        try:
+            sweep_registers(bfrt_client, handles, target, sweeper)
+        except Exception as error:
+            # a failed sweep is retried at the next interval
+            sweeper["errors"] += 1
+            print("Sweep error:", error)
+
+## counters of the sweeper
+def get_sweeper_counters(sweeper):
+    return {name: value for name, value in sweeper.items() if name not in ("switch_time", "local_time")}
+
+## print the counters of the sweeper
+def report_sweeper(counters):
+    print("register sweeper: {} sweeps, {} slots read in {:.3f} s, {} stale slots reset in {:.3f} s, {} slow chunks skipped, {} errors".format(
+        counters["sweeps"], counters["slots_read"], counters["read_seconds"], counters["slots_reset"],
+        counters["write_seconds"], counters["chunks_skipped"], counters["errors"]))
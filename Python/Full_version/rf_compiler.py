@@ -0,0 +1,195 @@
+## Vectorized compiler from a trained RF model to the Flowrest table contents.
+## The trees are walked once and every feature keeps its thresholds in sorted
+## NumPy arrays, so the feature tables are built with searchsorted/broadcasting
+## instead of one DataFrame column (and one filter) per split.
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+
+## value used by sklearn for the threshold of leaf nodes
+TREE_UNDEFINED = -2.0
+
+## gets all splits and conditions of the forest in a single pass
+def get_splits(forest, feature_names):
+    columns = {"Tree": [], "NodeID": [], "LeftID": [], "RightID": [], "Threshold": [], "Feature": []}
+    for t in range(len(forest.estimators_)):
+        tree_ = forest[t].tree_
+        nodes = np.flatnonzero(tree_.threshold != TREE_UNDEFINED)
+        columns["Tree"].append(np.full(len(nodes), t, dtype=np.int64))
+        columns["NodeID"].append(nodes)
+        columns["LeftID"].append(tree_.children_left[nodes])
+        columns["RightID"].append(tree_.children_right[nodes])
+        columns["Threshold"].append(tree_.threshold[nodes])
+        columns["Feature"].append(tree_.feature[nodes])
+    data = pd.DataFrame({name: np.concatenate(values) for name, values in columns.items()})
+    data["Feature"] = np.asarray(feature_names, dtype=object)[data["Feature"].to_numpy()]
+    return data
+
+## gets the feature table of one feature from the splits
+## Threshold holds the upper bound of every range (the last row stands for the
+## values above the largest threshold), Bits holds one 0/1 matrix per tree with
+## a column for each split of that tree, in increasing threshold order
+def get_feature_table(splits_data, feature_name, num_of_trees):
+    feature_data = splits_data[splits_data["Feature"] == feature_name]
+    # same (quicksort) ordering as the per-split pandas implementation
+    order = np.argsort(feature_data["Threshold"].to_numpy(), kind="quicksort")
+    split_thresholds = feature_data["Threshold"].to_numpy()[order].astype(int)
+    split_trees = feature_data["Tree"].to_numpy()[order]
+    split_nodes = feature_data["NodeID"].to_numpy()[order]
+    if len(split_thresholds) == 0:
+        # feature not used by the forest: a single range without code bits
+        thresholds = np.zeros(1, dtype=split_thresholds.dtype)
+    else:
+        thresholds = np.unique(split_thresholds)
+        thresholds = np.append(thresholds, thresholds[-1] + 1)
+    # a split is crossed to the right (bit 1) by every range above its threshold
+    first_right_row = np.searchsorted(thresholds, split_thresholds, side="right")
+    rows = np.arange(len(thresholds))[:, None]
+    bits = (rows >= first_right_row[None, :]).astype(np.uint8)
+    feature_table = {"Threshold": thresholds, "Nodes": [], "Bits": []}
+    for tree_id in range(num_of_trees):
+        in_tree = split_trees == tree_id
+        feature_table["Nodes"].append(split_nodes[in_tree])
+        feature_table["Bits"].append(bits[:, in_tree])
+    return feature_table
+
+## gets the feature tables of all features from one walk of the forest
+def compile_feature_tables(forest, feature_names):
+    splits = get_splits(forest, feature_names)
+    num_of_trees = len(forest.estimators_)
+    return [get_feature_table(splits, feature_name, num_of_trees) for feature_name in feature_names]
+
+## get start and end of every range of a feature table
+def get_feature_ranges(feature_table):
+    thresholds = feature_table["Threshold"]
+    starts = np.concatenate(([0], thresholds[:-1] + 1))
+    # the last range starts after the largest threshold
+    starts[-1] = thresholds[-1]
+    return starts, thresholds
+
+## format a 0/1 matrix as one "0b..." string per row
+def bits_to_strings(bits):
+    if bits.shape[1] == 0:
+        return ["0b"]*bits.shape[0]
+    chars = np.where(bits != 0, "1", "0")
+    return ["0b" + "".join(row) for row in chars]
+
+## convert a 0/1 matrix to one python integer per row, the first column is the MSB
+def bits_to_ints(bits):
+    width = bits.shape[1]
+    if width == 0:
+        return [0]*bits.shape[0]
+    # left pad to whole bytes so that every row packs to a big-endian integer
+    padded = np.zeros((bits.shape[0], (-width) % 8 + width), dtype=np.uint8)
+    padded[:, (-width) % 8:] = bits
+    packed = np.packbits(padded, axis=1)
+    return [int.from_bytes(row.tobytes(), "big") for row in packed]
+
+## get feature tables with ranges and codes only
+def get_feature_codes_with_ranges(feature_table, num_of_trees):
+    Codes = pd.DataFrame()
+    for tree_id in range(num_of_trees):
+        Codes["code"+str(tree_id)] = bits_to_strings(feature_table["Bits"][tree_id])
+    starts, ends = get_feature_ranges(feature_table)
+    Ranges = pd.Series([str(start)+","+str(end) for start, end in zip(starts, ends)])
+    return Ranges, Codes
+
+## format an integer bitset as a "0b..." string of the given width
+def format_bits(value, width):
+    if width == 0:
+        return "0b"
+    return "0b" + format(value, "0"+str(width)+"b")
+
+## get the order of the splits of one tree to enable code generation
+## (feature by feature, in increasing threshold order)
+def get_order_of_splits(clf, num_of_features):
+    tree_ = clf.tree_
+    nodes = np.flatnonzero(tree_.threshold != TREE_UNDEFINED)
+    splits_order = []
+    for feature in range(num_of_features):
+        feature_nodes = nodes[tree_.feature[nodes] == feature]
+        order = np.argsort(tree_.threshold[feature_nodes], kind="quicksort")
+        splits_order.extend(feature_nodes[order])
+    return np.asarray(splits_order, dtype=np.int64)
+
+## get the width of the codeword of one tree (one bit per split)
+def get_codeword_width(clf):
+    return int(np.count_nonzero(clf.tree_.threshold != TREE_UNDEFINED))
+
+## get class and certainty of a leaf
+def get_leaf_class(tree_, leaf):
+    if tree_.n_outputs == 1:
+        value = tree_.value[leaf][0]
+    else:
+        value = tree_.value[leaf].T[0]
+    class_name = int(np.argmax(value))
+    certainty = int(round(max(value)/sum(value),2)*100)
+    return class_name, certainty
+
+## get every leaf of one tree with a single depth-first walk:
+## the path of nodes crossed, the branch taken at each split (0 left, 1 right),
+## the code and mask as integer bitsets over the split order, class and certainty
+def get_leaves(clf, feature_names):
+    tree_ = clf.tree_
+    children_left = tree_.children_left
+    children_right = tree_.children_right
+    splits = get_order_of_splits(clf, len(feature_names))
+    width = len(splits)
+    # weight of the bit of each split in the codeword, the first split is the MSB
+    weight = [0]*tree_.node_count
+    for index, split in enumerate(splits):
+        weight[split] = 1 << (width - 1 - index)
+    leaves = []
+    stack = [(0, [0], [], 0, 0)]
+    while stack:
+        node, path, branch, code, mask = stack.pop()
+        left, right = children_left[node], children_right[node]
+        if left == right:
+            class_name, certainty = get_leaf_class(tree_, node)
+            leaves.append((node, path, branch, code, mask, class_name, certainty))
+            continue
+        bit = weight[node]
+        stack.append((right, path + [right], branch + [1], code | bit, mask | bit))
+        stack.append((left, path + [left], branch + [0], code, mask | bit))
+    # leaves are listed in node order
+    leaves.sort(key=lambda leaf: leaf[0])
+    columns = ["Leaf", "Path", "Branch", "Code", "Mask", "Class", "Certainty"]
+    # codes and masks can be wider than 64 bits, keep them as python integers
+    return pd.DataFrame({name: pd.Series([leaf[i] for leaf in leaves], dtype=object)
+                         for i, name in enumerate(columns)}).astype({"Leaf": np.int64, "Class": np.int64, "Certainty": np.int64})
+
+## get classes and certainties
+def get_classes(clf, feature_names):
+    leaves = get_leaves(clf, feature_names)
+    return list(leaves["Class"]), list(leaves["Certainty"])
+
+## get the codes corresponding to the branches followed
+def get_leaf_paths(clf, feature_names):
+    return list(get_leaves(clf, feature_names)["Branch"])
+
+## Get codes and masks as integer bitsets
+def get_codes_and_masks(clf, feature_names):
+    leaves = get_leaves(clf, feature_names)
+    return list(leaves["Code"]), list(leaves["Mask"])
+
+## compile the leaves of every tree of the forest, one tree per worker process.
+## The results are returned in tree order whatever the completion order.
+def compile_trees(forest, feature_names, max_workers=None):
+    return compile_estimators(list(forest.estimators_), feature_names, max_workers)
+
+## compile the leaves of a list of trees, one tree per worker process
+def compile_estimators(estimators, feature_names, max_workers=None):
+    if not estimators:
+        return []
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(estimators))
+    # the workers are forked so that the calling script is not executed again
+    # in each of them; without fork the trees are compiled in this process
+    if max_workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [get_leaves(estimator, feature_names) for estimator in estimators]
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        return list(executor.map(get_leaves, estimators, repeat(feature_names)))
@@ -0,0 +1,37 @@
+## Entries of the tables of the P4 program used by a trained RF model, counted
+## as the generator installs them: compiled by rf_compiler.py, then minimized by
+## entries_minimizer.py. It is the cost model of the search of the models
+## (model_search.py), of the quantization of the features
+## (feature_quantization.py) and of the pruning to the table sizes
+## (budget_pruning.py).
+from rf_compiler import compile_feature_tables, compile_estimators
+from entries_minimizer import minimize_entries
+from tcam_expansion import get_feature_ternary_entries
+from voting_compiler import count_voting_entries
+
+## feature tables and leaves of every tree of a model, as installed by the generator
+def get_installed_tables(forest, feature_names, feature_widths, minimize=True):
+    feature_tables = compile_feature_tables(forest, feature_names)
+    # the callers run one model per worker process already
+    forest_leaves = compile_estimators(list(forest.estimators_), feature_names, max_workers=1)
+    if minimize:
+        feature_tables, forest_leaves, stats = minimize_entries(feature_tables, forest_leaves, feature_widths)
+    return feature_tables, forest_leaves
+
+## entries of the feature and code tables of a model, and of the voting table
+## unless ternary_voting is None (the voting table only depends on the trees and classes)
+def get_table_usage(forest, feature_names, feature_widths, minimize=True, ternary_features=False, ternary_voting=None):
+    num_of_trees = len(forest.estimators_)
+    feature_tables, forest_leaves = get_installed_tables(forest, feature_names, feature_widths, minimize)
+    usage = {}
+    for fea, feature_table in enumerate(feature_tables):
+        if ternary_features:
+            usage["table_feature"+str(fea)] = len(get_feature_ternary_entries(feature_table, num_of_trees,
+                                                                               feature_widths[fea]))
+        else:
+            usage["table_feature"+str(fea)] = len(feature_table["Threshold"])
+    for tree_id, leaves in enumerate(forest_leaves):
+        usage["code_table"+str(tree_id)] = len(leaves)
+    if ternary_voting is not None:
+        usage["voting_table"] = count_voting_entries(num_of_trees, len(forest.classes_), ternary_voting)
+    return usage
@@ -0,0 +1,106 @@
+## TCAM-aware compilation of the feature tables.
+## A range match is expanded into TCAM prefixes by the target, and that
+## expansion decides whether a feature table fits. Here the feature tables can
+## be compiled to ternary entries directly: adjacent ranges with the same
+## codewords for every tree are merged, then the ranges are turned into the
+## minimal set of prioritized prefixes (Optimal Routing Table Constructor,
+## Draves et al.), where longer prefixes have a higher priority.
+import numpy as np
+from rf_compiler import get_feature_ranges, bits_to_ints
+
+## split the range [start, end] into the minimal list of (value, prefix length)
+def range_to_prefixes(start, end, width):
+    prefixes = []
+    while start <= end:
+        # largest aligned block starting at start and ending before end
+        size = start & -start if start else 1 << width
+        while size > end - start + 1:
+            size >>= 1
+        prefixes.append((start, width - size.bit_length() + 1))
+        start += size
+    return prefixes
+
+## number of TCAM entries of a range table expanded range by range
+def count_range_expansion(starts, ends, width):
+    return sum(len(range_to_prefixes(int(start), int(end), width)) for start, end in zip(starts, ends))
+
+## merge adjacent ranges with identical labels
+def merge_adjacent_ranges(starts, ends, labels):
+    merged_starts, merged_ends, merged_labels = [starts[0]], [ends[0]], [labels[0]]
+    for start, end, label in zip(starts[1:], ends[1:], labels[1:]):
+        if label == merged_labels[-1]:
+            merged_ends[-1] = end
+        else:
+            merged_starts.append(start)
+            merged_ends.append(end)
+            merged_labels.append(label)
+    return merged_starts, merged_ends, merged_labels
+
+## minimal prefix table for a partition of [0, 2**width) in labelled ranges,
+## returns (value, mask, priority, label) with the lowest priority value first
+def get_ternary_entries(starts, ends, labels, width):
+    starts = np.asarray(starts, dtype=np.int64)
+    label_ids = {label: index for index, label in enumerate(dict.fromkeys(labels))}
+    range_labels = [label_ids[label] for label in labels]
+
+    # binary trie over the field, a node is an aligned block [low, low + 2**size)
+    # and is a leaf when the whole block is in a single range
+    def build(low, size):
+        first = np.searchsorted(starts, low, side="right") - 1
+        last = np.searchsorted(starts, low + (1 << size) - 1, side="right") - 1
+        if first == last:
+            return {"low": low, "size": size, "labels": {range_labels[first]}, "leaf": True}
+        left = build(low, size - 1)
+        right = build(low + (1 << (size - 1)), size - 1)
+        # labels that can be inherited by both children at no cost, if any
+        common = left["labels"] & right["labels"]
+        return {"low": low, "size": size, "labels": common or (left["labels"] | right["labels"]),
+                "leaf": False, "children": (left, right)}
+
+    entries = []
+    def select(node, inherited):
+        if inherited in node["labels"]:
+            label = inherited
+        else:
+            label = min(node["labels"])
+            mask = ((1 << width) - 1) ^ ((1 << node["size"]) - 1)
+            entries.append((node["low"], mask, node["size"], label))
+        if not node["leaf"]:
+            for child in node["children"]:
+                select(child, label)
+
+    select(build(0, width), None)
+    labels_by_id = list(label_ids)
+    # longer prefixes (smaller blocks) first
+    entries.sort(key=lambda entry: (entry[2], entry[0]))
+    return [(value, mask, priority, labels_by_id[label]) for priority, (value, mask, size, label) in enumerate(entries)]
+
+## ranges of a feature table covering the whole field, with the codes of every tree
+def get_feature_partition(feature_table, num_of_trees, width):
+    starts, ends = get_feature_ranges(feature_table)
+    ends = ends.copy()
+    ends[-1] = (1 << width) - 1
+    codes = [bits_to_ints(feature_table["Bits"][tree_id]) for tree_id in range(num_of_trees)]
+    return list(starts), list(ends), list(zip(*codes))
+
+## ternary entries (value, mask, priority, codes of every tree) of a feature table
+def get_feature_ternary_entries(feature_table, num_of_trees, width):
+    starts, ends, labels = merge_adjacent_ranges(*get_feature_partition(feature_table, num_of_trees, width))
+    return get_ternary_entries(starts, ends, labels, width)
+
+## TCAM footprint of a feature table: ranges, merged ranges, range by range
+## prefix expansion and minimized ternary entries
+def get_tcam_footprint(feature_table, num_of_trees, width):
+    starts, ends, labels = get_feature_partition(feature_table, num_of_trees, width)
+    merged = merge_adjacent_ranges(starts, ends, labels)
+    return {"ranges": len(starts), "merged_ranges": len(merged[0]),
+            "range_expansion": count_range_expansion(starts, ends, width),
+            "ternary": len(get_ternary_entries(*merged, width))}
+
+## print the TCAM footprint of the feature tables against their sizes
+def report_tcam_footprint(footprints, table_sizes):
+    print("{:<16} {:>7} {:>7} {:>10} {:>8} {:>6}".format("table", "ranges", "merged", "expansion", "ternary", "size"))
+    for table_name, footprint in footprints.items():
+        size = table_sizes.get(table_name, "-")
+        print("{:<16} {:>7} {:>7} {:>10} {:>8} {:>6}".format(table_name, footprint["ranges"], footprint["merged_ranges"],
+                                                            footprint["range_expansion"], footprint["ternary"], size))
@@ -0,0 +1,29 @@
+## Tests of the buffered log of the digests.
+## usage: python3 -m pytest test_classification_log.py
+import time
+import pandas as pd
+from classification_log import open_log, log_digest, close_log, get_digest_columns
+
+def get_records(num_of_records):
+    return [{"source_addr": 0x0a000001, "destin_addr": 0x0a000002, "source_port": 1000 + row, "destin_port": 80,
+             "protocol": 6, "flow_class": 1, "register_index": row} for row in range(num_of_records)]
+
+def test_rows_are_written_without_new_digests(tmp_path):
+    path = str(tmp_path / "log.csv")
+    log = open_log(path, flush_interval=0.05)
+    log_digest(log, get_digest_columns(get_records(3)))
+    # no other digest: the timer writes the rows
+    deadline = time.time() + 5
+    while log["rows"] < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    assert log["rows"] == 3
+    assert pd.read_csv(path)["source_addr"].tolist() == ["10.0.0.1"] * 3
+    close_log(log)
+
+def test_rows_are_buffered_until_closed(tmp_path):
+    path = str(tmp_path / "log.csv")
+    log = open_log(path, flush_interval=None)
+    log_digest(log, get_digest_columns(get_records(5)))
+    assert log["rows"] == 0
+    close_log(log)
+    assert len(pd.read_csv(path)) == 5
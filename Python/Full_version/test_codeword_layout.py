@@ -0,0 +1,68 @@
+## Tests of the packing of the codewords in metadata fields and of the P4 generated with it.
+## usage: python3 -m pytest test_codeword_layout.py
+import re
+import numpy as np
+import pytest
+from codeword_layout import get_codeword_fields, get_codewords_p4, get_set_code_action_lines, get_phv_bits, \
+    get_phv_containers
+from p4_tables import get_p4_table_keys
+
+P4_FILE = '../../P4/Full_version/unibs_flowrest.p4'
+
+## a layout of the given code widths (one list of tree widths per feature)
+def get_layout(code_widths):
+    codeword_widths = [sum(widths[tree_id] for widths in code_widths) for tree_id in range(len(code_widths[0]))]
+    slices = []
+    for fea, widths in enumerate(code_widths):
+        slices.append([])
+        for tree_id, width in enumerate(widths):
+            high = codeword_widths[tree_id] - 1 - sum(code_widths[previous][tree_id] for previous in range(fea))
+            slices[-1].append((high, high - width + 1) if width else None)
+    return dict(get_codeword_fields(codeword_widths), codeword_widths=codeword_widths, code_widths=code_widths,
+                slices=slices)
+
+def test_containers_of_a_field():
+    assert get_phv_containers(90) == [2, 1, 2] and get_phv_bits(90) == 96
+    assert get_phv_containers(8) == [0, 0, 1] and get_phv_bits(0) == 0
+
+def test_codewords_share_the_containers_of_their_last_bits():
+    fields = get_codeword_fields([71, 90, 58])
+    # 90 + 58 bits fill 152 bits, instead of 96 + 64 in a field each
+    assert fields["placements"] == [(1, 0), (0, 0), (0, 90)]
+    assert sum(get_phv_bits(width) for width in fields["field_widths"]) == 224 < 72 + 96 + 64
+
+@pytest.mark.parametrize("seed", range(20))
+def test_packed_codewords_do_not_overlap(seed):
+    rng = np.random.default_rng(seed)
+    widths = rng.integers(0, 80, rng.integers(1, 12)).tolist()
+    fields = get_codeword_fields(widths)
+    used = [np.zeros(width, dtype=int) for width in fields["field_widths"]]
+    for width, (field, low) in zip(widths, fields["placements"]):
+        used[field][low:low+max(width, 1)] += 1
+    assert all((bits == 1).all() for bits in used)
+    assert sum(get_phv_bits(width) for width in fields["field_widths"]) <= sum(get_phv_bits(max(width, 1)) for width in widths)
+
+def test_set_code_actions_write_the_slices_of_the_codewords():
+    layout = get_layout([[3, 5, 0], [4, 0, 2], [1, 6, 7]])
+    codeword_slices = {}
+    for tree_id, field_bits in re.findall(r"#define CODEWORD(\d+) (codeword_field\d+\[\d+:\d+\])", get_codewords_p4(layout)):
+        codeword_slices[int(tree_id)] = field_bits
+    written = {}
+    for line in get_set_code_action_lines(layout):
+        match = re.match(r"\s+meta\.(codeword_field\d+)\[(\d+):(\d+)\] = code(\d+);", line)
+        if match:
+            field, high, low, tree_id = match.groups()
+            written.setdefault(int(tree_id), []).append((field, int(high), int(low)))
+    for tree_id, width in enumerate(layout["codeword_widths"]):
+        field, high, low = re.match(r"(\w+)\[(\d+):(\d+)\]", codeword_slices[tree_id]).groups()
+        # the slices of the features cover the codeword of the tree, without gaps
+        bits = sorted(bit for slice_field, slice_high, slice_low in written[tree_id] if slice_field == field
+                      for bit in range(slice_low, slice_high + 1))
+        assert bits == list(range(int(low), int(high) + 1)) and len(bits) == width
+
+def test_code_tables_match_the_codeword_slices():
+    table_keys = get_p4_table_keys(P4_FILE)
+    for tree_id in range(3):
+        field, match_type, width = table_keys["code_table"+str(tree_id)][0]
+        assert field.startswith("meta.codeword_field") and match_type == "ternary"
+    assert table_keys["voting_table"][0][1] in ("ternary", "exact")
@@ -0,0 +1,89 @@
+## Tests of the writer of the control plane pipeline against the fake switch.
+## usage: python3 -m pytest test_control_pipeline.py
+import pytest
+from control_pipeline import get_table_handles, get_pipeline_metrics, get_batch, add_records, write_batch, \
+    run_pipeline, get_flow_key
+from flow_eviction import open_flow_eviction
+from fake_switch import get_fake_client, get_fake_bfrt_info, get_fake_digest_source, install_fake_flows
+
+FLOW_TABLE = 'Ingress.flow_action_table'
+
+## a fake switch with the flows of the fake digests installed with f_action 1
+def get_switch(num_of_digests=4, records_per_digest=16):
+    bfrt_client = get_fake_client()
+    bfrt_info = get_fake_bfrt_info()
+    install_fake_flows(bfrt_client, bfrt_info, num_of_digests, records_per_digest)
+    return bfrt_client, bfrt_info
+
+## classified records of the flows with the given addresses
+def get_records(addresses, register_index=7):
+    return [{"source_addr": address, "destin_addr": 1, "source_port": 2, "destin_port": 3, "protocol": 6,
+             "flow_class": 1, "register_index": register_index, "ingress_port": 0} for address in addresses]
+
+def get_flow_action(bfrt_info, bfrt_client, address):
+    flow_table = bfrt_info.table_get(FLOW_TABLE)
+    return dict(flow_table.entries[get_flow_key(bfrt_client, flow_table, (address, 1, 3, 2, 6))])['f_action']
+
+def test_fake_table_is_strict():
+    bfrt_info = get_fake_bfrt_info()
+    table = bfrt_info.table_get(FLOW_TABLE)
+    table.entry_add(None, [(("k", 1),)], [(("f_action", 1),)])
+    with pytest.raises(RuntimeError, match="ALREADY_EXISTS"):
+        table.entry_add(None, [(("k", 1),), (("k", 2),)], [(("f_action", 1),)] * 2)
+    # the valid keys of a failed call are written
+    assert len(table.entries) == 2
+    with pytest.raises(RuntimeError, match="NOT_FOUND"):
+        table.entry_mod(None, [(("k", 3),)], [(("f_action", 0),)])
+    with pytest.raises(RuntimeError, match="NOT_FOUND"):
+        table.entry_del(None, [(("k", 3),)])
+    # every index of a register exists
+    bfrt_info.table_get('Ingress.reg_status').entry_mod(None, [(("$REGISTER_INDEX", 5),)], [(("f1", 0),)])
+
+@pytest.mark.parametrize("eviction", [False, True])
+def test_write_batch_modifies_installed_flows(eviction):
+    bfrt_client = get_fake_client()
+    bfrt_info = get_fake_bfrt_info()
+    handles = get_table_handles(bfrt_client, bfrt_info)
+    flow_table = handles["flow_action_table"]
+    data = flow_table.make_data([bfrt_client.DataTuple('f_action', 1)])
+    for address in range(10):
+        flow_table.entries[get_flow_key(bfrt_client, flow_table, (address, 1, 3, 2, 6))] = data
+    eviction = open_flow_eviction() if eviction else None
+    metrics = get_pipeline_metrics()
+    for _ in range(2):
+        batch = get_batch()
+        add_records(bfrt_client, handles, batch, get_records(range(10)), metrics)
+        write_batch(handles, None, batch, metrics, eviction)
+    assert metrics["write_errors"] == 0 and metrics["flows_added"] == 0
+    assert flow_table.calls["add"] == 0
+    assert all(get_flow_action(bfrt_info, bfrt_client, address) == 0 for address in range(10))
+    if eviction is not None:
+        # the flows are pinned once, then refreshed
+        assert eviction["added"] == 10 and eviction["refreshed"] == 10
+
+def test_write_batch_adds_absent_flows_and_resets_registers():
+    bfrt_client = get_fake_client()
+    bfrt_info = get_fake_bfrt_info()
+    handles = get_table_handles(bfrt_client, bfrt_info)
+    flow_table = handles["flow_action_table"]
+    flow_table.entries[get_flow_key(bfrt_client, flow_table, (0, 1, 3, 2, 6))] = (('f_action', 1),)
+    register = bfrt_info.table_get('Ingress.reg_status')
+    register.entries[(('$REGISTER_INDEX', 7),)] = (('Ingress.reg_status.f1', 1),)
+    eviction = open_flow_eviction()
+    metrics = get_pipeline_metrics()
+    batch = get_batch()
+    add_records(bfrt_client, handles, batch, get_records([0, 1]), metrics)
+    write_batch(handles, None, batch, metrics, eviction)
+    assert metrics["write_errors"] == 0 and metrics["flows_added"] == 1
+    assert len(flow_table.entries) == 2 and len(eviction["entries"]) == 2
+    assert register.entries[(('$REGISTER_INDEX', 7),)] == (('Ingress.reg_status.f1', 0),)
+
+def test_pipeline_on_fake_switch_without_write_errors():
+    bfrt_client, bfrt_info = get_switch()
+    interface, learn_filter = get_fake_digest_source(4, records_per_digest=16, interval=0.0)
+    eviction = open_flow_eviction()
+    metrics = run_pipeline(bfrt_client, interface, bfrt_info, learn_filter, None, digest_timeout=1,
+                           eviction=eviction, report_interval=None)
+    assert metrics["records"] == 64 and metrics["write_errors"] == 0 and metrics["flows_added"] == 0
+    flow_actions = [dict(data)['f_action'] for data in bfrt_info.table_get(FLOW_TABLE).entries.values()]
+    assert flow_actions.count(0) == metrics["classified"] == len(eviction["entries"])
@@ -0,0 +1,139 @@
+## Tests of the sharded control plane against fake switches of 4 pipes.
+## usage: python3 -m pytest test_control_shards.py
+import zlib
+import queue
+import threading
+from types import SimpleNamespace
+from control_shards import get_port_pipe, split_digests, run_switch, run_switches, get_merged_snapshot, NUM_OF_PIPES
+from control_pipeline import get_flow_key
+from bfrt_session import connect_switch
+from fake_switch import get_fake_session, get_fake_digests, NUM_OF_PIPES as FAKE_PIPES
+
+FLOW_TABLE = 'Ingress.flow_action_table'
+NUM_OF_DIGESTS = 6
+RECORDS_PER_DIGEST = 64
+
+## a fake digest source sending the given digests, then timing out
+def get_digest_source(digests):
+    digests = iter(digests)
+
+    def digest_get(timeout=None):
+        records = next(digests, None)
+        if records is None:
+            raise RuntimeError("digest_get timed out")
+        return records
+
+    learn_filter = SimpleNamespace(make_data_list=lambda records: [SimpleNamespace(to_dict=lambda record=record: record)
+                                                                   for record in records])
+    return SimpleNamespace(digest_get=digest_get), learn_filter
+
+## the records of a queue of a pipe, until the receiver stops
+def get_queued_records(pipe_queue):
+    records = []
+    for batch in iter(pipe_queue.get, None):
+        records += batch
+    return records
+
+## records of the digests of a fake switch (seeded by its name, see get_fake_session)
+def get_switch_records(name):
+    return [record for digest in get_fake_digests(NUM_OF_DIGESTS, RECORDS_PER_DIGEST, seed=zlib.crc32(name.encode()))
+            for record in digest]
+
+def get_flow(record):
+    return record['source_addr'], record['destin_addr'], record['destin_port'], record['source_port'], record['protocol']
+
+def is_classified(record):
+    return record['flow_class'] not in (255, 127)
+
+## run the worker of one fake switch in this process; returns its last snapshot
+## and its session
+def run_fake_switch(switch, **options):
+    sessions = []
+
+    def connect(switch):
+        sessions.append(get_fake_session(switch))
+        return sessions[-1]
+
+    snapshots = queue.Queue()
+    run_switch(dict(switch, num_of_digests=NUM_OF_DIGESTS, digest_interval=0.0),
+               dict({"connect": connect, "eviction": {}, "digest_timeout": 1.0, "report_interval": 0.1}, **options),
+               snapshots, threading.Event())
+    snapshot = None
+    while not snapshots.empty():
+        name, snapshot = snapshots.get()
+    assert snapshot["done"] and "error" not in snapshot, snapshot
+    return snapshot, sessions[0]
+
+def test_port_pipe_is_in_bits_8_7():
+    assert NUM_OF_PIPES == FAKE_PIPES
+    assert [get_port_pipe(port) for port in [0, 71, 128, 128 + 71, 256, 384 + 5, 511]] == [0, 0, 1, 1, 2, 3, 3]
+
+def test_receiver_routes_records_to_their_pipe():
+    digests = list(get_fake_digests(NUM_OF_DIGESTS, RECORDS_PER_DIGEST))
+    interface, learn_filter = get_digest_source(digests)
+    # pipe 2 is not served by this switch
+    pipe_queues = {pipe: queue.Queue() for pipe in [0, 1, 3]}
+    counters = {"digests": 0, "pipe_misses": 0}
+    split_digests(interface, learn_filter, pipe_queues, counters, None, threading.Event(), timeout=0.1)
+    records = [record for digest in digests for record in digest]
+    for pipe, pipe_queue in pipe_queues.items():
+        assert get_queued_records(pipe_queue) == [record for record in records
+                                                  if get_port_pipe(record['ingress_port']) == pipe]
+    assert counters["digests"] == NUM_OF_DIGESTS
+    assert counters["pipe_misses"] == sum(get_port_pipe(record['ingress_port']) == 2 for record in records) > 0
+
+def test_pipes_write_their_own_entries():
+    pipes = list(range(NUM_OF_PIPES))
+    snapshot, session = run_fake_switch({"name": "s0", "pipes": pipes, "pipe_scope": True})
+    bfrt_client, bfrt_info = session["bfrt_client"], session["bfrt_info"]
+    flow_table = bfrt_info.table_get(FLOW_TABLE)
+    reg_status = bfrt_info.table_get('Ingress.reg_status')
+    records = get_switch_records("s0")
+    classified = {}
+    for record in records:
+        if is_classified(record):
+            classified.setdefault(get_flow(record), set()).add(get_port_pipe(record['ingress_port']))
+    for flow, flow_pipes in classified.items():
+        key = get_flow_key(bfrt_client, flow_table, flow)
+        for pipe in pipes:
+            # f_action 0 only in the pipes of the ingress ports of the flow
+            assert dict(flow_table.entries[(pipe, key)])['f_action'] == (0 if pipe in flow_pipes else 1)
+    # the registers are reset in the pipe of the record only
+    written = {(pipe, key[0][1]) for pipe, key in reg_status.entries}
+    assert written == {(get_port_pipe(record['ingress_port']), record['register_index'])
+                       for record in records if is_classified(record)}
+    assert snapshot["write_errors"] == 0 and snapshot["pipe_misses"] == 0
+    assert snapshot["digests"] == NUM_OF_DIGESTS and snapshot["records"] == len(records)
+    assert sum(snapshot["flows_by_pipe"].values()) == snapshot["flows_written"]
+    assert all(snapshot["flows_by_pipe"][pipe] > 0 for pipe in pipes)
+
+def test_switch_without_pipes_writes_all_the_pipes_at_once():
+    snapshot, session = run_fake_switch({"name": "s1"})
+    flow_table = session["bfrt_info"].table_get(FLOW_TABLE)
+    assert not flow_table.scope["single_pipe"]
+    assert all(not isinstance(key[0], int) for key in flow_table.entries)
+    assert snapshot["write_errors"] == 0 and "flows_by_pipe" not in snapshot
+    flow_actions = [dict(data)['f_action'] for data in flow_table.entries.values()]
+    assert flow_actions.count(0) == len({get_flow(record) for record in get_switch_records("s1") if is_classified(record)})
+
+def test_pipes_without_pipe_scope_are_refused():
+    # the tables are symmetric unless installed with --pipes: the switch is not connected
+    snapshots = queue.Queue()
+    run_switch({"name": "s2", "grpc_addr": "127.0.0.1:1", "pipes": [0, 1]}, {"connect": connect_switch}, snapshots,
+               threading.Event())
+    name, snapshot = snapshots.get_nowait()
+    assert name == "s2" and snapshot["done"] and "pipe_scope" in snapshot["error"]
+
+def test_metrics_of_the_switches_are_merged():
+    switches = [{"name": name, "pipes": list(range(NUM_OF_PIPES)), "pipe_scope": True,
+                 "num_of_digests": NUM_OF_DIGESTS, "digest_interval": 0.0} for name in ["edge-1", "edge-2"]]
+    merged = run_switches(switches, {"connect": get_fake_session, "eviction": {}, "digest_timeout": 1.0,
+                                     "report_interval": 0.1})
+    snapshots = merged["switches"]
+    assert set(snapshots) == {"edge_1", "edge_2"}
+    assert all("error" not in snapshot for snapshot in snapshots.values())
+    for name in ["digests", "records", "classified", "flows_written", "write_errors", "pipe_misses"]:
+        assert merged[name] == sum(snapshot[name] for snapshot in snapshots.values())
+    assert merged["digests"] == 2 * NUM_OF_DIGESTS and merged["write_errors"] == 0
+    assert "flows_by_pipe" not in merged
+    assert get_merged_snapshot(snapshots)["records"] == merged["records"]
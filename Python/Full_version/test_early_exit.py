@@ -0,0 +1,79 @@
+## Tests of the early exit: packets 1, 2 and 3 of seeded flows go through the
+## emulated tables of the phases and the model of the 3rd packet, then through
+## the digest logic of the ingress.
+## usage: python3 -m pytest test_early_exit.py
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from early_exit import fit_phase_models, compile_phase, get_phase_tables, check_phase, get_phase_suffix
+from pipeline_emulator import get_emulator, emulate_pipeline
+from budget_pruning import get_switch_features, get_switch_classes, get_voting_tables
+from flow_register_simulator import get_inference_digests
+
+FEATURE_NAMES = ["f0", "f1", "f2"]
+FEATURE_WIDTHS = [16, 16, 16]
+CLASSES = ["a", "b", "c"]
+
+## features of the flows after packets 1, 2 and 3: the class shows more and more
+## in the features, some flows are already clear at the 1st packet
+def get_flows(num_of_flows=1200, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, len(CLASSES), num_of_flows)
+    centers = labels[:, None] * 1000 + np.array([0, 200, 400])
+    features = {}
+    for packets, noise in [(1, 1500), (2, 900), (3, 300)]:
+        # half of the flows show their class from the 1st packet
+        spread = np.where(np.arange(num_of_flows)[:, None] % 2 == 0, 100, noise)
+        values = centers + rng.normal(0, 1, (num_of_flows, len(FEATURE_NAMES))) * spread
+        features[packets] = pd.DataFrame(np.clip(values, 0, 65535).astype(np.int64), columns=FEATURE_NAMES)
+    return features, np.array(CLASSES)[labels]
+
+## final_class of every flow at packets 1, 2 (emulated tables of the phases) and 3
+def get_packet_classes(certainty=90):
+    features, y = get_flows()
+    clf = RandomForestClassifier(n_estimators=3, max_depth=5, random_state=0).fit(features[3], y)
+    phase_models = fit_phase_models(clf, {packets: (features[packets], y) for packets in (1, 2)})
+    packet_classes = []
+    for packets in (1, 2):
+        phase = compile_phase(None, phase_models[packets], FEATURE_NAMES, packets, certainty, FEATURE_WIDTHS)
+        phase["tables"] = get_phase_tables(phase, len(CLASSES), FEATURE_WIDTHS)
+        # the tables of the phase are the early exits of its model
+        assert check_phase(phase, FEATURE_WIDTHS, features[packets].values) == 0
+        suffix = get_phase_suffix(packets)
+        tables = [dict(table, table=table["table"][:-len(suffix)]) for table in phase["tables"]]
+        emulator = get_emulator(tables, phase["layout"], FEATURE_WIDTHS)
+        packet_classes.append(emulate_pipeline(emulator, features[packets].values)[0])
+    final = get_switch_classes(clf, get_switch_features(features[3], FEATURE_WIDTHS),
+                               get_voting_tables(len(clf.estimators_), len(CLASSES)))
+    packet_classes.append(np.searchsorted(clf.classes_, final) + 1)
+    return np.stack(packet_classes, axis=1)
+
+@pytest.mark.parametrize("packet_classes, digests, flags", [
+    ([0, 0, 2], [(3, 2)], [0, 0, 2]),
+    # a class 0 vote at the 3rd packet (voting table miss) is digested too
+    ([0, 0, 0], [(3, 0)], [0, 0, 0]),
+    # an early class is digested once and kept, whatever the next packets vote
+    ([2, 0, 3], [(1, 2)], [2, 2, 2]),
+    ([2, 1, 1], [(1, 2)], [2, 2, 2]),
+    ([0, 1, 3], [(2, 1)], [0, 1, 1]),
+])
+def test_digest_logic_of_a_flow(packet_classes, digests, flags):
+    assert get_inference_digests(packet_classes) == (digests, flags)
+
+def test_one_digest_per_flow_with_early_exits():
+    packet_classes = get_packet_classes()
+    early = np.where(packet_classes[:, 0] != 0, packet_classes[:, 0], packet_classes[:, 1])
+    # flows leave at packet 1, at packet 2 and at packet 3
+    assert (packet_classes[:, 0] != 0).sum() > 0
+    assert ((packet_classes[:, 0] == 0) & (packet_classes[:, 1] != 0)).sum() > 0
+    assert (early == 0).sum() > 0
+    for classes, early_class in zip(packet_classes.tolist(), early.tolist()):
+        digests, flags = get_inference_digests(classes)
+        assert len(digests) == 1
+        if early_class:
+            # the class of the early exit is the class of the flow until its registers are reset
+            assert digests[0][1] == early_class and digests[0][0] < 3
+            assert flags[-1] == early_class
+        else:
+            assert digests[0] == (3, classes[2])
@@ -0,0 +1,35 @@
+## Tests of the simulation of the flow registers.
+## usage: python3 -m pytest test_flow_register_simulator.py
+import pandas as pd
+from flow_register_simulator import simulate_registers, PACKET_COLUMNS
+
+## packets of the flows {src_addr: packet times in ms}, in one chunk
+def get_trace(flow_times):
+    rows = [(int(time * 10**6), src_addr, 1, 2, 3, 6) for src_addr, times in flow_times.items() for time in times]
+    return [pd.DataFrame(rows, columns=PACKET_COLUMNS)]
+
+def test_controller_resets_the_slot_of_a_classified_flow():
+    # 6 packets of one flow, 1 ms apart: classified at the 3rd, reset 1.5 ms later
+    trace = get_trace({10: range(6)})
+    report = simulate_registers(trace, 1, 512, controller_delay=0.0015)
+    assert report["classifications"] == 1
+    # the 4th packet still updates the registers, the 5th and 6th bypass them
+    assert report["bypass_rate"] == 2 / 6
+
+def test_without_controller_the_slot_stays_owned():
+    # a second flow in the single slot after the classification of the first one
+    trace = get_trace({10: range(4), 11: [10, 11, 12]})
+    report = simulate_registers(trace, 0, 512, controller_delay=None)
+    assert report["bypass_rate"] == 0 and report["collision_rate"] == 3 / 7
+    report = simulate_registers(trace, 0, 512, controller_delay=0.001)
+    assert report["collision_rate"] == 0 and report["classifications"] == 2
+
+def test_chunks_keep_the_state_of_the_slots():
+    flow_times = {src_addr: [src_addr * 0.7 + packet * 1.3 for packet in range(5)] for src_addr in range(40)}
+    packets = get_trace(flow_times)[0].sort_values("timestamp", kind="stable")
+    whole = simulate_registers([packets], 4, 4, controller_delay=0.002)
+    chunks = [packets.iloc[start:start+7] for start in range(0, len(packets), 7)]
+    chunked = simulate_registers(chunks, 4, 4, controller_delay=0.002)
+    assert whole["collision_rate"] > 0 and whole["classifications"] > 0
+    assert {name: value for name, value in chunked.items() if name != "occupancy"} == \
+        {name: value for name, value in whole.items() if name != "occupancy"}
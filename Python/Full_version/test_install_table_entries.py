@@ -0,0 +1,87 @@
+## Tests of the installation and update of the table entries on the fake switch.
+## usage: python3 -m pytest test_install_table_entries.py
+import pytest
+import numpy as np
+from entries_artifact import get_flow_action_table_entries, get_voting_table_entries, make_table, save_entries, \
+    load_entries
+from voting_compiler import get_ternary_voting_entries, count_voting_entries
+from install_table_entries import install_entries
+from model_update import diff_entries, apply_operations
+from bfrt_session import PIPE_SCOPE_TABLES
+from fake_switch import get_fake_client, get_fake_bfrt_info
+
+PIPES = [0, 1, 2, 3]
+
+def get_flow_table(num_of_flows, f_action=1):
+    flows = range(num_of_flows)
+    return get_flow_action_table_entries(list(flows), [1] * num_of_flows, [2] * num_of_flows, [3] * num_of_flows,
+                                         [6] * num_of_flows, [f_action] * num_of_flows)
+
+def get_tables(num_of_flows=10):
+    return [get_voting_table_entries(get_ternary_voting_entries(3, 2), 3), get_flow_table(num_of_flows)]
+
+## a feature table (range keys) and a code table (ternary keys) of one tree
+def get_model_tables():
+    return [make_table("Ingress.table_feature0", "Ingress.SetCode0", [("feature0", "range")], ["code0"],
+                       {"feature0_start": [0, 100, 200], "feature0_end": [99, 199, 65535], "code0": [0, 1, 3]}),
+            make_table("Ingress.code_table0", "Ingress.SetClass0", [("meta.codeword0", "ternary")], ["classe", "cert"],
+                       {"meta.codeword0": [0, 1, 3], "meta.codeword0_mask": [3, 3, 3], "classe": [1, 2, 2],
+                        "cert": [9, 8, 10]})]
+
+## a fake switch with the tables of bfrt_session.PIPE_SCOPE_TABLES asymmetric
+def get_asymmetric_switch():
+    bfrt_client = get_fake_client()
+    bfrt_info = get_fake_bfrt_info()
+    for name in PIPE_SCOPE_TABLES:
+        bfrt_info.table_get(name).attribute_entry_scope_set(None)
+    return bfrt_client, bfrt_info
+
+def test_install_the_entries_of_an_artifact(tmp_path):
+    save_entries(str(tmp_path / "entries.npz"), get_model_tables() + get_tables(100))
+    tables = load_entries(str(tmp_path / "entries.npz"))
+    bfrt_client = get_fake_client()
+    bfrt_info = get_fake_bfrt_info()
+    target = bfrt_client.Target(device_id=0, pipe_id=0xffff)
+    total_entries, elapsed = install_entries(bfrt_client, bfrt_info, target, tables, batch_size=32)
+    counts = {name: len(table.entries) for name, table in bfrt_info.tables.items()}
+    assert counts == {"Ingress.table_feature0": 3, "Ingress.code_table0": 3,
+                      "Ingress.voting_table": count_voting_entries(3, 2), "Ingress.flow_action_table": 100}
+    assert total_entries == sum(counts.values()) and elapsed > 0
+    # 100 flows in batches of 32
+    assert bfrt_info.table_get('Ingress.flow_action_table').calls["add"] == 4
+    flow_table = bfrt_info.table_get('Ingress.flow_action_table')
+    assert set(dict(data)["f_action"] for data in flow_table.entries.values()) == {1}
+    assert np.array_equal(sorted(dict(key)["hdr.ipv4.src_addr"] for key in flow_table.entries), np.arange(100))
+
+def test_reinstall_clears_the_tables_first():
+    bfrt_client = get_fake_client()
+    bfrt_info = get_fake_bfrt_info()
+    target = bfrt_client.Target(device_id=0, pipe_id=0xffff)
+    install_entries(bfrt_client, bfrt_info, target, get_model_tables())
+    install_entries(bfrt_client, bfrt_info, target, get_model_tables())
+    assert len(bfrt_info.table_get("Ingress.table_feature0").entries) == 3
+    # without clearing, the entries already installed are rejected
+    with pytest.raises(RuntimeError, match="ALREADY_EXISTS"):
+        install_entries(bfrt_client, bfrt_info, target, get_model_tables(), clear=False)
+
+def test_install_in_every_pipe_of_the_asymmetric_tables():
+    bfrt_client, bfrt_info = get_asymmetric_switch()
+    target = bfrt_client.Target(device_id=0, pipe_id=0xffff)
+    install_entries(bfrt_client, bfrt_info, target, get_tables(), pipes=PIPES)
+    flow_entries = bfrt_info.table_get('Ingress.flow_action_table').entries
+    assert sorted(set(pipe for pipe, key in flow_entries)) == PIPES and len(flow_entries) == 10 * len(PIPES)
+    # the symmetric tables are written once in all the pipes
+    assert len(bfrt_info.table_get('Ingress.voting_table').entries) == count_voting_entries(3, 2)
+
+def test_install_in_all_pipes_fails_on_asymmetric_tables():
+    bfrt_client, bfrt_info = get_asymmetric_switch()
+    with pytest.raises(RuntimeError, match="asymmetric"):
+        install_entries(bfrt_client, bfrt_info, bfrt_client.Target(device_id=0, pipe_id=0xffff), get_tables())
+
+def test_update_in_every_pipe_of_the_asymmetric_tables():
+    bfrt_client, bfrt_info = get_asymmetric_switch()
+    target = bfrt_client.Target(device_id=0, pipe_id=0xffff)
+    old_tables = get_tables(10)
+    install_entries(bfrt_client, bfrt_info, target, old_tables, pipes=PIPES)
+    apply_operations(bfrt_client, bfrt_info, target, diff_entries(old_tables, get_tables(12))[0], pipes=PIPES)
+    assert len(bfrt_info.table_get('Ingress.flow_action_table').entries) == 12 * len(PIPES)
@@ -0,0 +1,100 @@
+## Tests of the order of the operations of the differential model update, and of
+## the model seen by the packets while the update is applied on the fake switch.
+## usage: python3 -m pytest test_model_update.py
+from entries_artifact import make_table, get_num_of_entries, get_model_version_columns, MODEL_VERSION_FIELD
+from install_table_entries import install_entries
+from model_update import diff_entries, apply_operations, MODEL_VERSION_REGISTER
+from fake_switch import get_fake_client, get_fake_bfrt_info
+
+def get_feature_table(fea, starts, codes):
+    ends = starts[1:] + [65535]
+    columns = {"feature"+str(fea)+"_start": [start for start in starts], "feature"+str(fea)+"_end": ends}
+    columns.update(get_model_version_columns(len(starts)))
+    columns.update({"code"+str(tree_id): tree_codes for tree_id, tree_codes in codes.items()})
+    return make_table("Ingress.table_feature"+str(fea), "Ingress.SetCode"+str(fea),
+                      [("feature"+str(fea), "range"), (MODEL_VERSION_FIELD, "ternary")],
+                      ["code"+str(tree_id) for tree_id in codes], columns)
+
+def get_code_table(tree_id, codes, classes):
+    field = "meta.codeword"+str(tree_id)
+    columns = {field: codes, field+"_mask": [3] * len(codes), "classe": classes, "cert": [0] * len(codes)}
+    columns.update(get_model_version_columns(len(codes)))
+    return make_table("Ingress.code_table"+str(tree_id), "Ingress.SetClass"+str(tree_id),
+                      [(field, "ternary"), (MODEL_VERSION_FIELD, "ternary")], ["classe", "cert"], columns)
+
+## feature0 gets a new split for tree 0; tree 1 only has a slice in feature1,
+## which does not change, and gets a new leaf class
+def get_models():
+    old_tables = [get_feature_table(0, [0, 100], {0: [0, 1]}), get_feature_table(1, [0, 50], {1: [0, 1]}),
+                  get_code_table(0, [0, 1], [1, 2]), get_code_table(1, [0, 1], [1, 2])]
+    new_tables = [get_feature_table(0, [0, 80], {0: [0, 1]}), get_feature_table(1, [0, 50], {1: [0, 1]}),
+                  get_code_table(0, [0, 1], [1, 2]), get_code_table(1, [0, 1], [1, 3])]
+    return old_tables, new_tables
+
+def get_operations(old_tables, new_tables):
+    return [(operation, table["table"], get_num_of_entries(table)) for operation, table in diff_entries(old_tables, new_tables)[0]]
+
+## entries (key without the generation, data) of a fake table matched by the packets of a generation
+def get_live_entries(table, version):
+    live = set()
+    for key, data in table.entries.items():
+        field, value, mask = [key_tuple for key_tuple in key if key_tuple[0] == MODEL_VERSION_FIELD][0][:3]
+        if version & mask == value & mask:
+            live.add((tuple(key_tuple for key_tuple in key if key_tuple[0] != MODEL_VERSION_FIELD), data))
+    return live
+
+## generation read by the packets, 0 until reg_model_version is written
+def get_installed_version(bfrt_info):
+    data = bfrt_info.table_get(MODEL_VERSION_REGISTER).entries.get((("$REGISTER_INDEX", 0),))
+    return dict(data)[MODEL_VERSION_REGISTER+".f1"] if data else 0
+
+## the entries of the tables of a model, as seen by the packets of a generation
+def get_model_entries(bfrt_client, tables, version=0):
+    bfrt_info = get_fake_bfrt_info()
+    install_entries(bfrt_client, bfrt_info, bfrt_client.Target(device_id=0, pipe_id=0xffff), tables)
+    return {table["table"]: get_live_entries(bfrt_info.table_get(table["table"]), version) for table in tables}
+
+## apply the update operation by operation; after every operation the packets see
+## all the tables of one model, the old one until the generation is flipped
+def check_update(bfrt_client, bfrt_info, old_tables, new_tables):
+    target = bfrt_client.Target(device_id=0, pipe_id=0xffff)
+    version = get_installed_version(bfrt_info)
+    old_entries = get_model_entries(bfrt_client, old_tables, version)
+    new_entries = get_model_entries(bfrt_client, new_tables)
+    operations, installed = diff_entries(old_tables, new_tables)
+    for operation in operations:
+        apply_operations(bfrt_client, bfrt_info, target, [operation])
+        live_version = get_installed_version(bfrt_info)
+        expected = old_entries if live_version == version else new_entries
+        assert {name: get_live_entries(bfrt_info.table_get(name), live_version) for name in expected} == expected
+    assert get_installed_version(bfrt_info) == 1 - version
+    # the installed artifact is the state of the switch
+    assert get_model_entries(bfrt_client, installed, 1 - version) == new_entries
+    for table in installed:
+        assert len(bfrt_info.table_get(table["table"]).entries) == get_num_of_entries(table)
+    return installed
+
+def test_new_generation_is_installed_before_the_flip():
+    old_tables, new_tables = get_models()
+    assert get_operations(old_tables, new_tables) == [
+        # the ranges of feature0 and the leaf of tree 1 that change are restricted to generation 0
+        ("add", "Ingress.table_feature0", 2), ("delete", "Ingress.table_feature0", 2),
+        ("add", "Ingress.code_table1", 1), ("delete", "Ingress.code_table1", 1),
+        # the new entries are added under generation 1
+        ("add", "Ingress.table_feature0", 2), ("add", "Ingress.code_table1", 1),
+        ("modify", MODEL_VERSION_REGISTER, 1),
+        ("delete", "Ingress.table_feature0", 2), ("delete", "Ingress.code_table1", 1)]
+
+def test_packets_see_one_model_during_the_update():
+    old_tables, new_tables = get_models()
+    bfrt_client = get_fake_client()
+    bfrt_info = get_fake_bfrt_info()
+    install_entries(bfrt_client, bfrt_info, bfrt_client.Target(device_id=0, pipe_id=0xffff), old_tables)
+    installed = check_update(bfrt_client, bfrt_info, old_tables, new_tables)
+    # back to the old model from the installed artifact: generation 1 to 0
+    installed = check_update(bfrt_client, bfrt_info, installed, old_tables)
+    assert get_operations(installed, old_tables) == []
+
+def test_same_model_has_no_operations():
+    tables = [get_feature_table(0, [0, 100], {0: [0, 1]}), get_code_table(0, [0, 1], [1, 2])]
+    assert get_operations(tables, tables) == []
@@ -0,0 +1,45 @@
+## Tests of the chunked pcap reader against packets written to a pcap file.
+## usage: python3 -m pytest test_pcap_reader.py
+import struct
+import numpy as np
+import pytest
+from pcap_reader import read_pcap_chunks, LINKTYPE_ETHERNET
+
+## an Ethernet frame (with VLAN tags) of an IPv4 packet, TCP or UDP with ports
+def get_frame(src_addr, dst_addr, src_port, dst_port, protocol, total_len, ack_flag=0, vlan_tags=0):
+    ip = bytes([0x45, 0]) + struct.pack("!H", total_len) + bytes(5) + bytes([protocol]) + bytes(2) + \
+        struct.pack("!II", src_addr, dst_addr)
+    transport = struct.pack("!HH", src_port, dst_port) + bytes(9) + bytes([ack_flag << 4]) + bytes(6)
+    return bytes(12) + b"\x81\x00\x00\x01" * vlan_tags + b"\x08\x00" + ip + transport
+
+## pcap file of the given frames, one every microsecond
+def write_pcap(path, frames, endian="<", link_type=LINKTYPE_ETHERNET):
+    records = [struct.pack(endian+"IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, link_type)]
+    for packet, frame in enumerate(frames):
+        records.append(struct.pack(endian+"IIII", 1, packet, len(frame), len(frame)) + frame)
+    with open(path, "wb") as pcap:
+        pcap.write(b"".join(records))
+
+def read_columns(path, chunk_bytes):
+    chunks = list(read_pcap_chunks(str(path), chunk_bytes))
+    return {column: np.concatenate([chunk[column] for chunk in chunks]) for column in chunks[0]}
+
+@pytest.mark.parametrize("endian", ["<", ">"])
+def test_chunks_parse_every_record(tmp_path, endian):
+    frames = [get_frame(0x0a000001 + packet, 0x0a000100, 1000 + packet, 80, 6 if packet % 2 else 17, 60 + packet,
+                        packet % 2, packet % 3) for packet in range(50)]
+    # an IPv6 frame is skipped
+    frames.insert(10, bytes(12) + b"\x86\xdd" + bytes(40))
+    write_pcap(tmp_path / "trace.pcap", frames, endian)
+    packets = read_columns(tmp_path / "trace.pcap", 1 << 20)
+    assert len(packets["timestamp"]) == 50
+    assert list(packets["timestamp"][:3]) == [10**9, 10**9 + 1000, 10**9 + 2000]
+    assert list(packets["src_addr"]) == [0x0a000001 + packet for packet in range(50)]
+    assert list(packets["src_port"]) == [1000 + packet for packet in range(50)]
+    assert list(packets["protocol"]) == [6 if packet % 2 else 17 for packet in range(50)]
+    assert list(packets["total_len"]) == [60 + packet for packet in range(50)]
+    assert list(packets["ack_flag"]) == [packet % 2 for packet in range(50)]
+    # records split across chunks are parsed once, with the next chunk
+    for chunk_bytes in [7, 100, 1000]:
+        chunked = read_columns(tmp_path / "trace.pcap", chunk_bytes)
+        assert all(np.array_equal(chunked[column], packets[column]) for column in packets)
@@ -0,0 +1,34 @@
+## Tests of the register sweeper on the fake switch.
+## usage: python3 -m pytest test_register_sweeper.py
+from control_pipeline import get_table_handles
+from register_sweeper import open_register_sweeper, sweep_registers, STATUS_REGISTER, TIME_REGISTER
+from fake_switch import get_fake_client, get_fake_bfrt_info
+
+## a fake switch with the slots in use at the given timestamps
+def get_switch(slot_times):
+    bfrt_client = get_fake_client()
+    handles = get_table_handles(bfrt_client, get_fake_bfrt_info())
+    for index, timestamp in slot_times.items():
+        key = (('$REGISTER_INDEX', index),)
+        handles["registers"][STATUS_REGISTER].entries[key] = ((STATUS_REGISTER+'.f1', 1),)
+        handles["registers"][TIME_REGISTER].entries[key] = ((TIME_REGISTER+'.f1', timestamp),)
+    return bfrt_client, handles
+
+def get_status(handles, index):
+    return handles["registers"][STATUS_REGISTER].entries[(('$REGISTER_INDEX', index),)][0][1]
+
+def test_stale_slots_are_reset_chunk_by_chunk():
+    bfrt_client, handles = get_switch({3: 10000, 5: 100, 40: 200, 70: 9990})
+    sweeper = open_register_sweeper(num_of_slots=80, timeout=512, margin=512, chunk_size=32)
+    stale = sweep_registers(bfrt_client, handles, None, sweeper)
+    assert stale.tolist() == [5, 40]
+    assert [get_status(handles, index) for index in (3, 5, 40, 70)] == [1, 0, 0, 1]
+    # one reset per register for each of the two chunks with stale slots
+    assert handles["registers"][STATUS_REGISTER].calls["mod"] == 2
+    assert sweeper["slots_read"] == 80 and sweeper["slots_reset"] == 2 and sweeper["chunks_skipped"] == 0
+
+def test_chunks_read_slower_than_the_margin_are_not_reset():
+    bfrt_client, handles = get_switch({3: 10000, 5: 100})
+    sweeper = open_register_sweeper(num_of_slots=32, timeout=512, margin=0, chunk_size=32)
+    assert len(sweep_registers(bfrt_client, handles, None, sweeper)) == 0
+    assert get_status(handles, 5) == 1 and sweeper["chunks_skipped"] == 1
@@ -0,0 +1,239 @@
+## Regression tests of the table entry compiler against the per-split pandas
+## implementation it replaced (the baseline generate_table_entries_from_RF.py,
+## kept below as the reference) on small seeded forests, and exhaustive checks
+## of the TCAM expansion of the feature tables.
+## usage: python3 -m pytest test_rf_compiler.py
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from rf_compiler import compile_feature_tables, get_feature_codes_with_ranges, get_feature_ranges, get_leaves, \
+    get_classes, get_leaf_paths, get_codes_and_masks, format_bits, bits_to_ints
+from tcam_expansion import range_to_prefixes, get_ternary_entries, get_feature_ternary_entries, \
+    merge_adjacent_ranges
+
+FEATURE_NAMES = ["f0", "f1", "f2", "f3"]
+
+## forest of n_trees trees on seeded random flows of num_of_classes classes,
+## with every feature used by some split
+def get_forest(n_trees, num_of_classes, max_depth=5, seed=0):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.integers(0, 1000, (600, len(FEATURE_NAMES))), columns=FEATURE_NAMES)
+    y = (X["f0"] // 100 + X["f1"] // 250 + X["f2"] // 400 + X["f3"] // 500) % num_of_classes
+    forest = RandomForestClassifier(n_estimators=n_trees, max_depth=max_depth, random_state=seed).fit(X, y)
+    used = set(np.concatenate([tree.tree_.feature[tree.tree_.feature >= 0] for tree in forest.estimators_]))
+    assert used == set(range(len(FEATURE_NAMES)))
+    return forest
+
+## reference: the per-split pandas implementation of the baseline generator
+
+def baseline_get_splits(forest, feature_names):
+    data = []
+    for t in range(len(forest.estimators_)):
+        clf = forest[t]
+        features = [feature_names[i] for i in clf.tree_.feature]
+        for i in range(clf.tree_.node_count):
+            threshold = clf.tree_.threshold[i]
+            if threshold != -2.0:
+                data.append([t, i, clf.tree_.children_left[i], clf.tree_.children_right[i], threshold, features[i]])
+    data = pd.DataFrame(data)
+    data.columns = ["Tree", "NodeID", "LeftID", "RightID", "Threshold", "Feature"]
+    return data
+
+def baseline_get_feature_table(splits_data, feature_name):
+    feature_data = splits_data[splits_data["Feature"] == feature_name]
+    feature_data = feature_data.sort_values(by="Threshold")
+    feature_data = feature_data.reset_index(drop=True)
+    feature_data["Threshold"] = feature_data["Threshold"].astype(int)
+    code_table = pd.DataFrame()
+    code_table["Threshold"] = feature_data["Threshold"]
+    for tree_id, node in zip(list(feature_data["Tree"]), list(feature_data["NodeID"])):
+        colname = "s"+str(tree_id)+"_"+str(node)
+        code_table[colname] = np.where((code_table["Threshold"] <=
+                                        feature_data[(feature_data["NodeID"] == node) &
+                                                     (feature_data["Tree"] == tree_id)]["Threshold"].values[0]), 0, 1)
+    temp = [max(code_table["Threshold"])+1]
+    temp.extend(list([1]*(len(code_table.columns)-1)))
+    code_table.loc[len(code_table)] = temp
+    code_table = code_table.drop_duplicates(subset=['Threshold'])
+    code_table = code_table.reset_index(drop=True)
+    return code_table
+
+def baseline_get_feature_codes_with_ranges(feature_table, num_of_trees):
+    Codes = pd.DataFrame()
+    for tree_id in range(num_of_trees):
+        colname = "code"+str(tree_id)
+        Codes[colname] = feature_table[feature_table[[col for col in feature_table.columns if ('s'+str(tree_id)+'_') in col]].columns[0:]].apply(lambda x: ''.join(x.dropna().astype(str)), axis=1)
+        Codes[colname] = ["0b" + x for x in Codes[colname]]
+    feature_table["Range"] = [0]*len(feature_table)
+    feature_table["Range"].loc[0] = "0,"+str(feature_table["Threshold"].loc[0])
+    for i in range(1, len(feature_table)):
+        if (i == (len(feature_table))-1):
+            feature_table["Range"].loc[i] = str(feature_table["Threshold"].loc[i])+","+str(feature_table["Threshold"].loc[i])
+        else:
+            feature_table["Range"].loc[i] = str(feature_table["Threshold"].loc[i-1]+1) + ","+str(feature_table["Threshold"].loc[i])
+    Ranges = feature_table["Range"]
+    return Ranges, Codes
+
+def baseline_retrieve_branches(estimator):
+    children_left_list = estimator.tree_.children_left
+    children_right_list = estimator.tree_.children_right
+    is_leaves_list = [(False if cl != cr else True) for cl, cr in zip(children_left_list, children_right_list)]
+    paths = []
+    for i in range(estimator.tree_.node_count):
+        if is_leaves_list[i]:
+            end_node = [path[-1] for path in paths]
+            if i in end_node:
+                yield paths.pop(np.argwhere(i == np.array(end_node))[0][0])
+        else:
+            origin, end_l, end_r = i, children_left_list[i], children_right_list[i]
+            for index, path in enumerate(paths):
+                if origin == path[-1]:
+                    paths[index] = path + [end_l]
+                    paths.append(path + [end_r])
+            if i == 0:
+                paths.append([i, children_left_list[i]])
+                paths.append([i, children_right_list[i]])
+
+def baseline_get_classes(clf):
+    classes = []
+    certainties = []
+    for branch in list(baseline_retrieve_branches(clf)):
+        leaf = branch[-1]
+        value = clf.tree_.value[leaf][0] if clf.tree_.n_outputs == 1 else clf.tree_.value[leaf].T[0]
+        classes.append(np.argmax(value))
+        certainties.append(int(round(max(value)/sum(value), 2)*100))
+    return classes, certainties
+
+def baseline_get_leaf_paths(clf):
+    branch_codes = []
+    for branch in list(baseline_retrieve_branches(clf)):
+        code = [0]*len(branch)
+        for i in range(1, len(branch)):
+            if (branch[i] == clf.tree_.children_left[branch[i-1]]):
+                code[i] = 0
+            elif (branch[i] == clf.tree_.children_right[branch[i-1]]):
+                code[i] = 1
+        branch_codes.append(list(code[1:]))
+    return branch_codes
+
+def baseline_get_order_of_splits(data, feature_names):
+    splits_order = []
+    for feature_name in feature_names:
+        feature_data = data[data.iloc[:, 4] == feature_name]
+        feature_data = feature_data.sort_values(by="Threshold")
+        for node in list(feature_data.iloc[:, 0]):
+            splits_order.append(node)
+    return splits_order
+
+def baseline_get_splits_per_tree(clf, feature_names):
+    data = []
+    features = [feature_names[i] for i in clf.tree_.feature]
+    for i in range(clf.tree_.node_count):
+        threshold = clf.tree_.threshold[i]
+        if threshold != -2.0:
+            data.append([i, clf.tree_.children_left[i], clf.tree_.children_right[i], threshold, features[i]])
+    data = pd.DataFrame(data)
+    data.columns = ["NodeID", "LeftID", "RightID", "Threshold", "Feature"]
+    return data
+
+def baseline_get_codes_and_masks(clf, feature_names):
+    splits = baseline_get_order_of_splits(baseline_get_splits_per_tree(clf, feature_names), feature_names)
+    codes = []
+    masks = []
+    for branch in list(baseline_retrieve_branches(clf)):
+        masks.append([1 if split in branch else 0 for split in splits])
+        codes.append([0]*len(splits))
+    masks = pd.DataFrame(masks)
+    masks['Mask'] = masks[masks.columns[0:]].apply(lambda x: ''.join(x.dropna().astype(str)), axis=1)
+    masks = ["0b" + x for x in masks['Mask']]
+    temp = pd.DataFrame(columns=["split", "index"], dtype=object)
+    temp["split"] = splits
+    temp["index"] = range(0, len(splits))
+    final_codes = []
+    for branch, code, coded in zip(list(baseline_retrieve_branches(clf)), codes, baseline_get_leaf_paths(clf)):
+        indices_to_use = temp[temp["split"].isin(branch)].sort_values(by="split")["index"]
+        for i, j in zip(range(0, len(coded)), list(indices_to_use)):
+            code[j] = coded[i]
+        final_codes.append(code)
+    final_codes = pd.DataFrame(final_codes)
+    final_codes["Code"] = final_codes[final_codes.columns[0:]].apply(lambda x: ''.join(x.dropna().astype(str)), axis=1)
+    final_codes = ["0b" + x for x in final_codes["Code"]]
+    return final_codes, masks
+
+## end of the reference
+
+@pytest.mark.parametrize("n_trees, num_of_classes, seed", [(1, 2, 0), (3, 2, 1), (3, 5, 2), (12, 3, 3)])
+def test_feature_tables_match_the_baseline(n_trees, num_of_classes, seed):
+    forest = get_forest(n_trees, num_of_classes, seed=seed)
+    with warnings.catch_warnings(), pd.option_context("mode.chained_assignment", None):
+        warnings.simplefilter("ignore")
+        splits = baseline_get_splits(forest, FEATURE_NAMES)
+        expected = [baseline_get_feature_codes_with_ranges(baseline_get_feature_table(splits, feature_name), n_trees)
+                    for feature_name in FEATURE_NAMES]
+    for feature_table, (ranges, codes) in zip(compile_feature_tables(forest, FEATURE_NAMES), expected):
+        new_ranges, new_codes = get_feature_codes_with_ranges(feature_table, n_trees)
+        # the same strings, byte for byte
+        assert list(new_ranges) == list(ranges)
+        assert list(new_codes.columns) == list(codes.columns)
+        assert all(list(new_codes[column]) == list(codes[column]) for column in codes.columns)
+
+@pytest.mark.parametrize("n_trees, num_of_classes, seed", [(1, 2, 0), (2, 7, 1), (5, 3, 2), (12, 16, 3)])
+def test_leaves_match_the_baseline(n_trees, num_of_classes, seed):
+    forest = get_forest(n_trees, num_of_classes, max_depth=6, seed=seed)
+    for tree in forest.estimators_:
+        leaves = get_leaves(tree, FEATURE_NAMES)
+        width = int(np.count_nonzero(tree.tree_.threshold != -2.0))
+        codes, masks = baseline_get_codes_and_masks(tree, FEATURE_NAMES)
+        assert [format_bits(code, width) for code in leaves["Code"]] == codes
+        assert [format_bits(mask, width) for mask in leaves["Mask"]] == masks
+        assert get_leaf_paths(tree, FEATURE_NAMES) == baseline_get_leaf_paths(tree)
+        classes, certainties = get_classes(tree, FEATURE_NAMES)
+        expected_classes, expected_certainties = baseline_get_classes(tree)
+        assert classes == [int(class_name) for class_name in expected_classes]
+        assert certainties == expected_certainties
+        assert [format_bits(code, width) for code in get_codes_and_masks(tree, FEATURE_NAMES)[0]] == codes
+        assert set(leaves["Class"]) <= set(range(num_of_classes))
+
+@pytest.mark.parametrize("width", range(1, 7))
+def test_range_to_prefixes_covers_every_range_exactly(width):
+    for start in range(1 << width):
+        for end in range(start, 1 << width):
+            covered = []
+            for value, length in range_to_prefixes(start, end, width):
+                size = 1 << (width - length)
+                assert value % size == 0
+                covered.extend(range(value, value + size))
+            assert covered == list(range(start, end + 1))
+
+## label of the first entry (lowest priority value) hit by every value of the field
+def get_first_hits(entries, width):
+    entries = sorted(entries, key=lambda entry: entry[2])
+    return [next(label for value, mask, priority, label in entries if candidate & mask == value)
+            for candidate in range(1 << width)]
+
+@pytest.mark.parametrize("width", [1, 2, 3, 5, 8])
+def test_ternary_entries_match_every_value(width):
+    rng = np.random.default_rng(width)
+    for trial in range(30):
+        num_of_cuts = rng.integers(0, min(1 << width, 12))
+        starts = [0] + sorted(rng.choice(np.arange(1, 1 << width), num_of_cuts, replace=False).tolist())
+        ends = [start - 1 for start in starts[1:]] + [(1 << width) - 1]
+        labels = rng.integers(0, 3, len(starts)).tolist()
+        expected = [labels[np.searchsorted(starts, value, side="right") - 1] for value in range(1 << width)]
+        entries = get_ternary_entries(*merge_adjacent_ranges(starts, ends, labels), width)
+        assert get_first_hits(entries, width) == expected
+        # never more entries than the prefix expansion range by range
+        merged = merge_adjacent_ranges(starts, ends, labels)
+        assert len(entries) <= sum(len(range_to_prefixes(start, end, width)) for start, end in zip(*merged[:2]))
+
+def test_feature_ternary_entries_match_the_ranges():
+    forest = get_forest(3, 3, seed=4)
+    width = 10
+    for feature_table in compile_feature_tables(forest, FEATURE_NAMES):
+        starts, ends = get_feature_ranges(feature_table)
+        codes = list(zip(*[bits_to_ints(bits) for bits in feature_table["Bits"]]))
+        # the last range holds every value above the largest threshold
+        expected = [codes[min(np.searchsorted(ends, value), len(ends) - 1)] for value in range(1 << width)]
+        assert get_first_hits(get_feature_ternary_entries(feature_table, 3, width), width) == expected
@@ -0,0 +1,34 @@
+## Tests of the table entries counted by the search, the quantization and the pruning.
+## usage: python3 -m pytest test_table_usage.py
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from table_usage import get_installed_tables, get_table_usage
+from voting_compiler import count_voting_entries
+
+FEATURE_NAMES = ["f0", "f1", "f2"]
+FEATURE_WIDTHS = [8, 8, 16]
+
+## small forest on seeded random flows, with thresholds beyond the 8 bit fields
+def get_forest(seed=0):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.integers(0, 600, (400, 3)), columns=FEATURE_NAMES)
+    y = (X["f0"] > 300).astype(int) + (X["f1"] + X["f2"] > 500)
+    return RandomForestClassifier(n_estimators=3, max_depth=5, random_state=seed).fit(X, y)
+
+def test_usage_counts_the_installed_entries():
+    forest = get_forest()
+    feature_tables, forest_leaves = get_installed_tables(forest, FEATURE_NAMES, FEATURE_WIDTHS)
+    usage = get_table_usage(forest, FEATURE_NAMES, FEATURE_WIDTHS)
+    assert usage == dict([("table_feature"+str(fea), len(table["Threshold"])) for fea, table in enumerate(feature_tables)]
+                         + [("code_table"+str(tree_id), len(leaves)) for tree_id, leaves in enumerate(forest_leaves)])
+    raw = get_table_usage(forest, FEATURE_NAMES, FEATURE_WIDTHS, minimize=False)
+    assert all(usage[table_name] <= raw[table_name] for table_name in raw)
+    assert sum(usage.values()) < sum(raw.values())
+
+def test_usage_of_the_voting_table():
+    forest = get_forest()
+    assert "voting_table" not in get_table_usage(forest, FEATURE_NAMES, FEATURE_WIDTHS)
+    for ternary_voting in [True, False]:
+        usage = get_table_usage(forest, FEATURE_NAMES, FEATURE_WIDTHS, ternary_voting=ternary_voting)
+        assert usage["voting_table"] == count_voting_entries(3, 3, ternary_voting)
@@ -0,0 +1,84 @@
+## Compiler of the voting table entries.
+## The exact voting table needs one entry per combination of the classes voted
+## by the trees, i.e. num_of_classes ** num_of_trees entries. The ternary voting
+## table only lists, for every class, the sets of trees that agree on it and
+## wildcards the other trees. Entries with more agreeing trees get a higher
+## priority (lower MATCH_PRIORITY), so the first entry hit gives the class voted
+## by the most trees. When no two trees agree, the class of the first tree is used.
+from itertools import combinations, product
+from statistics import mode
+from math import comb
+import numpy as np
+
+## the class fields of the voting table are bit<8>
+CLASS_MASK = 0xff
+
+## get the class voted by the majority of the trees, ties are broken at random
+def majority_vote(votes):
+    counts = [votes.count(vote) for vote in votes]
+    tied = [vote for vote, count in zip(votes, counts) if count == max(counts)]
+    if len(set(tied)) > 1:
+        return np.random.choice(tied)
+    return mode(votes)
+
+## exact entries: (classes voted by the trees, class_result)
+def get_exact_voting_entries(num_of_trees, num_of_classes):
+    for votes in product(range(1, num_of_classes+1), repeat=num_of_trees):
+        yield list(votes), majority_vote(list(votes))
+
+## ternary entries: (classes, masks, priority, class_result)
+def get_ternary_voting_entries(num_of_trees, num_of_classes):
+    majority = num_of_trees // 2 + 1
+    priority = 0
+    # any vector with a majority matches one of the entries of the majority level,
+    # below the majority one level per number of agreeing trees
+    for agreeing in range(majority, 1, -1):
+        for trees in combinations(range(num_of_trees), agreeing):
+            masks = [CLASS_MASK if tree_id in trees else 0 for tree_id in range(num_of_trees)]
+            for classe in range(1, num_of_classes+1):
+                classes = [classe if tree_id in trees else 0 for tree_id in range(num_of_trees)]
+                yield classes, masks, priority, classe
+                priority += 1
+    # no two trees agree: keep the class of the first tree
+    masks = [CLASS_MASK] + [0]*(num_of_trees-1)
+    for classe in range(1, num_of_classes+1):
+        yield [classe] + [0]*(num_of_trees-1), masks, priority, classe
+        priority += 1
+
+## ternary entries of a strict majority of the trees only: a vector without a
+## majority misses the table (used by the early-exit phases, see early_exit.py)
+def get_majority_voting_entries(num_of_trees, num_of_classes):
+    majority = num_of_trees // 2 + 1
+    for classes, masks, priority, classe in get_ternary_voting_entries(num_of_trees, num_of_classes):
+        if masks.count(CLASS_MASK) >= majority:
+            yield classes, masks, priority, classe
+
+## number of voting table entries without generating them
+def count_voting_entries(num_of_trees, num_of_classes, ternary=True):
+    if not ternary:
+        return num_of_classes ** num_of_trees
+    majority = num_of_trees // 2 + 1
+    return num_of_classes * (sum(comb(num_of_trees, agreeing) for agreeing in range(2, majority+1)) + 1)
+
+## get the voting table entries, ternary or exact
+def get_voting_entries(num_of_trees, num_of_classes, ternary=True):
+    if ternary:
+        return get_ternary_voting_entries(num_of_trees, num_of_classes)
+    return get_exact_voting_entries(num_of_trees, num_of_classes)
+
+## write the voting table entries one by one, returns the number of entries written
+def write_voting_entries(entries_file, voting_entries, ternary=True):
+    count = 0
+    if ternary:
+        for classes, masks, priority, classe in voting_entries:
+            keys = ", ".join("class"+str(tree_id)+"="+str(value)+", class"+str(tree_id)+"_mask="+str(mask)
+                             for tree_id, (value, mask) in enumerate(zip(classes, masks)))
+            print("voting_table.add_with_set_final_class("+keys+", MATCH_PRIORITY="+str(priority)+
+                  ", class_result="+str(classe)+")", file=entries_file)
+            count += 1
+    else:
+        for classes, classe in voting_entries:
+            keys = ", ".join("class"+str(tree_id)+"="+str(value) for tree_id, value in enumerate(classes))
+            print("voting_table.add_with_set_final_class("+keys+", class_result="+str(classe)+")", file=entries_file)
+            count += 1
+    return count